@@ -0,0 +1,3 @@
+"""
+Micro benchmarks of the parsers, digest authentication and event dispatch, see __main__.py
+"""
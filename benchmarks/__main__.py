@@ -0,0 +1,44 @@
+"""
+Runs the benchmarks from the root of the repository:
+
+    python -m benchmarks                      runs all benchmarks
+    python -m benchmarks --filter parse_event runs the benchmarks with parse_event in their name
+    python -m benchmarks --save main          saves the results as the baseline named main
+    python -m benchmarks --compare main       compares the results to the baseline main, exits with 1 on regressions
+"""
+import argparse
+import sys
+
+from . import harness
+from .suite import all_benchmarks
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the Dahua integration")
+    parser.add_argument("--filter", help="only run the benchmarks with this in their name")
+    parser.add_argument("--save", metavar="NAME", help="save the results as the baseline NAME")
+    parser.add_argument("--compare", metavar="NAME", help="compare the results to the baseline NAME")
+    parser.add_argument("--threshold", type=float, default=harness.REGRESSION_THRESHOLD,
+                        help="the fraction slower or bigger that counts as a regression (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        baseline = harness.load_baseline(args.compare)
+        if baseline is None:
+            parser.error("there is no baseline named {0}".format(args.compare))
+
+    results = harness.run(all_benchmarks(), args.filter)
+    if args.save:
+        harness.save_baseline(args.save, results)
+        print("Saved the baseline {0}".format(harness.baseline_path(args.save)))
+    if baseline is not None:
+        regressions = harness.compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressed: {0}".format(", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
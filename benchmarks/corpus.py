@@ -0,0 +1,163 @@
+"""
+Realistic payloads for the benchmarks: event stream chunks, DHIP packets, getConfig bodies and digest challenges
+"""
+import json
+import struct
+
+# Event stream chunks as read from eventManager.cgi?action=attach, one multipart part per chunk
+_STREAM_PART = "--myboundary\r\nContent-Type: text/plain\r\nContent-Length:{0}\r\n\r\n{1}\r\n\r\n"
+
+
+def stream_chunk(body: str) -> str:
+    return _STREAM_PART.format(len(body), body)
+
+
+VIDEO_MOTION = stream_chunk(
+    'Code=VideoMotion;action=Start;index=0;data={\n'
+    '   "Id" : [ 0 ],\n'
+    '   "RegionName" : [ "Region1" ],\n'
+    '   "SmartMotionEnable" : false\n'
+    '}'
+)
+
+CROSS_LINE_DETECTION = stream_chunk(
+    "Code=CrossLineDetection;action=Start;index=0;data=" + json.dumps({
+        "Class": "Normal",
+        "DetectLine": [[18, 4098], [8155, 5549]],
+        "Direction": "RightToLeft",
+        "EventSeq": 40,
+        "FrameSequence": 549073,
+        "GroupID": 40,
+        "Mark": 0,
+        "Name": "Rule1",
+        "Object": {
+            "Action": "Appear",
+            "BoundingBox": [4816, 4552, 5248, 5272],
+            "Center": [5032, 4912],
+            "Confidence": 0,
+            "FrameSequence": 0,
+            "ObjectID": 542,
+            "ObjectType": "Human",
+            "RelativeID": 0,
+            "Source": 0.0,
+            "Speed": 0,
+            "SpeedTypeInternal": 0,
+        },
+        "PTS": 42986015370.0,
+        "RuleId": 1,
+        "Source": 51190936.0,
+        "Track": None,
+        "UTC": 1620477656,
+        "UTCMS": 180,
+    }, indent=3)
+)
+
+VIDEO_MOTION_INFO = stream_chunk(
+    "Code=VideoMotionInfo;action=State;index=0;data=" + json.dumps({
+        "Id": 0,
+        "Region": [4194303, 4194303, 4128767, 3997695, 3801087, 3801087, 3932159, 3407871, 3932159, 3932158, 3932156,
+                   3735548, 3678204, 2101244, 2047, 2097663, 3146239, 524799],
+        "RegionName": "Region1",
+        "State": "Active",
+        "Threshold": 54,
+    }, indent=3)
+)
+
+# An event nobody listens to, skipped by the accept function before the event is created
+NEW_FILE = stream_chunk(
+    'Code=NewFile;action=Pulse;index=0;data={\n'
+    '   "File" : "/mnt/sd/2021-05-08/001/dav/11/11.12.13-11.12.43[M][0@0][0].dav",\n'
+    '   "Size" : 2834113\n'
+    '}'
+)
+
+EVENT_STREAM_CHUNKS = {
+    "video_motion": VIDEO_MOTION,
+    "cross_line_detection": CROSS_LINE_DETECTION,
+    "video_motion_info": VIDEO_MOTION_INFO,
+    "new_file_skipped": NEW_FILE,
+}
+
+
+def dhip_packet(message: dict) -> bytes:
+    """ Returns a DHIP packet as sent by a VTO, see DahuaVTOClient.convert_message """
+    payload = json.dumps(message).encode("utf-8")
+    header = struct.pack(">L", 0x20000000) + struct.pack(">L", 0x44484950) + struct.pack(">d", 0)
+    header += struct.pack("<L", len(payload)) + struct.pack("<L", 0) + struct.pack("<L", len(payload))
+    header += struct.pack("<L", 0)
+    return header + payload + b"\n"
+
+
+def _notify_event_stream(*events: dict) -> dict:
+    return {"id": 8, "method": "client.notifyEventStream", "params": {"SID": 513, "eventList": list(events)},
+            "session": 1722306858}
+
+
+_DOOR_STATUS = {"Action": "Pulse", "Code": "DoorStatus", "Index": 0,
+                "Data": {"LocaleTime": "2021-04-11 21:34:52", "Status": "Close", "UTC": 1618148092}}
+_BACK_KEY_LIGHT = {"Action": "Pulse", "Code": "BackKeyLight", "Index": -1,
+                   "Data": {"LocaleTime": "2021-06-20 13:52:20", "State": 1, "UTC": 1624168340.0}}
+_INTELLI_FRAME = {"Action": "Pulse", "Code": "IntelliFrame", "Index": 0,
+                  "Data": {"Class": "Normal", "Event": "IntelliFrame", "PTS": 43380319830.0, "UTC": 1620477656}}
+
+DHIP_PACKETS = {
+    "door_status": dhip_packet(_notify_event_stream(_DOOR_STATUS)),
+    "two_packets": dhip_packet(_notify_event_stream(_BACK_KEY_LIGHT)) + dhip_packet(_notify_event_stream(_DOOR_STATUS)),
+    "keep_alive_response": dhip_packet({"id": 5, "params": {"timeout": 55}, "result": True, "session": 1722306858}),
+    "intelli_frame_skipped": dhip_packet(_notify_event_stream(_INTELLI_FRAME)),
+}
+
+
+def _video_analyse_rules(rules: int) -> str:
+    """ A getConfig&name=VideoAnalyseRule body with the given number of rules """
+    lines = []
+    for rule in range(rules):
+        prefix = "table.VideoAnalyseRule[0][{0}]".format(rule)
+        lines.extend([
+            "{0}.Class=Normal".format(prefix),
+            "{0}.Config.AreaType=Line".format(prefix),
+            "{0}.Config.Direction=Both".format(prefix),
+            "{0}.Config.DetectLine[0][0]=18".format(prefix),
+            "{0}.Config.DetectLine[0][1]=4098".format(prefix),
+            "{0}.Config.DetectLine[1][0]=8155".format(prefix),
+            "{0}.Config.DetectLine[1][1]=5549".format(prefix),
+            "{0}.Config.FeatureEnable=false".format(prefix),
+            "{0}.Config.SizeFilter.FilterType=ByLength".format(prefix),
+            "{0}.Enable=true".format(prefix),
+            "{0}.EventHandler.AlarmOutEnable=false".format(prefix),
+            "{0}.EventHandler.Dejitter=0".format(prefix),
+            "{0}.EventHandler.RecordChannels[0]=0".format(prefix),
+            "{0}.EventHandler.RecordEnable=true".format(prefix),
+            "{0}.EventHandler.SnapshotEnable=true".format(prefix),
+            "{0}.EventHandler.TimeSection[0][0]=1 00:00:00-23:59:59".format(prefix),
+            "{0}.EventHandler.VoiceEnable=false".format(prefix),
+            "{0}.Id={1}".format(prefix, rule + 1),
+            "{0}.Name=Rule{1}".format(prefix, rule + 1),
+            "{0}.ObjectTypes[0]=Human".format(prefix),
+            "{0}.ObjectTypes[1]=Vehicle".format(prefix),
+            "{0}.PtzPresetId=0".format(prefix),
+            "{0}.Type=CrossLineDetection".format(prefix),
+        ])
+    return "\r\n".join(lines) + "\r\n"
+
+
+API_RESPONSES = {
+    "system_info": "\r\n".join([
+        "appAutoStart=true",
+        "deviceType=IPC-HDW5831R-ZE",
+        "hardwareVersion=1.00",
+        "processor=S3LM",
+        "serialNumber=4X7C5A1ZAG21L3F",
+        "updateSerial=IPC-HDW5830R-Z",
+    ]) + "\r\n",
+    "video_analyse_rules_8": _video_analyse_rules(8),
+    "video_analyse_rules_64": _video_analyse_rules(64),
+}
+
+DIGEST_CHALLENGES = {
+    "md5_qop": {"realm": "Login to 4X7C5A1ZAG21L3F", "nonce": "1380436349", "qop": "auth",
+                "opaque": "6b6a4e3f2a1b0c9d8e7f6a5b4c3d2e1f0a9b8c7d"},
+    "md5_no_qop": {"realm": "Login to 4X7C5A1ZAG21L3F", "nonce": "1380436349"},
+}
+
+DIGEST_URL = "http://192.168.1.108:80/cgi-bin/configManager.cgi?action=getConfig&name=VideoAnalyseRule"
@@ -0,0 +1,147 @@
+"""
+Runs benchmarks, reporting operations per second and allocations per operation, and compares them to saved baselines
+"""
+import gc
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+# Each benchmark runs this many rounds of at least ROUND_SECONDS, the best round counts
+ROUNDS = 5
+ROUND_SECONDS = 0.2
+# Allocations are traced over this many operations
+ALLOCATION_OPS = 50
+# A benchmark this much slower (or allocating this much more) than its baseline is a regression
+REGRESSION_THRESHOLD = 0.10
+
+BASELINE_DIRECTORY = os.path.join(os.path.dirname(__file__), "baselines")
+
+
+class Benchmark:
+    """ A named operation, a function without arguments doing the work once """
+    __slots__ = ("name", "func")
+
+    def __init__(self, name: str, func: Callable[[], object]):
+        self.name = name
+        self.func = func
+
+
+def run_sync(coroutine):
+    """ Runs a coroutine that never suspends (like parse_dahua_api_response) without an event loop """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("The coroutine suspended")
+
+
+def _calibrate(func: Callable[[], object]) -> int:
+    """ Returns how many operations take at least ROUND_SECONDS """
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - started >= ROUND_SECONDS:
+            return loops
+        loops *= 2
+
+
+def measure(benchmark: Benchmark) -> dict:
+    """ Returns the best operations per second of ROUNDS rounds and the bytes and blocks allocated per operation """
+    func = benchmark.func
+    func()
+    loops = _calibrate(func)
+    best = 0.0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            for _ in range(loops):
+                func()
+            elapsed = time.perf_counter() - started
+            best = max(best, loops / elapsed)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    # Everything allocated during the operations, including what was freed right away
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(ALLOCATION_OPS):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0)
+    return {
+        "ops_per_sec": round(best, 1),
+        "peak_bytes": peak,
+        "retained_blocks_per_op": round(retained / ALLOCATION_OPS, 2),
+    }
+
+
+def run(benchmarks: List[Benchmark], pattern: Optional[str] = None) -> Dict[str, dict]:
+    """ Measures the benchmarks whose name contains pattern, all of them by default """
+    results = {}
+    for benchmark in benchmarks:
+        if pattern is not None and pattern not in benchmark.name:
+            continue
+        results[benchmark.name] = measure(benchmark)
+        print_result(benchmark.name, results[benchmark.name])
+    return results
+
+
+def print_result(name: str, result: dict, baseline: Optional[dict] = None):
+    line = "{0:<48} {1:>14,.1f} ops/s {2:>10,} peak B".format(name, result["ops_per_sec"], result["peak_bytes"])
+    if baseline is not None:
+        line += "  {0:+.1%} ops/s {1:+.1%} peak".format(*_changes(result, baseline))
+    print(line)
+
+
+def _changes(result: dict, baseline: dict):
+    speed = result["ops_per_sec"] / baseline["ops_per_sec"] - 1 if baseline["ops_per_sec"] else 0.0
+    memory = result["peak_bytes"] / baseline["peak_bytes"] - 1 if baseline["peak_bytes"] else 0.0
+    return speed, memory
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIRECTORY, name + ".json")
+
+
+def save_baseline(name: str, results: Dict[str, dict]):
+    """ Saves the results as the named baseline, merged into the benchmarks already in it """
+    baseline = load_baseline(name) or {}
+    baseline.update(results)
+    os.makedirs(BASELINE_DIRECTORY, exist_ok=True)
+    with open(baseline_path(name), "w", encoding="utf-8") as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def load_baseline(name: str) -> Optional[Dict[str, dict]]:
+    try:
+        with open(baseline_path(name), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """ Prints the results against the baseline and returns the names of the benchmarks that regressed """
+    regressions = []
+    print()
+    for name, result in results.items():
+        if name not in baseline:
+            print_result(name, result)
+            continue
+        print_result(name, result, baseline[name])
+        speed, memory = _changes(result, baseline[name])
+        if speed < -threshold or memory > threshold:
+            regressions.append(name)
+    return regressions
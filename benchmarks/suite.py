@@ -0,0 +1,105 @@
+"""
+The benchmarks of the hot paths: parsing the event stream, VTO packets and API responses, building digest headers and
+dispatching events
+"""
+from typing import List
+
+from custom_components.dahua import DahuaDataUpdateCoordinator
+from custom_components.dahua.client import DahuaClient
+from custom_components.dahua.dahua_utils import parse_event
+from custom_components.dahua.digest import DigestAuth
+from custom_components.dahua.event_registry import DahuaEventRegistry
+from custom_components.dahua.models import DahuaEvent
+from custom_components.dahua.vto import DahuaVTOClient
+
+from . import corpus
+from .harness import Benchmark, run_sync
+
+# The event codes a typical camera has binary sensors for
+WANTED_CODES = frozenset(("VideoMotion", "CrossLineDetection", "CrossRegionDetection", "VideoMotionInfo",
+                          "BackKeyLight", "DoorStatus", "AlarmLocal", "AudioMutation"))
+
+
+def _accept(code: str, action: str, index: int) -> bool:
+    """ The accept function of parse_event, the same checks as DahuaDataUpdateCoordinator.is_event_wanted """
+    return index == 0 and code in WANTED_CODES
+
+
+def _event_filter(code: str) -> bool:
+    return code in WANTED_CODES
+
+
+def _coordinator(registry: DahuaEventRegistry) -> DahuaDataUpdateCoordinator:
+    """ A coordinator with only what translate_event_code and get_event_key use, no Home Assistant needed """
+    coordinator = DahuaDataUpdateCoordinator.__new__(DahuaDataUpdateCoordinator)
+    coordinator._event_registry = registry
+    coordinator._channel = 0
+    return coordinator
+
+
+def event_stream_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for name, chunk in corpus.EVENT_STREAM_CHUNKS.items():
+        benchmarks.append(Benchmark("parse_event." + name, lambda chunk=chunk: parse_event(chunk, _accept)))
+
+    # Parsing and decoding the data, as happens for every event something listens to
+    def parse_and_decode(chunk=corpus.CROSS_LINE_DETECTION):
+        for event in parse_event(chunk, _accept):
+            event.data_dict()
+
+    benchmarks.append(Benchmark("parse_event.cross_line_detection_decoded", parse_and_decode))
+    return benchmarks
+
+
+def vto_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for name, packet in corpus.DHIP_PACKETS.items():
+        benchmarks.append(Benchmark("vto.parse_response." + name,
+                                    lambda packet=packet: DahuaVTOClient.parse_response(packet, _event_filter)))
+    return benchmarks
+
+
+def api_response_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for name, body in corpus.API_RESPONSES.items():
+        benchmarks.append(Benchmark("parse_dahua_api_response." + name,
+                                    lambda body=body: run_sync(DahuaClient.parse_dahua_api_response(body))))
+    return benchmarks
+
+
+def digest_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for name, challenge in corpus.DIGEST_CHALLENGES.items():
+        auth = DigestAuth("admin", "password", None, {"challenge": challenge})
+        benchmarks.append(Benchmark("digest.build_header." + name,
+                                    lambda auth=auth: auth._build_digest_header("GET", corpus.DIGEST_URL)))
+    return benchmarks
+
+
+def dispatch_benchmarks() -> List[Benchmark]:
+    registry = DahuaEventRegistry()
+    coordinator = _coordinator(registry)
+    for code in WANTED_CODES | {"SmartMotionHuman", "DoorbellPressed"}:
+        registry.subscribe(code, 0, lambda event: None)
+
+    motion = parse_event(corpus.VIDEO_MOTION, _accept)[0]
+    cross_line_data = parse_event(corpus.CROSS_LINE_DETECTION, _accept)[0]._raw_data
+
+    def translate_and_dispatch(event: DahuaEvent):
+        event.set_event_name(coordinator.translate_event_code(event))
+        registry.dispatch(event, True)
+
+    def cross_line():
+        # A new event every time, so the data is decoded to find out if the object is a human
+        translate_and_dispatch(DahuaEvent("CrossLineDetection", 0, "Start", raw_data=cross_line_data))
+
+    return [
+        Benchmark("dispatch.get_event_key", lambda: coordinator.get_event_key("VideoMotion")),
+        Benchmark("dispatch.video_motion", lambda: translate_and_dispatch(motion)),
+        Benchmark("dispatch.cross_line_detection_human", cross_line),
+    ]
+
+
+def all_benchmarks() -> List[Benchmark]:
+    return (event_stream_benchmarks() + vto_benchmarks() + api_response_benchmarks() + digest_benchmarks()
+            + dispatch_benchmarks())
@@ -2,7 +2,7 @@
 Custom integration to integrate Dahua cameras with Home Assistant.
 """
 import asyncio
-from typing import Any, Dict
+from typing import Any, Collection, Dict, Optional
 import logging
 import time
 
@@ -13,11 +13,14 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import CALLBACK_TYPE, Config, HomeAssistant
 from homeassistant.exceptions import ConfigEntryNotReady, PlatformNotReady
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
 from homeassistant.const import EVENT_HOMEASSISTANT_STOP
 
 from custom_components.dahua.thread import DahuaEventThread, DahuaVtoEventThread
-from . import dahua_utils
+from . import dahua_utils, tracing
 from .client import DahuaClient
 
 from .const import (
@@ -32,12 +35,83 @@ from .const import (
     CONF_RTSP_PORT,
     STARTUP_MESSAGE,
     CONF_CHANNEL,
+    CONF_DEDUP_GROUP,
+    CONF_PUBLISH_POLICIES,
+    CONF_PAYLOAD_FIELDS,
+    CONF_SLIM_PAYLOADS,
+    CONF_MOTION_ZONES,
+    CONF_OBJECT_COUNTERS,
+    CONF_OCCUPANCY,
+    CONF_RULES,
+    CONF_SPATIAL_ZONES,
+    CONF_JOURNAL,
+    CONF_TRACING,
+    SIGNAL_EVENTS_UPDATED,
 )
-from .dahua_utils import parse_event
+from .counters import COUNTER_CODES, ObjectCounters
+from .dahua_utils import parse_event, peek_event_codes, peek_event_index
+from .dedup import get_event_deduplicator
+from .event_queue import DahuaEventQueue
+from .event_registry import DahuaEventRegistry, EventState
+from .frames import FRAME_DHIP_IN, FRAME_DHIP_OUT, FRAME_EVENT_STREAM, FrameRecorder
+from .health import HEALTH_UPDATE_SECONDS, DeviceHealth
+from .history import EventHistory, EventRecord
+from .journal import EventJournal, get_event_journal
+from .latency import LatencyTracker, parse_device_time
+from .models import DahuaEvent, EventAction, EVENT_SOURCE_EXPIRED, EVENT_SOURCE_STREAM, EVENT_SOURCE_VTO
+from .liveness import DeviceLiveness, EVENT_STREAM_TIMEOUT_SECONDS, VTO_TIMEOUT_SLACK_SECONDS
+from .motion_grid import (
+    MotionGrid, MOTION_GRID_CODES, MOTION_GRID_TIMEOUT_SECONDS, extract_row_masks, parse_motion_zones,
+)
+from .occupancy import OCCUPANCY_CODES, SWEEP_SECONDS, OccupancyTracker
+from .payload import PayloadProjector, parse_payload_fields
+from .profiler import async_register_profiler_services
+from .publisher import EventPublisher, parse_publish_policies
+from .rules import RULE_EVENT_PREFIX, RuleEngine, parse_rules
+from .timer_wheel import WheelTimer, get_timer_wheel
+from .tracing import TraceStats, acquire_trace_stats, release_trace_stats
 from .vto import DahuaVTOClient
+from .zones import ZONE_CODES, ZONE_EVENT_PREFIX, SpatialZoneIndex, parse_spatial_zones
 
 SCAN_INTERVAL_SECONDS = timedelta(seconds=30)
 
+# How often we check if the device is still sending heartbeats
+LIVENESS_CHECK_INTERVAL = timedelta(seconds=2)
+# How often the health counters are sampled for the health sensors
+HEALTH_UPDATE_INTERVAL = timedelta(seconds=HEALTH_UPDATE_SECONDS)
+# The event names an event code might be translated into by translate_event_code, including the code itself
+EVENT_CODE_TRANSLATIONS = {
+    "CrossLineDetection": ("CrossLineDetection", "SmartMotionHuman"),
+    "CrossRegionDetection": ("CrossRegionDetection", "SmartMotionHuman"),
+    "BackKeyLight": ("DoorbellPressed",),
+    "PhoneCallDetect": ("DoorbellPressed",),
+}
+
+# An event that started but didn't stop after this many seconds is cleared. Some streams drop between Start and Stop
+# and we'd never see the Stop. Codes mapped to None describe a state that can legitimately last forever
+DEFAULT_EVENT_MAX_DURATION_SECONDS = 600
+EVENT_MAX_DURATION_SECONDS = {
+    "AlarmLocal": None,
+    "VideoLoss": None,
+    "VideoBlind": None,
+    "StorageNotExist": None,
+    "StorageFailure": None,
+    "StorageLowSpace": None,
+    "FireWarning": None,
+    "DoorStatus": None,
+}
+# Pulse events have no Stop, they're active for this many seconds. DoorStatus is closed by its own pulse
+DEFAULT_PULSE_HOLD_SECONDS = 5
+EVENT_PULSE_HOLD_SECONDS = {
+    "DoorStatus": None,
+}
+# After the event stream or VTO reconnected, events that were active before the disconnect are cleared after this many
+# seconds unless the device reports them again. They might have stopped while we weren't connected
+RECONNECT_GRACE_SECONDS = 10
+
+# While the device isn't sending heartbeats we skip polls, but still try every nth poll in case only the stream is broken
+MAX_SKIPPED_POLLS = 3
+
 _LOGGER: logging.Logger = logging.getLogger(__package__)
 
 
@@ -47,6 +121,7 @@ async def async_setup(hass: HomeAssistant, config: Config):
     https://developers.home-assistant.io/docs/asyncio_working_with_async/
     """
     hass.data.setdefault(DOMAIN, {})
+    async_register_profiler_services(hass)
     return True
 
 
@@ -61,12 +136,14 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     address = entry.data.get(CONF_ADDRESS)
     port = int(entry.data.get(CONF_PORT))
     rtsp_port = int(entry.data.get(CONF_RTSP_PORT))
-    events = entry.data.get(CONF_EVENTS)
+    # Events can be changed later on in the options
+    events = entry.options.get(CONF_EVENTS, entry.data.get(CONF_EVENTS))
     name = entry.data.get(CONF_NAME)
     channel = entry.data.get(CONF_CHANNEL, 0)
 
     coordinator = DahuaDataUpdateCoordinator(hass, events=events, address=address, port=port, rtsp_port=rtsp_port,
                                              username=username, password=password, name=name, channel=channel)
+    coordinator.apply_options(entry.options)
     await coordinator.async_config_entry_first_refresh()
 
     if not coordinator.last_update_success:
@@ -82,7 +159,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
                 hass.config_entries.async_forward_entry_setup(entry, platform)
             )
 
-    entry.add_update_listener(async_reload_entry)
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
 
     entry.async_on_unload(
         hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, coordinator.async_stop)
@@ -131,39 +208,237 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
         # This is the name as reported from the camera itself
         self.machine_name = ""
 
-        # This thread is what connects to the cameras event stream and fires on_receive when there's an event
-        self.dahua_event_thread = DahuaEventThread(hass, self.client, self.on_receive, events, self._channel)
-
-        # This thread will connect to VTO devices (Dahua doorbells)
-        self.dahua_vto_event_thread = DahuaVtoEventThread(hass, self.client, self.on_receive_vto_event, host=address,
-                                                          port=5000, username=username, password=password)
+        # Events read from the device are queued here and processed by a separate task so bursts of events don't block
+        # the readers. on_receive and on_receive_vto_event are called from that task
+        self._event_queue = DahuaEventQueue(hass, address)
 
-        # A dictionary of event name (CrossLineDetection, VideoMotion, etc) to a listener for that event
-        # The key will be formed from self.get_event_key(event_name) and includes the channel
-        self._dahua_event_listeners: Dict[str, CALLBACK_TYPE] = dict()
+        # This thread is what connects to the cameras event stream and queues the data it receives
+        self.dahua_event_thread = DahuaEventThread(hass, self.client, self.enqueue_stream_data, events, self._channel)
 
-        # A dictionary of event name (CrossLineDetection, VideoMotion, etc) to the time the event fire or was cleared.
-        # If cleared the time will be 0. The time unit is seconds epoch
-        self._dahua_event_timestamp: Dict[str, int] = dict()
+        # This thread will connect to VTO devices (Dahua doorbells)
+        self.dahua_vto_event_thread = DahuaVtoEventThread(hass, self.client, self.enqueue_vto_event, host=address,
+                                                          port=5000, username=username, password=password,
+                                                          on_alive=self.on_vto_alive,
+                                                          event_filter=self.is_event_code_wanted,
+                                                          on_frame=self.on_vto_frame)
+
+        # Tells if the device is alive based on event stream heartbeats and VTO keep alives. Combined with the poll
+        # results to determine if entities are available
+        self._liveness = DeviceLiveness()
+        self._skipped_polls = 0
+        self._unsub_liveness_check: CALLBACK_TYPE = None
+        # Poll durations, request errors and events per code for the health sensors
+        self._health = DeviceHealth()
+        self._unsub_health_sample: CALLBACK_TYPE = None
+
+        # Listeners for events (CrossLineDetection, VideoMotion, etc) and the state of each event (active, since when,
+        # last event). Keyed by self.get_event_key(event_name) which includes the channel
+        self._event_registry = DahuaEventRegistry()
+        # The recent events of the device, indexed by event and channel for the query_events service and attributes
+        self._history = EventHistory()
+        # Suppresses events already fired by another device of the same dedup group (see apply_options). Shared by all
+        # devices
+        self._event_deduplicator = get_event_deduplicator(hass)
+        self._dedup_group: Optional[str] = None
+        # Fires the events on the HA event bus according to the publish policy of their code
+        self._publisher = EventPublisher(hass, self.get_device_name)
+        # The motion detection grid from VideoMotionInfo and MDResult events, only decoded when zones are configured
+        self._motion_grid = MotionGrid()
+        self._motion_grid_timer: Optional[WheelTimer] = None
+        # Line crossing and intrusion counts, None unless enabled in the options
+        self._object_counters: Optional[ObjectCounters] = None
+        # The objects in IVS areas and the occupancy of each area, None unless enabled in the options
+        self._occupancy: Optional[OccupancyTracker] = None
+        self._occupancy_timer: Optional[WheelTimer] = None
+        # Local rules that drop events or drive rule sensors, None if there are no rules
+        self._rules: Optional[RuleEngine] = None
+        # Polygons and lines the objects of IVS events are matched against, None if there are no zones
+        self._spatial_zones: Optional[SpatialZoneIndex] = None
+        # Rule and zone sensors turned on by an event, by the event's (code, index). The Stop of the event turns them
+        # off even when it doesn't match the rule or zone anymore
+        self._derived_events: Dict[tuple, set] = {}
+        # Writes the received events to disk for incident review, shared by all devices. None unless enabled
+        self._journal: Optional[EventJournal] = None
+        # How long events take from the device to our entities, by stage, and the device clock offset
+        self._latency = LatencyTracker()
+        # Span stats of requests, parsing and dispatch, shared by all devices. None unless enabled
+        self._trace_stats: Optional[TraceStats] = None
+        # The last raw frames of the event stream and VTO, for diagnostics
+        self._frames = FrameRecorder()
+
+        # Clears events that didn't stop in time and pulse events. The wheel is shared by all devices, the timers of
+        # this device are kept by event key
+        self._timer_wheel = get_timer_wheel(hass)
+        self._event_timers: Dict[tuple, WheelTimer] = {}
+        # The connect counts of the event stream and VTO seen by _async_reconcile_events, to notice reconnects
+        self._connect_counts = {EVENT_SOURCE_STREAM: 0, EVENT_SOURCE_VTO: 0}
 
         super().__init__(hass, _LOGGER, name=DOMAIN, update_interval=SCAN_INTERVAL_SECONDS)
 
+    def apply_options(self, options: dict):
+        """ Applies the options that can change without reloading the device """
+        self._dedup_group = options.get(CONF_DEDUP_GROUP) or None
+        try:
+            self._publisher.set_policies(parse_publish_policies(options.get(CONF_PUBLISH_POLICIES, "")))
+        except ValueError as exception:
+            _LOGGER.warning("Ignoring invalid publish policies for %s: %s", self._address, exception)
+        try:
+            projections = parse_payload_fields(options.get(CONF_PAYLOAD_FIELDS, ""))
+        except ValueError as exception:
+            _LOGGER.warning("Ignoring invalid payload fields for %s: %s", self._address, exception)
+            projections = {}
+        self._publisher.set_payload_projector(PayloadProjector(projections, options.get(CONF_SLIM_PAYLOADS, False)))
+        try:
+            self._motion_grid.set_zones(parse_motion_zones(options.get(CONF_MOTION_ZONES, "")))
+        except ValueError as exception:
+            _LOGGER.warning("Ignoring invalid motion zones for %s: %s", self._address, exception)
+        if options.get(CONF_OBJECT_COUNTERS, False):
+            if self._object_counters is None:
+                self._object_counters = ObjectCounters()
+        else:
+            self._object_counters = None
+        if options.get(CONF_OCCUPANCY, False):
+            if self._occupancy is None:
+                self._occupancy = OccupancyTracker()
+        else:
+            self._occupancy = None
+        try:
+            rules = parse_rules(options.get(CONF_RULES, ""))
+        except ValueError as exception:
+            _LOGGER.warning("Ignoring invalid rules for %s: %s", self._address, exception)
+            rules = []
+        self._rules = RuleEngine(rules) if rules else None
+        try:
+            spatial_zones = parse_spatial_zones(options.get(CONF_SPATIAL_ZONES, ""))
+        except ValueError as exception:
+            _LOGGER.warning("Ignoring invalid spatial zones for %s: %s", self._address, exception)
+            spatial_zones = {}
+        self._spatial_zones = SpatialZoneIndex(spatial_zones) if spatial_zones else None
+        self._journal = get_event_journal(self.hass) if options.get(CONF_JOURNAL, False) else None
+        if options.get(CONF_TRACING, False):
+            self._trace_stats = acquire_trace_stats(self.hass, self)
+        elif self._trace_stats is not None:
+            release_trace_stats(self.hass, self)
+            self._trace_stats = None
+
     async def async_start_event_listener(self):
         """ Starts the event listeners for IP cameras (this does not work for doorbells (VTO)) """
         if self.events is not None:
+            self._event_queue.start()
             self.dahua_event_thread.start()
 
     async def async_start_vto_event_listener(self):
         """ Starts the event listeners for doorbells (VTO). This will not work for IP cameras"""
         if self.dahua_vto_event_thread is not None:
+            self._event_queue.start()
             self.dahua_vto_event_thread.start()
 
+    async def async_set_events(self, events: list):
+        """
+        Changes the events we listen to without reloading the device. The event stream is resubscribed make before
+        break so no events are lost while switching over
+        """
+        self.events = events
+        if self.dahua_event_thread.started:
+            self.dahua_event_thread.resubscribe(events)
+        elif self.initialized and not self.is_doorbell() and self.dahua_event_thread.ident is None:
+            # We weren't listening to any events before
+            self.dahua_event_thread.events = events
+            await self.async_start_event_listener()
+
     async def async_stop(self, event: Any):
         """ Stop anything we need to stop """
         self.dahua_event_thread.stop()
         self.dahua_vto_event_thread.stop()
+        self._event_queue.stop()
+        self._publisher.stop()
+        for timer in self._event_timers.values():
+            timer.cancel()
+        self._event_timers.clear()
+        if self._motion_grid_timer is not None:
+            self._motion_grid_timer.cancel()
+            self._motion_grid_timer = None
+        if self._occupancy_timer is not None:
+            self._occupancy_timer.cancel()
+            self._occupancy_timer = None
+        if self._unsub_liveness_check is not None:
+            self._unsub_liveness_check()
+            self._unsub_liveness_check = None
+        if self._unsub_health_sample is not None:
+            self._unsub_health_sample()
+            self._unsub_health_sample = None
+        if self._trace_stats is not None:
+            release_trace_stats(self.hass, self)
+            self._trace_stats = None
+        if self._journal is not None:
+            # Make sure the events we got are on disk
+            await self._journal.async_flush()
+
+    async def _async_check_liveness(self, now=None):
+        """ Called every few seconds to flip entity availability as soon as the device stops sending heartbeats """
+        changed = self._liveness.check()
+        alive = self._liveness.is_alive()
+        self._async_reconcile_events()
+
+        if alive is False:
+            # A half open connection would hang forever, so reconnect if the stream is up but silent
+            supervisor = self.dahua_event_thread.supervisor
+            connected_since = supervisor.connected_since
+            if connected_since is not None and time.time() - connected_since > EVENT_STREAM_TIMEOUT_SECONDS:
+                self.dahua_event_thread.abort_stream(
+                    TimeoutError("No heartbeat from {0} in {1} seconds".format(self._address,
+                                                                               EVENT_STREAM_TIMEOUT_SECONDS)))
+
+        if changed:
+            if alive is False:
+                _LOGGER.warning("Dahua device at %s stopped sending heartbeats, marking it unavailable", self._address)
+            elif alive:
+                _LOGGER.info("Dahua device at %s is sending heartbeats again", self._address)
+            self._async_notify_listeners()
+
+    def _async_reconcile_events(self):
+        """
+        After the event stream or VTO reconnected, events that were active before the disconnect might have stopped while
+        we weren't connected. These are cleared after a grace period unless the device reports them again
+        """
+        links = ((EVENT_SOURCE_STREAM, self.dahua_event_thread.supervisor),
+                 (EVENT_SOURCE_VTO, self.dahua_vto_event_thread.supervisor))
+        for source, supervisor in links:
+            connect_count = supervisor.connect_count
+            if connect_count == self._connect_counts[source]:
+                continue
+            self._connect_counts[source] = connect_count
+            connected_since = supervisor.connected_since
+            if connect_count < 2 or connected_since is None:
+                continue
+
+            for key, state in self._event_registry.states().items():
+                if not state.active or state.last_event.source != source or state.last_event_time >= connected_since:
+                    continue
+                timer = self._event_timers.get(key)
+                if timer is None or timer.remaining() > RECONNECT_GRACE_SECONDS:
+                    _LOGGER.debug("%s on %s was active before reconnecting, clearing it in %s seconds unless it fires "
+                                  "again", key[0], self._address, RECONNECT_GRACE_SECONDS)
+                    self._schedule_event_expiry(key, RECONNECT_GRACE_SECONDS)
+
+    def _async_notify_listeners(self):
+        """ Tells all entities to write their state, for example because the availability changed """
+        if hasattr(self, "async_update_listeners"):
+            self.async_update_listeners()
+        else:
+            # Older versions of Home Assistant
+            for update_callback in list(self._listeners):
+                update_callback()
 
     async def _async_update_data(self):
+        """Reload the camera information, the duration of the poll is kept for the health sensors"""
+        started = time.monotonic()
+        try:
+            return await self._async_poll_device()
+        finally:
+            self._health.poll_done(time.monotonic() - started)
+
+    async def _async_poll_device(self):
         """Reload the camera information"""
         data = {}
 
@@ -264,12 +539,22 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
                     # Start the event listeners for doorbells (VTO)
                     await self.async_start_vto_event_listener()
 
+                self._unsub_liveness_check = async_track_time_interval(self.hass, self._async_check_liveness,
+                                                                       LIVENESS_CHECK_INTERVAL)
+                self._unsub_health_sample = async_track_time_interval(self.hass, self._async_sample_health,
+                                                                      HEALTH_UPDATE_INTERVAL)
                 self.initialized = True
             except Exception as exception:
                 _LOGGER.error("Failed to initialize device at %s", self._address, exc_info=exception)
                 raise PlatformNotReady("Dahua device at " + self._address + " isn't fully initialized yet")
 
         # This is the event loop code that's called every n seconds
+        if self._liveness.is_alive() is False and self._skipped_polls < MAX_SKIPPED_POLLS:
+            # The device stopped sending heartbeats, don't wait for the request timeouts
+            self._skipped_polls += 1
+            raise UpdateFailed("Dahua device at " + self._address + " is not sending heartbeats, skipping poll")
+        self._skipped_polls = 0
+
         try:
             # We need the profile mode (0=day, 1=night, 2=scene)
             if self._supports_profile_mode and not self.is_doorbell():
@@ -313,6 +598,13 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
                 if light_v2 is not None:
                     data.update(light_v2)
 
+            if self._latency.should_read_clock():
+                await self._async_read_clock()
+
+            if self._liveness.is_alive() is False:
+                # The device answers but the heartbeats are missing, so only the stream is broken. Go by the poll
+                # results until heartbeats arrive again
+                self._liveness.reset()
             return data
         except Exception as exception:
             _LOGGER.warning("Failed to sync device state for %s. See README to enable debug logs to get full exception",
@@ -320,10 +612,124 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
             _LOGGER.debug("Failed to sync device state for %s", self._address, exc_info=exception)
             raise UpdateFailed() from exception
 
-    def on_receive_vto_event(self, event: dict):
-        event["DeviceName"] = self.get_device_name()
-        _LOGGER.debug(f"VTO Data received: {event}")
-        self.hass.bus.fire("dahua_event_received", event)
+    async def _async_sample_health(self, now=None):
+        """ Called every HEALTH_UPDATE_INTERVAL to sample the health counters, the health sensors update from them """
+        self._health.sample(self.client.request_durations.count, self.client.request_errors)
+
+    def get_health(self) -> DeviceHealth:
+        return self._health
+
+    def get_health_stats(self) -> dict:
+        """ Returns the values of the health sensors, from in memory counters only """
+        supervisor = self.get_event_link_supervisor()
+        connected_since = supervisor.connected_since
+        vto_client = self.get_vto_client()
+        keep_alive_rtt = vto_client.keep_alive_rtt if vto_client is not None else None
+        heartbeat_age = self._liveness.last_seen_age()
+        poll_duration = self._health.last_poll_duration
+        error_rate = self._health.request_error_rate()
+        events_per_minute, events_per_minute_by_code = self._health.events_per_minute()
+        return {
+            "poll_duration": round(poll_duration * 1000) if poll_duration is not None else None,
+            "request_error_rate": round(error_rate, 1) if error_rate is not None else None,
+            "link_uptime": int(time.time() - connected_since) if connected_since is not None else 0,
+            "reconnects": supervisor.reconnect_count,
+            "events_per_minute": events_per_minute,
+            "events_per_minute_by_code": events_per_minute_by_code,
+            "heartbeat_age": int(heartbeat_age) if heartbeat_age is not None else None,
+            "vto_keep_alive_rtt": round(keep_alive_rtt * 1000, 1) if keep_alive_rtt is not None else None,
+        }
+
+    def get_event_link_supervisor(self):
+        """ Returns the supervisor of the link events come in on, the VTO for doorbells, otherwise the event stream """
+        if self.is_doorbell():
+            return self.dahua_vto_event_thread.supervisor
+        return self.dahua_event_thread.supervisor
+
+    async def _async_read_clock(self):
+        """ Reads the device clock for the clock offset of the latency tracker, the request time is taken into account """
+        requested = time.time()
+        try:
+            result = await self.client.async_get_current_time()
+            device_time = parse_device_time(result.get("result", ""), dt_util.DEFAULT_TIME_ZONE)
+        except (ClientError, asyncio.TimeoutError, ValueError) as exception:
+            _LOGGER.debug("Could not read the clock of %s", self._address, exc_info=exception)
+            return
+        self._latency.set_clock_offset(device_time, requested, time.time())
+
+    def get_latency_stats(self) -> dict:
+        """ Returns the clock offset and the latency percentiles of every stage of the events """
+        return self._latency.as_dict()
+
+    def get_trace_stats(self) -> Optional[dict]:
+        """ Returns the span stats of requests, parsing and dispatch of all devices, None unless tracing is on """
+        return self._trace_stats.as_dict() if self._trace_stats is not None else None
+
+    def get_latency_tracker(self) -> LatencyTracker:
+        return self._latency
+
+    def on_vto_alive(self):
+        """ Called by the VTO client (from the VTO thread) whenever the VTO sends us something """
+        vto_client = self.get_vto_client()
+        keep_alive_interval = vto_client.keep_alive_interval if vto_client is not None else 0
+        self._liveness.seen(keep_alive_interval + VTO_TIMEOUT_SLACK_SECONDS)
+
+    def is_device_alive(self):
+        """
+        Returns True if the device is sending heartbeats (event stream) or keep alives (VTO), False if they stopped and
+        None if we don't get heartbeats from this device
+        """
+        return self._liveness.is_alive()
+
+    def on_vto_frame(self, direction: str, data: bytes):
+        """ Called by the VTO client (from the VTO thread) with every DHIP frame received and sent """
+        self._frames.record(FRAME_DHIP_IN if direction == "in" else FRAME_DHIP_OUT, data)
+
+    def get_frames(self) -> list:
+        """ Returns the last raw frames of the event stream and VTO with the credentials redacted, oldest first """
+        return self._frames.as_list()
+
+    def enqueue_vto_event(self, event: dict):
+        """ Called from the VTO thread for every event, the event is processed by on_receive_vto_event on the HA loop """
+        self._event_queue.put_threadsafe(self.on_receive_vto_event, (event, time.time()), [event.get("Code", "")],
+                                         event.get("Index"))
+
+    def enqueue_stream_data(self, data_bytes: bytes, channel: int):
+        """
+        Called by the event stream reader for every chunk of data. The data is queued and processed by on_receive.
+        Returns an awaitable when the queue is full so the reader waits, otherwise None
+        """
+        # Any data on the stream, including the heartbeats, tells us the device is alive
+        self._liveness.seen(EVENT_STREAM_TIMEOUT_SECONDS)
+
+        codes = peek_event_codes(data_bytes)
+        if not codes:
+            # Heartbeat
+            return None
+        self._frames.record(FRAME_EVENT_STREAM, data_bytes)
+
+        index = peek_event_index(data_bytes)
+        args = (data_bytes, channel, time.time())
+        if self._event_queue.put_nowait(self.on_receive, args, codes, index):
+            return None
+        return self._event_queue.put(self.on_receive, args, codes, index)
+
+    def get_queue_stats(self) -> dict:
+        """ Returns the depth, drop and coalesce counts of the event queue """
+        return self._event_queue.as_dict()
+
+    def on_receive_vto_event(self, message: dict, received: float = None):
+        event = DahuaEvent.from_vto_message(message, self._channel)
+        parsed = time.time()
+        self._health.count_event(event.code)
+        if self._journal is not None:
+            self._journal.append(self.get_device_name(), event)
+        derived_events = self._filter_event(event)
+        if derived_events is None:
+            return
+        if not self._is_duplicate(event):
+            self._publisher.publish(event)
+        fired = time.time()
 
         # Example events:
         # {
@@ -356,35 +762,11 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
         #    "Index":-1
         # }
 
-        # This is the event code, example: VideoMotion, CrossLineDetection, BackKeyLight, PhoneCallDetect, DoorStatus, etc
-        code = self.translate_event_code(event)
-        event_key = self.get_event_key(code)
-
-        listener = self._dahua_event_listeners.get(event_key)
-        if listener is not None:
-            action = event.get("Action", "")
-            if action == "Start":
-                self._dahua_event_timestamp[event_key] = int(time.time())
-                listener()
-            elif action == "Stop":
-                self._dahua_event_timestamp[event_key] = 0
-                listener()
-            elif action == "Pulse":
-                if code == "DoorStatus":
-                    if event.get("Data", {}).get("Status", "") == "Open":
-                        self._dahua_event_timestamp[event_key] = int(time.time())
-                    else:
-                        self._dahua_event_timestamp[event_key] = 0
-                else:
-                    state = event.get("Data", {}).get("State", 0)
-                    if state == 1:
-                        # button pressed
-                        self._dahua_event_timestamp[event_key] = int(time.time())
-                    else:
-                        self._dahua_event_timestamp[event_key] = 0
-                listener()
+        self._dispatch_event(event, derived_events)
+        if received is not None:
+            self._latency.observe_event(event, received, parsed, fired, time.time())
 
-    def on_receive(self, data_bytes: bytes, channel: int):
+    def on_receive(self, data_bytes: bytes, channel: int, received: float = None):
         """
         Takes in bytes from the Dahua event stream, converts to a string, parses to a dict and fires an event with the data on the HA event bus
         Example input:
@@ -404,55 +786,255 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
         }
         """
         data = data_bytes.decode("utf-8", errors="ignore")
-        events = parse_event(data)
+        events = parse_event(data, self.is_event_wanted)
 
         if len(events) == 0:
             return
-
-        _LOGGER.debug(f"Events received from {self.get_address()} on channel {channel}: {events}")
+        parsed = time.time()
 
         for event in events:
-            index = 0
-            if "index" in event:
-                try:
-                    index = int(event["index"])
-                except ValueError:
-                    index = 0
-
-            # This is a short term fix. Right now for NVRs this integration creates a thread per channel to listen to events. Every thread gets the same response. We need to
-            # discard events not for this channel. Longer term work should create only a single thread per channel.
-            if index != self._channel:
+            self._health.count_event(event.code)
+            # The journal gets every event, including the ones a rule drops
+            if self._journal is not None:
+                self._journal.append(self.get_device_name(), event)
+
+            # Local rules and zones come first, an event dropped by a rule isn't fired nor dispatched
+            derived_events = self._filter_event(event)
+            if derived_events is None:
                 continue
 
-            # Put the vent on the HA event bus
-            event["name"] = self.get_device_name()
-            event["DeviceName"] = self.get_device_name()
-            self.hass.bus.fire("dahua_event_received", event)
+            # Put the vent on the HA event bus, unless another device of the dedup group already did
+            if not self._is_duplicate(event):
+                self._publisher.publish(event)
+            fired = time.time()
+
+            self._dispatch_event(event, derived_events)
+            if received is not None:
+                self._latency.observe_event(event, received, parsed, fired, time.time())
 
-            # When there's an event start we'll update the a map x to the current timestamp in seconds for the event.
-            # We'll reset it to 0 when the event stops.
-            # We'll use these timestamps in binary_sensor to know how long to trigger the sensor
+    def _is_duplicate(self, event: DahuaEvent) -> bool:
+        """
+        Returns true if another device of the dedup group already fired this event on the HA event bus. Our own
+        entities still get the event, only the bus event is suppressed
+        """
+        return self._dedup_group is not None and self._event_deduplicator.is_duplicate(self._dedup_group, event)
 
-            # This is the event code, example: VideoMotion, CrossLineDetection, etc
-            event_name = self.translate_event_code(event)
+    def get_dedup_stats(self) -> dict:
+        """ Returns the dedup group and the stats of the deduplicator shared by all devices """
+        stats = self._event_deduplicator.as_dict()
+        stats["group"] = self._dedup_group
+        return stats
 
-            event_key = self.get_event_key(event_name)
-            listener = self._dahua_event_listeners.get(event_key)
-            if listener is not None:
-                action = event["action"]
-                if action == "Start":
-                    self._dahua_event_timestamp[event_key] = int(time.time())
-                    listener()
-                elif action == "Stop":
-                    self._dahua_event_timestamp[event_key] = 0
-                    listener()
+    def _filter_event(self, event: DahuaEvent) -> Optional[Collection[str]]:
+        """
+        Tags the event with the spatial zones its objects are in and applies the local rules. Returns None if a rule
+        drops the event, otherwise the event names of the rule and zone sensors the event drives
+        """
+        if self._spatial_zones is not None and event.code in ZONE_CODES:
+            event.zones = self._spatial_zones.match(event)
+        rule_sensors = ()
+        if self._rules is not None:
+            rule_sensors = self._rules.evaluate(event)
+            if rule_sensors is None:
+                return None
+        if not rule_sensors and not event.zones:
+            return ()
+        derived_events = [RULE_EVENT_PREFIX + name for name in rule_sensors]
+        derived_events.extend(ZONE_EVENT_PREFIX + name for name in event.zones or ())
+        return derived_events
+
+    def get_rule_engine(self) -> Optional[RuleEngine]:
+        """ Returns the local rules, None if there are no rules """
+        return self._rules
+
+    def get_rule_sensor_names(self) -> list:
+        """ Returns the names of the rule sensors """
+        return self._rules.sensor_names() if self._rules is not None else []
+
+    def get_spatial_zones(self) -> Optional[SpatialZoneIndex]:
+        """ Returns the spatial zones, None if there are no zones """
+        return self._spatial_zones
+
+    def get_spatial_zone_names(self) -> list:
+        """ Returns the names of the spatial zones """
+        return self._spatial_zones.names() if self._spatial_zones is not None else []
+
+    @tracing.traced(tracing.SPAN_DISPATCH)
+    def _dispatch_event(self, event: DahuaEvent, derived_events: Collection[str] = ()):
+        """ Updates the event state and calls the listeners of the event and of the rule and zone sensors it drives """
+        if event.code in MOTION_GRID_CODES and self._motion_grid.has_zones():
+            self._update_motion_grid(event)
+        if event.code in COUNTER_CODES and self._object_counters is not None:
+            self._object_counters.count(event)
+        if event.code in OCCUPANCY_CODES and self._occupancy is not None:
+            self._occupancy.track(event)
+            if self._occupancy_timer is None:
+                self._occupancy_timer = self._timer_wheel.schedule(SWEEP_SECONDS, self._sweep_occupancy)
+
+        # This is the event code, example: VideoMotion, CrossLineDetection, BackKeyLight, PhoneCallDetect, DoorStatus, etc
+        event.set_event_name(self.translate_event_code(event))
+
+        # When there's an event start we'll mark the event as active since the current time and clear it when the event
+        # stops. binary_sensor uses this state to know how long to trigger the sensor
+        active = self._is_event_active(event)
+        # Recorded before dispatching so the listeners see the event in the history
+        self._history.add(event)
+        self._event_registry.dispatch(event, active)
+        self._track_event_expiry(event, active)
+
+        # Rule and zone sensors are events of their own, following the events that match the rule or are in the zone
+        source_key = (event.code, event.channel)
+        if event.action is EventAction.STOP:
+            held = self._derived_events.pop(source_key, None)
+            if held:
+                derived_events = held.union(derived_events)
+        elif active and derived_events:
+            self._derived_events.setdefault(source_key, set()).update(derived_events)
+        for event_name in derived_events:
+            derived_event = DahuaEvent(event.code, event.channel, event.action_name, data=event.data,
+                                       source=event.source)
+            derived_event.zones = event.zones
+            derived_event.set_event_name(event_name)
+            self._event_registry.dispatch(derived_event, active)
+            self._track_event_expiry(derived_event, active)
+
+    def _track_event_expiry(self, event: DahuaEvent, active: Optional[bool]):
+        """
+        Events that start are cleared automatically after their max duration (or hold time for pulses) in case the
+        Stop never arrives. Every new event for the key restarts the timer
+        """
+        if active:
+            event_name = event.key[0]
+            if event.action is EventAction.PULSE:
+                timeout = EVENT_PULSE_HOLD_SECONDS.get(event_name, DEFAULT_PULSE_HOLD_SECONDS)
+            else:
+                timeout = EVENT_MAX_DURATION_SECONDS.get(event_name, DEFAULT_EVENT_MAX_DURATION_SECONDS)
+            self._schedule_event_expiry(event.key, timeout)
+        elif active is not None:
+            self._schedule_event_expiry(event.key, None)
+
+    def _update_motion_grid(self, event: DahuaEvent):
+        """ Applies the motion grid of a VideoMotionInfo or MDResult event, motion zone sensors listen to the grid """
+        masks = extract_row_masks(event.data)
+        if masks is None:
+            return
+        self._motion_grid.update(masks)
+        # Devices don't always report the end of motion, clear the grid if it isn't refreshed
+        if self._motion_grid_timer is not None:
+            self._motion_grid_timer.cancel()
+        self._motion_grid_timer = self._timer_wheel.schedule(MOTION_GRID_TIMEOUT_SECONDS, self._clear_motion_grid)
+
+    def _clear_motion_grid(self):
+        self._motion_grid_timer = None
+        self._motion_grid.clear()
+
+    def _sweep_occupancy(self):
+        """ Evicts timed out objects and lowers held occupancies, keeps sweeping while anything is tracked """
+        self._occupancy_timer = None
+        if self._occupancy is not None and self._occupancy.sweep():
+            self._occupancy_timer = self._timer_wheel.schedule(SWEEP_SECONDS, self._sweep_occupancy)
+
+    def get_occupancy(self) -> Optional[OccupancyTracker]:
+        """ Returns the occupancy tracker, None if it's not enabled """
+        return self._occupancy
+
+    def get_object_counters(self) -> Optional[ObjectCounters]:
+        """ Returns the line crossing and intrusion counters, None if they're not enabled """
+        return self._object_counters
+
+    def get_motion_grid(self) -> MotionGrid:
+        """ Returns the motion grid with its heatmap and zones """
+        return self._motion_grid
+
+    def add_motion_zone_listener(self, listener) -> CALLBACK_TYPE:
+        """ Adds a listener called with the names of the motion zones that changed. Returns a function removing it """
+        return self._motion_grid.add_listener(listener)
+
+    def _schedule_event_expiry(self, key: tuple, timeout):
+        """ Clears the event with the given key in timeout seconds, replacing an earlier timer. None just cancels """
+        timer = self._event_timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if timeout is not None:
+            self._event_timers[key] = self._timer_wheel.schedule(timeout, self._expire_event, key)
+
+    def _expire_event(self, key: tuple):
+        """ Called by the timer wheel, clears an event that is still active by dispatching a Stop for it """
+        self._event_timers.pop(key, None)
+        state = self._event_registry.get_state(key)
+        if state is None or not state.active:
+            return
+        last_event = state.last_event
+        _LOGGER.debug("Clearing %s on %s, it didn't stop in time", key[0], self._address)
+        event = DahuaEvent(last_event.code, last_event.channel, "Stop", source=EVENT_SOURCE_EXPIRED)
+        event.set_event_name(key[0])
+        self._event_registry.dispatch(event, False)
+
+    @staticmethod
+    def _is_event_active(event: DahuaEvent):
+        """ Returns True if the event starts, False if it stops and None if it doesn't change the state """
+        action = event.action
+        if action is EventAction.START:
+            return True
+        if action is EventAction.STOP:
+            return False
+        if action is EventAction.PULSE:
+            if event.source != EVENT_SOURCE_VTO:
+                # Pulses from the event stream have no Stop, they're cleared after their hold time
+                return True
+            if event.key[0] == "DoorStatus":
+                return event.data_dict().get("Status", "") == "Open"
+            # button pressed
+            return event.data_dict().get("State", 0) == 1
+        return None
+
+    def is_event_wanted(self, code: str, action: str, index: int) -> bool:
+        """
+        Returns true if an event from the event stream should be processed. Called before the event data is decoded so
+        unwanted events are cheap to skip
+        """
+        # This is a short term fix. Right now for NVRs this integration creates a thread per channel to listen to events. Every thread gets the same response. We need to
+        # discard events not for this channel. Longer term work should create only a single thread per channel.
+        if index != self._channel:
+            return False
+        return self.is_event_code_wanted(code)
 
-    def translate_event_code(self, event: dict):
+    def is_event_code_wanted(self, code: str) -> bool:
+        """
+        Returns true if anything consumes events with the given code: a listener (directly or through
+        translate_event_code) or the HA event bus
+        """
+        if self.publishes_event_code(code):
+            return True
+        if code in MOTION_GRID_CODES and self._motion_grid.has_zones():
+            return True
+        if code in COUNTER_CODES and self._object_counters is not None:
+            return True
+        if code in OCCUPANCY_CODES and self._occupancy is not None:
+            return True
+        if self._rules is not None and self._rules.wants_code(code):
+            return True
+        if code in ZONE_CODES and self._spatial_zones is not None:
+            return True
+        for event_name in EVENT_CODE_TRANSLATIONS.get(code, (code,)):
+            if self._event_registry.has_subscribers(self.get_event_key(event_name)):
+                return True
+        return False
+
+    def publishes_event_code(self, code: str) -> bool:
+        """ Returns true if events with the given code are fired on the HA event bus """
+        return self._publisher.publishes(code)
+
+    def get_publisher_stats(self) -> dict:
+        """ Returns the publish policies and the counters per event code """
+        return self._publisher.as_dict()
+
+    def translate_event_code(self, event: DahuaEvent):
         """
         translate_event_code will try to convert the event code to a more specific event code if the device has a listener for the more specific type
         Example event codes: VideoMotion, CrossLineDetection, BackKeyLight, DoorStatus
         """
-        code = event.get("Code", "")
+        code = event.code
 
         # For CrossLineDetection, the event data will look like this... and if there's a human detected then we'll use the SmartMotionHuman code instead
         # {
@@ -464,9 +1046,7 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
         #    }
         # }
         if code == "CrossLineDetection" or code == "CrossRegionDetection":
-            data = event.get("data", event.get("Data", {}))
-            is_human = data.get("Object", {}).get("ObjectType", "").lower() == "human"
-            if is_human and self._dahua_event_listeners.get(self.get_event_key(code)) is not None:
+            if self._event_registry.is_subscribed(event.key) and self._is_human(event):
                 return "SmartMotionHuman"
 
         # Convert doorbell pressed related events to common event name, DoorbellPressed.
@@ -476,19 +1056,37 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
 
         return code
 
+    @staticmethod
+    def _is_human(event: DahuaEvent) -> bool:
+        """ True if the object of an IVS event is a human """
+        obj = event.data_dict().get("Object")
+        return isinstance(obj, dict) and str(obj.get("ObjectType", "")).lower() == "human"
+
     def get_event_timestamp(self, event_name: str) -> int:
         """
         Returns the event timestamp. If the event is firing then it will be the time of the firing. Otherwise returns 0.
         event_name: the event name, example: CrossLineDetection
         """
-        event_key = self.get_event_key(event_name)
-        return self._dahua_event_timestamp.get(event_key, 0)
+        state = self._event_registry.get_state(self.get_event_key(event_name))
+        return int(state.since) if state is not None else 0
+
+    def get_event_history(self) -> EventHistory:
+        """ Returns the history of the recent events of the device """
+        return self._history
 
-    def add_dahua_event_listener(self, event_name: str, listener: CALLBACK_TYPE):
-        """ Adds an event listener for the given event (CrossLineDetection, etc).
-        This callback will be called when the event fire """
-        event_key = self.get_event_key(event_name)
-        self._dahua_event_listeners[event_key] = listener
+    def get_last_event_record(self, event_name: str) -> Optional[EventRecord]:
+        """ Returns the record of the last event with the event name (or code) on our channel, None if there's none """
+        return self._history.last(event_name, self._channel)
+
+    def get_event_state(self, event_name: str) -> EventState:
+        """ Returns the state of the event (active, since, last event), None if the event never fired """
+        return self._event_registry.get_state(self.get_event_key(event_name))
+
+    def add_dahua_event_listener(self, event_name, listener) -> CALLBACK_TYPE:
+        """ Adds an event listener for the given event (CrossLineDetection, etc). Use None for all events of the
+        channel. The listener is called with the DahuaEvent when the event fires. Returns a function that removes the
+        listener, entities should pass it to async_on_remove """
+        return self._event_registry.subscribe(event_name, self._channel, listener)
 
     def supports_siren(self) -> bool:
         """
@@ -632,9 +1230,12 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
         """returns the channel number of this camera"""
         return self._channel_number
 
-    def get_event_key(self, event_name: str) -> str:
-        """returns the event key we use for listeners. It uses the channel index to support multiple channels"""
-        return "{0}-{1}".format(event_name, self._channel)
+    def get_event_key(self, event_name: str) -> tuple:
+        """
+        returns the event key we use for listeners, (event name, channel). It uses the channel index to support
+        multiple channels. Events carry this key precomputed, see DahuaEvent.key
+        """
+        return event_name, self._channel
 
     def get_address(self) -> str:
         """returns the IP address of this camera"""
@@ -659,12 +1260,44 @@ class DahuaDataUpdateCoordinator(DataUpdateCoordinator):
         """
         return self.dahua_vto_event_thread.vto_client
 
+    def get_capabilities(self) -> dict:
+        """ Returns what the device was found to support during initialization """
+        return {
+            "coaxial_control": self._supports_coaxial_control,
+            "disarming_linkage": self._supports_disarming_linkage,
+            "smart_motion_detection": self._supports_smart_motion_detection,
+            "smart_motion_detection_amcrest": self.supports_smart_motion_detection_amcrest(),
+            "lighting": self._supports_lighting,
+            "profile_mode": self._supports_profile_mode,
+            "infrared_light": self.supports_infrared_light(),
+            "security_light": self.supports_security_light(),
+            "siren": self.supports_siren(),
+            "doorbell": self.is_doorbell(),
+            "amcrest_doorbell": self.is_amcrest_doorbell(),
+            "amcrest_flood_light": self.is_amcrest_flood_light(),
+            "max_streams": self._max_streams,
+            "channel_number": self._channel_number,
+        }
+
+    def get_request_stats(self) -> dict:
+        """ Returns the number of requests to the device, the errors and the duration percentiles """
+        return self.client.get_request_stats()
+
+    def get_link_states(self) -> dict:
+        """
+        Returns the state of the event stream and VTO links (connected since, reconnect count, last error, the recent
+        connects and disconnects with their errors and retry delays, etc) as tracked by their connection supervisors
+        """
+        return {
+            "event_stream": self.dahua_event_thread.supervisor.as_dict(),
+            "vto": self.dahua_vto_event_thread.supervisor.as_dict(),
+        }
+
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Handle removal of an entry."""
     coordinator = hass.data[DOMAIN][entry.entry_id]
-    coordinator.dahua_event_thread.stop()
-    coordinator.dahua_vto_event_thread.stop()
+    await coordinator.async_stop(None)
     unloaded = all(
         await asyncio.gather(
             *[
@@ -680,6 +1313,47 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     return unloaded
 
 
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """
+    Called when the options change. If the enabled platforms, the motion zones, the object counters, occupancy, the
+    rule sensors or the spatial zones changed the entry is reloaded, everything else is applied in place. The event
+    stream is resubscribed when the events changed
+    """
+    coordinator: DahuaDataUpdateCoordinator = hass.data[DOMAIN].get(entry.entry_id)
+    if coordinator is None:
+        return
+
+    platforms = [platform for platform in PLATFORMS if entry.options.get(platform, True)]
+    try:
+        motion_zones = parse_motion_zones(entry.options.get(CONF_MOTION_ZONES, ""))
+    except ValueError:
+        motion_zones = {}
+    try:
+        rule_sensors = RuleEngine(parse_rules(entry.options.get(CONF_RULES, ""))).sensor_names()
+    except ValueError:
+        rule_sensors = []
+    try:
+        spatial_zones = list(parse_spatial_zones(entry.options.get(CONF_SPATIAL_ZONES, "")))
+    except ValueError:
+        spatial_zones = []
+    # New motion zones, counters, occupancy, rule sensors or spatial zones mean new entities, so these reload the entry
+    counters_enabled = entry.options.get(CONF_OBJECT_COUNTERS, False)
+    occupancy_enabled = entry.options.get(CONF_OCCUPANCY, False)
+    if platforms != coordinator.platforms or motion_zones.keys() != coordinator.get_motion_grid().zones.keys() \
+            or counters_enabled != (coordinator.get_object_counters() is not None) \
+            or occupancy_enabled != (coordinator.get_occupancy() is not None) \
+            or rule_sensors != coordinator.get_rule_sensor_names() \
+            or spatial_zones != coordinator.get_spatial_zone_names():
+        await hass.config_entries.async_reload(entry.entry_id)
+        return
+
+    coordinator.apply_options(entry.options)
+    events = entry.options.get(CONF_EVENTS, entry.data.get(CONF_EVENTS))
+    if events != coordinator.get_event_list():
+        await coordinator.async_set_events(events)
+        async_dispatcher_send(hass, SIGNAL_EVENTS_UPDATED.format(entry.entry_id))
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Reload config entry."""
     await async_unload_entry(hass, entry)
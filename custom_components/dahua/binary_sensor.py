@@ -3,13 +3,18 @@ import re
 
 from homeassistant.components.binary_sensor import BinarySensorEntity
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.util import dt as dt_util
 from custom_components.dahua import DahuaDataUpdateCoordinator
 
 from .const import (
     MOTION_SENSOR_DEVICE_CLASS,
     DOMAIN, SAFETY_DEVICE_CLASS, CONNECTIVITY_DEVICE_CLASS, SOUND_DEVICE_CLASS, DOOR_DEVICE_CLASS, VOLUME_HIGH_ICON,
+    SIGNAL_EVENTS_UPDATED,
 )
 from .entity import DahuaBaseEntity
+from .rules import RULE_EVENT_PREFIX
+from .zones import ZONE_EVENT_PREFIX
 
 # Override event names. Otherwise we'll generate the name from the event name for example SmartMotionHuman will
 # become "Smart Motion Human"
@@ -46,8 +51,11 @@ async def async_setup_entry(hass: HomeAssistant, entry, async_add_devices):
     coordinator: DahuaDataUpdateCoordinator = hass.data[DOMAIN][entry.entry_id]
 
     sensors: list[DahuaEventSensor] = []
-    for event_name in coordinator.get_event_list():
-        sensors.append(DahuaEventSensor(coordinator, entry, event_name))
+    # The sensors created for the selected events, by event name. Used to add/remove sensors when the events change
+    event_sensors: dict[str, DahuaEventSensor] = {}
+    for event_name in coordinator.get_event_list() or []:
+        event_sensors[event_name] = DahuaEventSensor(coordinator, entry, event_name)
+    sensors.extend(event_sensors.values())
 
     # For doorbells we'll just add these since most people will want them
     if coordinator.is_doorbell():
@@ -56,9 +64,36 @@ async def async_setup_entry(hass: HomeAssistant, entry, async_add_devices):
         sensors.append(DahuaEventSensor(coordinator, entry, "DoorStatus"))
         sensors.append(DahuaEventSensor(coordinator, entry, "CallNoAnswered"))
 
+    # A sensor per zone of the motion detection grid, see motion_grid.py
+    for zone_name in coordinator.get_motion_grid().zones:
+        sensors.append(DahuaMotionZoneSensor(coordinator, entry, zone_name))
+
+    # A sensor per rule sensor name of the local rules, see rules.py
+    for rule_name in coordinator.get_rule_sensor_names():
+        sensors.append(DahuaRuleSensor(coordinator, entry, rule_name))
+
+    # A sensor per spatial zone, see zones.py
+    for zone_name in coordinator.get_spatial_zone_names():
+        sensors.append(DahuaSpatialZoneSensor(coordinator, entry, zone_name))
+
     if sensors:
         async_add_devices(sensors)
 
+    async def async_events_updated():
+        """ The events were changed in the options, add sensors for new events and remove the ones not used anymore """
+        events = coordinator.get_event_list() or []
+        added = [event_name for event_name in events if event_name not in event_sensors]
+        for event_name in [event_name for event_name in event_sensors if event_name not in events]:
+            await event_sensors.pop(event_name).async_remove()
+        for event_name in added:
+            event_sensors[event_name] = DahuaEventSensor(coordinator, entry, event_name)
+        if added:
+            async_add_devices([event_sensors[event_name] for event_name in added])
+
+    entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_EVENTS_UPDATED.format(entry.entry_id), async_events_updated)
+    )
+
 
 class DahuaEventSensor(DahuaBaseEntity, BinarySensorEntity):
     """
@@ -121,13 +156,171 @@ class DahuaEventSensor(DahuaBaseEntity, BinarySensorEntity):
         The async_added_to_hass method adds a listener to the coordinator so when the event is started or stopped
         it calls the async_write_ha_state function. async_write_ha_state gets the current value from this is_on method.
         """
-        return self._coordinator.get_event_timestamp(self._event_name) > 0
+        state = self._coordinator.get_event_state(self._event_name)
+        return state is not None and state.active
+
+    @property
+    def extra_state_attributes(self):
+        """Return the time and action of the last event, from the event history"""
+        attributes = dict(super().extra_state_attributes)
+        record = self._coordinator.get_last_event_record(self._event_name)
+        if record is not None:
+            attributes["last_event"] = dt_util.utc_from_timestamp(record.time).isoformat()
+            attributes["last_event_action"] = record.action
+        return attributes
 
     async def async_added_to_hass(self):
         """Connect to dispatcher listening for entity data notifications."""
-        self._coordinator.add_dahua_event_listener(self._event_name, self.async_write_ha_state)
+        await super().async_added_to_hass()
+        self.async_on_remove(self._coordinator.add_dahua_event_listener(self._event_name, self._handle_event))
+
+    def _handle_event(self, event):
+        """ Called when the event fires """
+        self.async_write_ha_state()
+
+    @property
+    def should_poll(self) -> bool:
+        """Return True if entity has to be polled for state.  False if entity pushes its state to HA"""
+        return False
+
+
+class DahuaMotionZoneSensor(DahuaBaseEntity, BinarySensorEntity):
+    """
+    dahua binary_sensor class for a zone of the motion detection grid. The grid comes from VideoMotionInfo or MDResult
+    events, so one of them must be selected in the events. The sensor is on while there's motion in the zone
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry, zone_name: str):
+        DahuaBaseEntity.__init__(self, coordinator, config_entry)
+        BinarySensorEntity.__init__(self)
+
+        self._zone_name = zone_name
+        self._coordinator = coordinator
+        self._name = "{0} Motion Zone {1}".format(coordinator.get_device_name(), zone_name)
+        self._unique_id = "{0}_motion_zone_{1}".format(coordinator.get_serial_number(),
+                                                       zone_name.lower().replace(" ", "_"))
+
+    @property
+    def unique_id(self):
+        """Return the entity unique ID."""
+        return self._unique_id
+
+    @property
+    def name(self):
+        """Return the name of the binary_sensor. Example: Cam14 Motion Zone Driveway"""
+        return self._name
+
+    @property
+    def device_class(self):
+        """Return the class of this binary_sensor, Example: motion"""
+        return MOTION_SENSOR_DEVICE_CLASS
+
+    @property
+    def is_on(self):
+        """Return true if there's motion in the zone"""
+        zone = self._coordinator.get_motion_grid().zones.get(self._zone_name)
+        return zone is not None and zone.occupied
+
+    @property
+    def extra_state_attributes(self):
+        """Return the state attributes: the number of cells with motion and the decayed motion heat of the zone"""
+        attributes = dict(super().extra_state_attributes)
+        zone = self._coordinator.get_motion_grid().zones.get(self._zone_name)
+        if zone is not None:
+            attributes["active_cells"] = zone.active_cells
+            attributes["cells"] = zone.cells
+            attributes["heat"] = round(zone.heat, 3)
+        return attributes
+
+    async def async_added_to_hass(self):
+        """Connect to the motion grid"""
+        await super().async_added_to_hass()
+        self.async_on_remove(self._coordinator.add_motion_zone_listener(self._handle_zones_changed))
+
+    def _handle_zones_changed(self, zone_names):
+        """ Called when the occupancy of motion zones changed """
+        if self._zone_name in zone_names:
+            self.async_write_ha_state()
 
     @property
     def should_poll(self) -> bool:
         """Return True if entity has to be polled for state.  False if entity pushes its state to HA"""
         return False
+
+
+class DahuaRuleSensor(DahuaBaseEntity, BinarySensorEntity):
+    """
+    dahua binary_sensor class for a local rule. The sensor is on while an event matching one of the rules with its name
+    is active, and turns off with the Stop of that event
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry, rule_name: str,
+                 event_prefix: str = RULE_EVENT_PREFIX, kind: str = "Rule"):
+        DahuaBaseEntity.__init__(self, coordinator, config_entry)
+        BinarySensorEntity.__init__(self)
+
+        # The rule sensor's events are dispatched under the prefix plus the name
+        self._event_name = event_prefix + rule_name
+        self._coordinator = coordinator
+        self._name = "{0} {1} {2}".format(coordinator.get_device_name(), kind, rule_name)
+        self._unique_id = "{0}_{1}_{2}".format(coordinator.get_serial_number(), kind,
+                                               rule_name).lower().replace(" ", "_")
+
+    @property
+    def unique_id(self):
+        """Return the entity unique ID."""
+        return self._unique_id
+
+    @property
+    def name(self):
+        """Return the name of the binary_sensor. Example: Cam14 Rule Driveway Car"""
+        return self._name
+
+    @property
+    def device_class(self):
+        """Return the class of this binary_sensor, Example: motion"""
+        return MOTION_SENSOR_DEVICE_CLASS
+
+    @property
+    def is_on(self):
+        """Return true while an event matching the rule is active"""
+        state = self._coordinator.get_event_state(self._event_name)
+        return state is not None and state.active
+
+    @property
+    def extra_state_attributes(self):
+        """Return the code of the last event that matched the rule"""
+        attributes = dict(super().extra_state_attributes)
+        state = self._coordinator.get_event_state(self._event_name)
+        if state is not None and state.last_event is not None:
+            attributes["last_code"] = state.last_event.code
+        return attributes
+
+    async def async_added_to_hass(self):
+        """Connect to the rule's events"""
+        await super().async_added_to_hass()
+        self.async_on_remove(self._coordinator.add_dahua_event_listener(self._event_name, self._handle_event))
+
+    def _handle_event(self, event):
+        """ Called when an event matching the rule fires """
+        self.async_write_ha_state()
+
+    @property
+    def should_poll(self) -> bool:
+        """Return True if entity has to be polled for state.  False if entity pushes its state to HA"""
+        return False
+
+
+class DahuaSpatialZoneSensor(DahuaRuleSensor):
+    """
+    dahua binary_sensor class for a spatial zone. The sensor is on while an IVS event with an object in the zone (center
+    in the polygon or bounding box across the line) is active
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry, zone_name: str):
+        DahuaRuleSensor.__init__(self, coordinator, config_entry, zone_name, ZONE_EVENT_PREFIX, "Zone")
+
+    @property
+    def name(self):
+        """Return the name of the binary_sensor. Example: Cam14 Zone Driveway"""
+        return self._name
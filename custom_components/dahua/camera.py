@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import logging
+import time
 import voluptuous as vol
 
 from homeassistant.core import HomeAssistant
@@ -14,6 +15,8 @@ from custom_components.dahua.entity import DahuaBaseEntity
 from .const import (
     DOMAIN,
 )
+from .diagnostics import async_write_diagnostics
+from .history import HISTORY_SIZE
 
 _LOGGER: logging.Logger = logging.getLogger(__package__)
 
@@ -35,6 +38,15 @@ SERVICE_VTO_OPEN_DOOR = "vto_open_door"
 SERVICE_VTO_CANCEL_CALL = "vto_cancel_call"
 SERVICE_SET_DAY_NIGHT_MODE = "set_video_in_day_night_mode"
 SERVICE_REBOOT = "reboot"
+# Fires a dahua_object_counts event with the line crossing and intrusion counts of the camera
+SERVICE_QUERY_OBJECT_COUNTS = "query_object_counts"
+EVENT_OBJECT_COUNTS = "dahua_object_counts"
+# Fires a dahua_event_history event with the recent events of the camera from the in memory history
+SERVICE_QUERY_EVENTS = "query_events"
+EVENT_EVENT_HISTORY = "dahua_event_history"
+# Writes the diagnostics of the device to a file in the config directory and fires a dahua_diagnostics event with its path
+SERVICE_WRITE_DIAGNOSTICS = "write_diagnostics"
+EVENT_DIAGNOSTICS = "dahua_diagnostics"
 
 
 async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entities):
@@ -192,6 +204,34 @@ async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entitie
         "async_set_record_mode"
     )
 
+    platform.async_register_entity_service(
+        SERVICE_QUERY_OBJECT_COUNTS,
+        {
+            vol.Optional("seconds", default=3600): vol.All(vol.Coerce(int), vol.Range(min=1, max=30 * 86400)),
+            vol.Optional("rule"): str,
+            vol.Optional("direction"): str,
+            vol.Optional("object_type"): str,
+        },
+        "async_query_object_counts"
+    )
+
+    platform.async_register_entity_service(
+        SERVICE_QUERY_EVENTS,
+        {
+            vol.Optional("event"): str,
+            vol.Optional("action"): vol.In(["Start", "Stop", "Pulse", "State"]),
+            vol.Optional("seconds", default=3600): vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional("limit", default=20): vol.All(vol.Coerce(int), vol.Range(min=1, max=HISTORY_SIZE)),
+        },
+        "async_query_events"
+    )
+
+    platform.async_register_entity_service(
+        SERVICE_WRITE_DIAGNOSTICS,
+        {},
+        "async_write_diagnostics"
+    )
+
     # Exposes a service to enable setting the cameras infrared light to Auto, Manual, and Off along with the brightness
     if coordinator.supports_infrared_light():
         # "async_set_infrared_mode" is the method called upon calling the service. Defined below in DahuaCamera class
@@ -339,6 +379,51 @@ class DahuaCamera(DahuaBaseEntity, Camera):
         """ Handles the service call from SERVICE_VTO_CANCEL_CALL to cancel VTO calls """
         await self._coordinator.get_vto_client().cancel_call()
 
+    async def async_query_object_counts(self, seconds: int, rule: str = None, direction: str = None,
+                                        object_type: str = None):
+        """
+        Handles the service call from SERVICE_QUERY_OBJECT_COUNTS. The counts are fired in a dahua_object_counts event
+        as services can't return data
+        """
+        counters = self._coordinator.get_object_counters()
+        counts = counters.query(seconds, rule, direction, object_type) if counters is not None else []
+        self.hass.bus.async_fire(EVENT_OBJECT_COUNTS, {
+            "entity_id": self.entity_id,
+            "DeviceName": self._coordinator.get_device_name(),
+            "seconds": seconds,
+            "counts": counts,
+        })
+
+    async def async_query_events(self, seconds: int, limit: int, event: str = None, action: str = None):
+        """
+        Handles the service call from SERVICE_QUERY_EVENTS. The events of the last seconds, newest first, and their
+        count are fired in a dahua_event_history event as services can't return data
+        """
+        history = self._coordinator.get_event_history()
+        channel = self._coordinator.get_channel()
+        since = time.time() - seconds
+        records = history.query(event, channel, since=since, action=action, limit=limit)
+        self.hass.bus.async_fire(EVENT_EVENT_HISTORY, {
+            "entity_id": self.entity_id,
+            "DeviceName": self._coordinator.get_device_name(),
+            "seconds": seconds,
+            "count": history.count(event, channel, since=since, action=action),
+            "events": [record.as_dict() for record in records],
+        })
+
+    async def async_write_diagnostics(self):
+        """
+        Handles the service call from SERVICE_WRITE_DIAGNOSTICS. Home Assistant versions before 2022.2 can't download
+        diagnostics, so they're written to a file in the config directory
+        """
+        path = await async_write_diagnostics(self.hass, self.config_entry, self._coordinator)
+        _LOGGER.info("Wrote the diagnostics of %s to %s", self._coordinator.get_device_name(), path)
+        self.hass.bus.async_fire(EVENT_DIAGNOSTICS, {
+            "entity_id": self.entity_id,
+            "DeviceName": self._coordinator.get_device_name(),
+            "path": path,
+        })
+
     async def async_set_service_set_channel_title(self, text1: str, text2: str):
         """ Handles the service call from SERVICE_SET_CHANNEL_TITLE to set profile mode to day/night """
         channel = self._coordinator.get_channel()
@@ -2,10 +2,13 @@
 import logging
 import socket
 import asyncio
+import time
 import aiohttp
 import async_timeout
 
+from . import tracing
 from .digest import DigestAuth
+from .latency import LatencyHistogram
 from hashlib import md5
 
 _LOGGER: logging.Logger = logging.getLogger(__package__)
@@ -42,6 +45,10 @@ class DahuaClient:
         protocol = "https" if int(port) == 443 else "http"
         self._base = "{0}://{1}:{2}".format(protocol, address, port)
 
+        # The duration of every request (streams excluded) and the number that failed
+        self.request_durations = LatencyHistogram()
+        self.request_errors = 0
+
     def get_rtsp_stream_url(self, channel: int, subtype: int) -> str:
         """
         Returns the RTSP url for the supplied subtype (subtype is 0=Main stream, 1=Sub stream)
@@ -131,6 +138,10 @@ class DahuaClient:
         except aiohttp.ClientResponseError as e:
             return {"vendor": "Generic RTSP"}
 
+    async def async_get_current_time(self) -> dict:
+        """ async_get_current_time returns the device time in its time zone. Example response: result=2021-7-3 21:02:32 """
+        return await self.get("/cgi-bin/global.cgi?action=getCurrentTime")
+
     async def reboot(self) -> dict:
         """ Reboots the device """
         return await self.get("/cgi-bin/magicBox.cgi?action=reboot")
@@ -620,9 +631,11 @@ class DahuaClient:
                                                                                                 str(enabled).lower())
         return await self.get(url)
 
-    async def stream_events(self, on_receive, events: list, channel: int):
+    async def stream_events(self, on_receive, events: list, channel: int, on_connect=None):
         """
-        enable_motion_detection will either enable or disable motion detection on the camera depending on the supplied value
+        stream_events attaches to the event manager and calls on_receive for every chunk of data read from the stream.
+        on_connect (optional) is called once the device accepted the attach request. Errors are raised to the caller so
+        it can decide when to reconnect
 
         All: Use the literal word "All" to get back all events.. or pick and choose from the ones below
         VideoMotion: motion detection event
@@ -681,17 +694,21 @@ class DahuaClient:
                 auth = DigestAuth(self._username, self._password, self._session)
                 response = await auth.request("GET", url)
                 response.raise_for_status()
+                if on_connect is not None:
+                    on_connect()
 
                 # https://docs.aiohttp.org/en/stable/streams.html
                 async for data, _ in response.content.iter_chunks():
-                    on_receive(data, channel)
-            except Exception as exception:
-                pass
+                    # on_receive may return an awaitable when it needs us to slow down reading
+                    result = on_receive(data, channel)
+                    if result is not None:
+                        await result
             finally:
                 if response is not None:
                     response.close()
 
     @staticmethod
+    @tracing.traced(tracing.SPAN_PARSE_API_RESPONSE)
     async def parse_dahua_api_response(data: str) -> dict:
         """
         Dahua APIs return back text that looks like this:
@@ -714,33 +731,46 @@ class DahuaClient:
 
     async def get_bytes(self, url: str) -> bytes:
         """Get information from the API. This will return the raw response and not process it"""
-        async with async_timeout.timeout(TIMEOUT_SECONDS):
-            response = None
-            try:
-                auth = DigestAuth(self._username, self._password, self._session)
-                response = await auth.request("GET", self._base + url)
-                response.raise_for_status()
-
-                return await response.read()
-            finally:
-                if response is not None:
-                    response.close()
+        started = time.perf_counter()
+        failed = True
+        try:
+            async with async_timeout.timeout(TIMEOUT_SECONDS):
+                response = None
+                try:
+                    with tracing.request_span(url):
+                        auth = DigestAuth(self._username, self._password, self._session)
+                        response = await auth.request("GET", self._base + url)
+                        response.raise_for_status()
+
+                        data = await response.read()
+                        failed = False
+                        return data
+                finally:
+                    if response is not None:
+                        response.close()
+        finally:
+            self._record_request(started, failed)
 
     async def get(self, url: str, verify_ok=False) -> dict:
         """Get information from the API."""
         url = self._base + url
+        started = time.perf_counter()
+        failed = True
         try:
             async with async_timeout.timeout(TIMEOUT_SECONDS):
                 response = None
                 try:
-                    auth = DigestAuth(self._username, self._password, self._session)
-                    response = await auth.request("GET", url)
-                    response.raise_for_status()
-                    data = await response.text()
+                    with tracing.request_span(url):
+                        auth = DigestAuth(self._username, self._password, self._session)
+                        response = await auth.request("GET", url)
+                        response.raise_for_status()
+                        data = await response.text()
                     if verify_ok:
                         if data.lower().strip() != "ok":
                             raise Exception(data)
-                    return await self.parse_dahua_api_response(data)
+                    result = await self.parse_dahua_api_response(data)
+                    failed = False
+                    return result
                 finally:
                     if response is not None:
                         response.close()
@@ -756,6 +786,19 @@ class DahuaClient:
         except Exception as exception:  # pylint: disable=broad-except
             _LOGGER.warning("Exception fetching information from %s", url)
             raise exception
+        finally:
+            self._record_request(started, failed)
+
+    def _record_request(self, started: float, failed: bool):
+        self.request_durations.add(time.perf_counter() - started)
+        if failed:
+            self.request_errors += 1
+
+    def get_request_stats(self) -> dict:
+        """ Returns the number of requests, the errors and the duration percentiles in milliseconds """
+        stats = self.request_durations.as_dict()
+        stats["errors"] = self.request_errors
+        return stats
 
     @staticmethod
     def to_stream_name(subtype: int) -> str:
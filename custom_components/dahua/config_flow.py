@@ -9,6 +9,11 @@ from homeassistant.helpers.aiohttp_client import async_create_clientsession
 from homeassistant.helpers import config_validation as cv
 
 from .client import DahuaClient
+from .motion_grid import parse_motion_zones
+from .payload import parse_payload_fields
+from .publisher import parse_publish_policies
+from .rules import parse_rules
+from .zones import parse_spatial_zones
 from .const import (
     CONF_PASSWORD,
     CONF_USERNAME,
@@ -20,6 +25,17 @@ from .const import (
     DOMAIN,
     PLATFORMS,
     CONF_CHANNEL,
+    CONF_DEDUP_GROUP,
+    CONF_PUBLISH_POLICIES,
+    CONF_PAYLOAD_FIELDS,
+    CONF_SLIM_PAYLOADS,
+    CONF_MOTION_ZONES,
+    CONF_OBJECT_COUNTERS,
+    CONF_OCCUPANCY,
+    CONF_RULES,
+    CONF_SPATIAL_ZONES,
+    CONF_JOURNAL,
+    CONF_TRACING,
 )
 
 """
@@ -198,18 +214,76 @@ class DahuaOptionsFlowHandler(config_entries.OptionsFlow):
 
     async def async_step_user(self, user_input=None):
         """Handle a flow initialized by the user."""
+        errors = {}
         if user_input is not None:
-            self.options.update(user_input)
-            return await self._update_options()
+            try:
+                parse_publish_policies(user_input.get(CONF_PUBLISH_POLICIES, ""))
+            except ValueError as exception:
+                _LOGGER.warning("Invalid publish policies: %s", exception)
+                errors[CONF_PUBLISH_POLICIES] = "publish_policies"
+            try:
+                parse_payload_fields(user_input.get(CONF_PAYLOAD_FIELDS, ""))
+            except ValueError as exception:
+                _LOGGER.warning("Invalid payload fields: %s", exception)
+                errors[CONF_PAYLOAD_FIELDS] = "payload_fields"
+            try:
+                parse_motion_zones(user_input.get(CONF_MOTION_ZONES, ""))
+            except ValueError as exception:
+                _LOGGER.warning("Invalid motion zones: %s", exception)
+                errors[CONF_MOTION_ZONES] = "motion_zones"
+            try:
+                parse_rules(user_input.get(CONF_RULES, ""))
+            except ValueError as exception:
+                _LOGGER.warning("Invalid rules: %s", exception)
+                errors[CONF_RULES] = "rules"
+            try:
+                parse_spatial_zones(user_input.get(CONF_SPATIAL_ZONES, ""))
+            except ValueError as exception:
+                _LOGGER.warning("Invalid spatial zones: %s", exception)
+                errors[CONF_SPATIAL_ZONES] = "spatial_zones"
+            if not errors:
+                self.options.update(user_input)
+                return await self._update_options()
+
+        # The form shows what was entered if it's shown again for errors, the options stay as they are until it's valid
+        values = dict(self.options)
+        if user_input is not None:
+            values.update(user_input)
+        schema = {
+            vol.Required(x, default=values.get(x, True)): bool
+            for x in sorted(PLATFORMS)
+        }
+        # Changing the events doesn't reload the device, the event stream is resubscribed in place
+        events = values.get(CONF_EVENTS, self.config_entry.data.get(CONF_EVENTS, DEFAULT_EVENTS))
+        schema[vol.Optional(CONF_EVENTS, default=events)] = cv.multi_select(ALL_EVENTS)
+        # Devices with the same dedup group don't fire the same event twice, for a camera added directly and through
+        # its NVR. Empty disables deduplication
+        schema[vol.Optional(CONF_DEDUP_GROUP, default=values.get(CONF_DEDUP_GROUP, ""))] = str
+        # How events are fired on the HA event bus per code, example: VideoMotionInfo=sample:1, IntelliFrame=none
+        schema[vol.Optional(CONF_PUBLISH_POLICIES, default=values.get(CONF_PUBLISH_POLICIES, ""))] = str
+        # Which fields of the event data are fired on the HA event bus, for example CrossLineDetection=Name|UTC
+        # Slimming drops bulky lists from the data of all other codes
+        schema[vol.Optional(CONF_PAYLOAD_FIELDS, default=values.get(CONF_PAYLOAD_FIELDS, ""))] = str
+        schema[vol.Optional(CONF_SLIM_PAYLOADS, default=values.get(CONF_SLIM_PAYLOADS, False))] = bool
+        # Zones of the 18x22 motion detection grid, each gets a binary sensor. Example: Driveway=0-5:0-10
+        schema[vol.Optional(CONF_MOTION_ZONES, default=values.get(CONF_MOTION_ZONES, ""))] = str
+        # Count IVS line crossings and intrusions per rule, direction and object type
+        schema[vol.Optional(CONF_OBJECT_COUNTERS, default=values.get(CONF_OBJECT_COUNTERS, False))] = bool
+        # Track the objects in IVS areas and report how many there are
+        schema[vol.Optional(CONF_OCCUPANCY, default=values.get(CONF_OCCUPANCY, False))] = bool
+        # Local rules that drop events or drive rule sensors, example: drop: Code=VideoMotion & hour<6
+        schema[vol.Optional(CONF_RULES, default=values.get(CONF_RULES, ""))] = str
+        # Polygons and lines in the 8192x8192 space of IVS events, each gets a binary sensor. Example: Gate=10,0 10,8191
+        schema[vol.Optional(CONF_SPATIAL_ZONES, default=values.get(CONF_SPATIAL_ZONES, ""))] = str
+        # Write the events of the device to the event journal in .storage/dahua_journal
+        schema[vol.Optional(CONF_JOURNAL, default=values.get(CONF_JOURNAL, False))] = bool
+        # Time requests, parsing and dispatch (shared by all devices, on while any device has it on)
+        schema[vol.Optional(CONF_TRACING, default=values.get(CONF_TRACING, False))] = bool
 
         return self.async_show_form(
             step_id="user",
-            data_schema=vol.Schema(
-                {
-                    vol.Required(x, default=self.options.get(x, True)): bool
-                    for x in sorted(PLATFORMS)
-                }
-            ),
+            data_schema=vol.Schema(schema),
+            errors=errors,
         )
 
     async def _update_options(self):
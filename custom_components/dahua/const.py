@@ -14,6 +14,9 @@ SIREN_ICON = "mdi:bullhorn"
 INFRARED_ICON = "mdi:weather-night"
 DISARMING_ICON = "mdi:alarm-check"
 VOLUME_HIGH_ICON = "mdi:volume-high"
+COUNTER_ICON = "mdi:counter"
+OCCUPANCY_ICON = "mdi:account-group"
+LATENCY_ICON = "mdi:timer-outline"
 
 # Device classes - https://www.home-assistant.io/integrations/binary_sensor/#device-class
 MOTION_SENSOR_DEVICE_CLASS = "motion"
@@ -28,7 +31,8 @@ SWITCH = "switch"
 LIGHT = "light"
 CAMERA = "camera"
 SELECT = "select"
-PLATFORMS = [BINARY_SENSOR, SWITCH, LIGHT, CAMERA, SELECT]
+SENSOR = "sensor"
+PLATFORMS = [BINARY_SENSOR, SWITCH, LIGHT, CAMERA, SELECT, SENSOR]
 
 
 # Configuration and options
@@ -42,10 +46,24 @@ CONF_STREAMS = "streams"
 CONF_EVENTS = "events"
 CONF_NAME = "name"
 CONF_CHANNEL = "channel"
+CONF_DEDUP_GROUP = "dedup_group"
+CONF_PUBLISH_POLICIES = "publish_policies"
+CONF_PAYLOAD_FIELDS = "payload_fields"
+CONF_SLIM_PAYLOADS = "slim_payloads"
+CONF_MOTION_ZONES = "motion_zones"
+CONF_OBJECT_COUNTERS = "object_counters"
+CONF_OCCUPANCY = "occupancy"
+CONF_RULES = "rules"
+CONF_SPATIAL_ZONES = "spatial_zones"
+CONF_JOURNAL = "journal"
+CONF_TRACING = "tracing"
 
 # Defaults
 DEFAULT_NAME = "Dahua"
 
+# Dispatcher signals, formatted with the config entry ID
+SIGNAL_EVENTS_UPDATED = "dahua_events_updated_{0}"
+
 STARTUP_MESSAGE = f"""
 -------------------------------------------------------------------
 {NAME}
@@ -0,0 +1,186 @@
+"""
+Line crossing and intrusion counters from IVS events, kept in fixed size ring buckets
+"""
+from collections import OrderedDict
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+from .models import DahuaEvent, EventAction
+
+# IVS events that are counted
+COUNTER_CODES = ("CrossLineDetection", "CrossRegionDetection")
+
+# Bucket width in seconds and number of buckets per resolution. minute covers the last hour, hour the last day and day
+# the last 30 days
+RESOLUTIONS = {
+    "minute": (60, 60),
+    "hour": (3600, 24),
+    "day": (86400, 30),
+}
+
+# The same object crossing the same rule within this many seconds is counted once. Devices report an object again as
+# it moves along the line
+OBJECT_DEDUP_SECONDS = 60.0
+OBJECT_DEDUP_MAX_ENTRIES = 1024
+
+
+class RingBuckets:
+    """ Counts in size buckets of width seconds. Buckets are reused as time moves on, so the size never grows """
+    __slots__ = ("_width", "_counts", "_latest")
+
+    def __init__(self, width: int, size: int):
+        self._width = width
+        self._counts = [0] * size
+        # The absolute number (time // width) of the newest bucket
+        self._latest = 0
+
+    def _advance(self, bucket: int):
+        """ Moves the newest bucket up to bucket, clearing the buckets in between """
+        size = len(self._counts)
+        if bucket <= self._latest:
+            return
+        for number in range(max(self._latest + 1, bucket - size + 1), bucket + 1):
+            self._counts[number % size] = 0
+        self._latest = bucket
+
+    def add(self, timestamp: float, count: int = 1):
+        """ Adds count at the time. Counts older than the oldest bucket are ignored """
+        bucket = int(timestamp // self._width)
+        self._advance(bucket)
+        if bucket > self._latest - len(self._counts):
+            self._counts[bucket % len(self._counts)] += count
+
+    def total(self, seconds: float, now: float) -> int:
+        """ Returns the count of the last seconds (rounded up to whole buckets), up to the whole ring """
+        self._advance(int(now // self._width))
+        buckets = min(len(self._counts), max(1, math.ceil(seconds / self._width)))
+        size = len(self._counts)
+        return sum(self._counts[number % size] for number in range(self._latest - buckets + 1, self._latest + 1))
+
+    def span(self) -> int:
+        """ The number of seconds covered by the ring """
+        return self._width * len(self._counts)
+
+
+class ObjectCounter:
+    """ The counts of one (rule, direction, object type) at every resolution, plus the total since we started """
+    __slots__ = ("key", "rings", "total", "last_counted")
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.rings = [RingBuckets(width, size) for width, size in RESOLUTIONS.values()]
+        self.total = 0
+        self.last_counted: Optional[float] = None
+
+    def add(self, timestamp: float):
+        for ring in self.rings:
+            ring.add(timestamp)
+        self.total += 1
+        self.last_counted = timestamp
+
+    def count(self, seconds: float, now: float) -> int:
+        """ Returns the count of the last seconds from the finest resolution that covers them """
+        for ring in self.rings:
+            if seconds <= ring.span():
+                return ring.total(seconds, now)
+        return self.rings[-1].total(seconds, now)
+
+
+def counter_key(event: DahuaEvent) -> tuple:
+    """
+    Returns (rule, direction, object type) of an IVS event. The rule is the rule name, or its id if there's no name.
+    Example data: {"Direction": "RightToLeft", "Name": "Rule1", "Object": {"ObjectID": 542, "ObjectType": "Human"}}
+    """
+    data = event.data_dict()
+    obj = data.get("Object")
+    obj = obj if isinstance(obj, dict) else {}
+    rule = data.get("Name") or str(data.get("RuleId", event.code))
+    return rule, data.get("Direction") or "Any", obj.get("ObjectType") or "Unknown"
+
+
+class ObjectCounters:
+    """
+    ObjectCounters counts IVS line crossings and intrusions per rule, direction and object type. Counts are kept per
+    minute, hour and day in ring buckets, so memory doesn't grow with the number of events. Objects are deduplicated by
+    their ObjectID per rule.
+
+    Listeners are called with the counter key and True if the counter is new.
+    """
+
+    def __init__(self):
+        self.counters: Dict[tuple, ObjectCounter] = {}
+        # (rule, ObjectID) to the monotonic time the object was counted, oldest first
+        self._seen_objects: OrderedDict = OrderedDict()
+        self._listeners: List[Callable[[tuple, bool], None]] = []
+        self.duplicates = 0
+
+    def add_listener(self, listener: Callable[[tuple, bool], None]) -> Callable[[], None]:
+        """ Adds a listener called when a counter changed. Returns a function removing it """
+        self._listeners.append(listener)
+
+        def remove():
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+        return remove
+
+    def count(self, event: DahuaEvent) -> Optional[tuple]:
+        """ Counts the event if it starts a crossing of an object we didn't count yet. Returns the counter key """
+        if event.action is not EventAction.START and event.action is not EventAction.PULSE:
+            return None
+
+        key = counter_key(event)
+        obj = event.data_dict().get("Object")
+        object_id = obj.get("ObjectID") if isinstance(obj, dict) else None
+        if object_id is not None and self._is_seen(key[0], object_id):
+            self.duplicates += 1
+            return None
+
+        counter = self.counters.get(key)
+        is_new = counter is None
+        if is_new:
+            counter = self.counters[key] = ObjectCounter(key)
+        counter.add(time.time())
+
+        for listener in list(self._listeners):
+            listener(key, is_new)
+        return key
+
+    def _is_seen(self, rule: str, object_id) -> bool:
+        """ Returns true if the object was already counted for the rule recently, otherwise remembers it """
+        now = time.monotonic()
+        seen = self._seen_objects
+        while seen:
+            oldest_key, counted = next(iter(seen.items()))
+            if now - counted < OBJECT_DEDUP_SECONDS:
+                break
+            del seen[oldest_key]
+
+        object_key = (rule, object_id)
+        if object_key in seen:
+            return True
+        seen[object_key] = now
+        if len(seen) > OBJECT_DEDUP_MAX_ENTRIES:
+            seen.popitem(last=False)
+        return False
+
+    def query(self, seconds: float, rule: str = None, direction: str = None, object_type: str = None) -> List[dict]:
+        """ Returns the counts of the last seconds for the counters matching the optional filters """
+        now = time.time()
+        results = []
+        for (counter_rule, counter_direction, counter_object_type), counter in self.counters.items():
+            if rule is not None and rule != counter_rule:
+                continue
+            if direction is not None and direction != counter_direction:
+                continue
+            if object_type is not None and object_type.lower() != counter_object_type.lower():
+                continue
+            results.append({
+                "rule": counter_rule,
+                "direction": counter_direction,
+                "object_type": counter_object_type,
+                "count": counter.count(seconds, now),
+                "total": counter.total,
+            })
+        return results
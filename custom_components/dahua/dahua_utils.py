@@ -1,9 +1,15 @@
 """
 Various utilities for Dahua cameras
 """
-import json
 import re
 
+from . import tracing
+from .models import DahuaEvent
+
+# Used to find the event codes and channel in raw event stream data without parsing it
+EVENT_CODE_PATTERN = re.compile(rb"Code=([^;\r\n]+)")
+EVENT_INDEX_PATTERN = re.compile(rb"index=(-?\d+)")
+
 
 def dahua_brightness_to_hass_brightness(bri_str: str) -> int:
     """
@@ -27,10 +33,27 @@ def hass_brightness_to_dahua_brightness(hass_brightness: int) -> int:
     return int((hass_brightness / 255) * 100)
 
 
+def peek_event_codes(data: bytes) -> list[str]:
+    """
+    Returns the event codes found in raw event stream data without parsing the events. Heartbeats have no codes.
+    Example: b'Code=VideoMotion;action=Start;index=0' returns ["VideoMotion"]
+    """
+    return [code.decode("utf-8", errors="ignore") for code in EVENT_CODE_PATTERN.findall(data)]
+
+
+def peek_event_index(data: bytes):
+    """ Returns the channel index of the first event found in raw event stream data, None if there isn't one """
+    match = EVENT_INDEX_PATTERN.search(data)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
 # https://github.com/rroller/dahua/issues/166
-def parse_event(data: str) -> list[dict[str, any]]:
-    # This will turn the event stream data into a list of events, where each item in the list is a dictionary and where
-    # the key of the dictionary is the key is for example "Code" and the value is "VideoMotion", etc
+@tracing.traced(tracing.SPAN_PARSE_EVENT)
+def parse_event(data: str, accept=None) -> list[DahuaEvent]:
+    # This will turn the event stream data into a list of events, where each item in the list is a DahuaEvent made from
+    # the key/value pairs of the event, for example "Code" is "VideoMotion", etc
     # That's a little hard to explain... so look at this example...
     # Code=VideoMotion;action=Start;index=0;data={
     #    "Id" : [ 0 ],
@@ -38,12 +61,11 @@ def parse_event(data: str) -> list[dict[str, any]]:
     #    "SmartMotionEnable" : true
     # }
     # will be turned into
-    # [{
-    #   "Code":"VideoMotion",
-    #   "action":"Start",
-    #   "index":"0",
-    #   ...
-    # }]
+    # [DahuaEvent(code="VideoMotion", action="Start", channel=0, data=...)]
+    # The JSON data is only decoded when the event's data is read.
+    #
+    # accept is an optional function of (code, action, index) returning True if the event is wanted. It's called before
+    # the event is created so events nobody wants are skipped as cheaply as possible.
 
     # We will split on "--myboundary" and then skip the first 3 lines so we end up with a string that starts with Code=
     event_blocks = re.split(r'--myboundary\n', data)
@@ -65,19 +87,30 @@ def parse_event(data: str) -> list[dict[str, any]]:
         #    "RegionName" : [ "Region1" ],
         #    "SmartMotionEnable" : true
         # }
-        # And we want to put each key/value pair into a dictionary...
-        event = dict()
-        for key_value in event_block.split(';'):
-            key, value = key_value.split('=')
-            event[key] = value
-
-        # data is a json string, convert it to real json and add it back to the output dic
-        if "data" in event:
-            try:
-                data = json.loads(event["data"])
-                event["data"] = data
-            except Exception:  # pylint: disable=broad-except
-                pass
-        events.append(event)
+        # And we want to get each key/value pair... The data is split off first, the json may contain ; and = itself
+        header, _, event_data = event_block.partition(";data=")
+        fields = dict()
+        for key_value in header.split(';'):
+            key, _, value = key_value.partition('=')
+            fields[key] = value
+
+        code = fields.get("Code", "")
+        action = fields.get("action", "")
+        index = to_event_index(fields.get("index"))
+        if accept is not None and not accept(code, action, index):
+            continue
+
+        # data is a json string, it's decoded when the event data is read
+        events.append(DahuaEvent(code, index, action, raw_data=event_data or None))
 
     return events
+
+
+def to_event_index(index) -> int:
+    """ Converts the index (channel) of an event to an int. Events without a valid index are for channel 0 """
+    if index is None:
+        return 0
+    try:
+        return int(index)
+    except ValueError:
+        return 0
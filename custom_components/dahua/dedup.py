@@ -0,0 +1,94 @@
+"""
+Suppresses events that arrive more than once, for example from a camera and from the NVR it's connected to
+"""
+from collections import OrderedDict
+import time
+from typing import Optional
+
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN_DATA
+from .models import DahuaEvent
+
+# A duplicate arrives within this many seconds of the original, usually a lot sooner
+DEDUP_WINDOW_SECONDS = 30.0
+# Upper bound on the number of events remembered, the oldest are forgotten first
+DEDUP_MAX_ENTRIES = 4096
+
+
+def event_dedup_key(group: str, event: DahuaEvent) -> Optional[tuple]:
+    """
+    Returns the key identifying the event within the dedup group. Only events with a sequence number or millisecond
+    timestamp in their data can be identified, for all others (plain VideoMotion, etc) None is returned.
+
+    The channel isn't part of the key: a camera is channel 0 when added directly but has another channel on the NVR.
+    """
+    data = event.data_dict()
+    event_seq = data.get("EventSeq")
+    utc_ms = data.get("UTCMS")
+    if event_seq is None and utc_ms is None:
+        return None
+    return group, event.code, event.action_name, event_seq, data.get("GroupID"), data.get("UTC"), utc_ms
+
+
+class EventDeduplicator:
+    """
+    EventDeduplicator remembers the events seen in the last window seconds, bounded to maxsize entries. Entries are
+    kept in arrival order so expiring them only ever looks at the oldest ones.
+
+    Devices share one deduplicator per integration and pass a dedup group with every event. Devices in the same group
+    see the same events (a camera added directly and through its NVR), so only the first copy is let through.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW_SECONDS, maxsize: int = DEDUP_MAX_ENTRIES):
+        self._window = window
+        self._maxsize = maxsize
+        # dedup key to the monotonic time it was first seen
+        self._seen: OrderedDict = OrderedDict()
+        self.checked = 0
+        self.suppressed = 0
+
+    def is_duplicate(self, group: str, event: DahuaEvent) -> bool:
+        """ Returns True if the same event was already seen in the group within the window """
+        key = event_dedup_key(group, event)
+        if key is None:
+            return False
+
+        now = time.monotonic()
+        self._expire(now)
+        self.checked += 1
+        if key in self._seen:
+            self.suppressed += 1
+            return True
+
+        self._seen[key] = now
+        if len(self._seen) > self._maxsize:
+            self._seen.popitem(last=False)
+        return False
+
+    def _expire(self, now: float):
+        """ Forgets the events older than the window """
+        seen = self._seen
+        oldest = now - self._window
+        while seen:
+            key, first_seen = next(iter(seen.items()))
+            if first_seen >= oldest:
+                return
+            del seen[key]
+
+    def as_dict(self) -> dict:
+        """ Returns the dedup stats as a dictionary, useful for diagnostics """
+        return {
+            "entries": len(self._seen),
+            "checked": self.checked,
+            "suppressed": self.suppressed,
+        }
+
+
+def get_event_deduplicator(hass: HomeAssistant) -> EventDeduplicator:
+    """ Returns the deduplicator shared by all Dahua devices, it's created on first use """
+    data = hass.data.setdefault(DOMAIN_DATA, {})
+    deduplicator: Optional[EventDeduplicator] = data.get("event_deduplicator")
+    if deduplicator is None:
+        deduplicator = data["event_deduplicator"] = EventDeduplicator()
+    return deduplicator
@@ -0,0 +1,82 @@
+"""
+Diagnostics of a Dahua device: what it supports, how its links, queue and requests are doing and its last raw frames
+"""
+import json
+import re
+import time
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from custom_components.dahua import DahuaDataUpdateCoordinator
+
+from .const import CONF_PASSWORD, CONF_USERNAME, DOMAIN
+from .frames import REDACTED
+
+# Config entry fields that are never part of the diagnostics
+TO_REDACT = (CONF_USERNAME, CONF_PASSWORD)
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    """ Returns the diagnostics of a config entry, downloaded from the device page (Home Assistant 2022.2 and up) """
+    coordinator: DahuaDataUpdateCoordinator = hass.data[DOMAIN][entry.entry_id]
+    return get_diagnostics(entry, coordinator)
+
+
+def get_diagnostics(entry: ConfigEntry, coordinator: DahuaDataUpdateCoordinator) -> dict:
+    """ Returns the diagnostics of the device with the credentials redacted """
+    diagnostics = {
+        "entry": {
+            "title": entry.title,
+            "data": redact(entry.data),
+            "options": redact(entry.options),
+        },
+        "device": {
+            "model": coordinator.model,
+            "firmware": coordinator.get_firmware_version() if coordinator.data else None,
+            "initialized": coordinator.initialized,
+            "alive": coordinator.is_device_alive(),
+            "last_update_success": coordinator.last_update_success,
+        },
+        "capabilities": coordinator.get_capabilities() if coordinator.initialized else None,
+        "requests": coordinator.get_request_stats(),
+        "links": coordinator.get_link_states(),
+        "queue": coordinator.get_queue_stats(),
+        "publisher": coordinator.get_publisher_stats(),
+        "dedup": coordinator.get_dedup_stats(),
+        "history": coordinator.get_event_history().as_dict(),
+        "latency": coordinator.get_latency_stats(),
+        "tracing": coordinator.get_trace_stats(),
+    }
+    rules = coordinator.get_rule_engine()
+    if rules is not None:
+        diagnostics["rules"] = rules.as_dict()
+    spatial_zones = coordinator.get_spatial_zones()
+    if spatial_zones is not None:
+        diagnostics["spatial_zones"] = spatial_zones.as_dict()
+    diagnostics["frames"] = coordinator.get_frames()
+    return diagnostics
+
+
+def redact(data) -> Any:
+    """ Returns a copy of the dict with the values of TO_REDACT replaced """
+    return {key: REDACTED if key in TO_REDACT else value for key, value in data.items()}
+
+
+async def async_write_diagnostics(hass: HomeAssistant, entry: ConfigEntry,
+                                  coordinator: DahuaDataUpdateCoordinator) -> str:
+    """
+    Writes the diagnostics to dahua_diagnostics_<serial number>_<time>.json in the config directory, for Home Assistant
+    versions without the diagnostics download. Returns the path of the file
+    """
+    diagnostics = get_diagnostics(entry, coordinator)
+    serial_number = re.sub(r"[^\w-]", "_", coordinator.get_serial_number() or "unknown")
+    path = hass.config.path("dahua_diagnostics_{0}_{1}.json".format(serial_number, int(time.time())))
+    await hass.async_add_executor_job(_write_json, path, diagnostics)
+    return path
+
+
+def _write_json(path: str, data: dict):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2, default=str)
@@ -7,11 +7,17 @@ from aiohttp.client_reqrep import ClientResponse
 from aiohttp.client_exceptions import ClientError
 from yarl import URL
 
+from . import tracing
+
 
 # Seems that aiohttp doesn't support Diegest Auth, which Dahua cams require. So I had to bake it in here.
 # Copied and then modified from https://github.com/aio-libs/aiohttp/pull/2213
 # I really wish this was baked into aiohttp :-(
 
+# Challenges answered per request, the device can ask again when the nonce went stale. Past this the credentials are
+# wrong and the 401 is returned to the caller instead of retrying forever
+MAX_CHALLENGES = 2
+
 
 class DigestAuth:
     """HTTP digest authentication helper.
@@ -30,6 +36,7 @@ class DigestAuth:
         self.challenge = previous.get("challenge")
         self.args = {}
         self.session = session
+        self.challenges = 0
 
     async def request(self, method, url, *, headers=None, **kwargs):
         """Makes a request"""
@@ -43,10 +50,14 @@ class DigestAuth:
             authorization = self._build_digest_header(method.upper(), url)
             headers["AUTHORIZATION"] = authorization
 
+        started = time.perf_counter() if tracing.enabled else None
         response = await self.session.request(method, url, headers=headers, **kwargs)
 
         # Only try performing digest authentication if the response status is from 401
         if response.status == 401:
+            if started is not None:
+                # The round trip that got us the challenge
+                tracing.record(tracing.SPAN_HTTP_AUTH, time.perf_counter() - started)
             return await self._handle_401(response)
 
         return response
@@ -143,6 +154,10 @@ class DigestAuth:
 
         parts = auth_header.split(" ", 1)
         if "digest" == parts[0].lower() and len(parts) > 1:
+            if self.challenges >= MAX_CHALLENGES:
+                return response
+            self.challenges += 1
+
             # Close the initial response since we are going making another request and return that response
             response.close()
 
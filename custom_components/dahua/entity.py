@@ -16,6 +16,14 @@ class DahuaBaseEntity(CoordinatorEntity):
         self.config_entry = config_entry
         self._coordinator = coordinator
 
+    @property
+    def available(self) -> bool:
+        """
+        Return True if the entity is available. The device must answer polls and, if it sends heartbeats, must not have
+        missed them. Heartbeats detect an offline device within seconds instead of waiting for the next poll to time out
+        """
+        return super().available and self._coordinator.is_device_alive() is not False
+
     # https://developers.home-assistant.io/docs/entity_registry_index
     @property
     def unique_id(self):
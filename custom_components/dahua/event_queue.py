@@ -0,0 +1,181 @@
+"""
+Bounded queue between the event readers (HTTP event stream, VTO) and the code that processes the events
+"""
+import asyncio
+from collections import deque
+import logging
+from typing import Callable, Dict, Iterable, Optional
+
+from homeassistant.core import HomeAssistant
+
+_LOGGER: logging.Logger = logging.getLogger(__package__)
+
+DEFAULT_QUEUE_SIZE = 256
+
+# Informational codes are chatty and only describe an ongoing state. They can be coalesced or dropped when we fall
+# behind. All other codes (alarms) are never dropped
+INFORMATIONAL_EVENT_CODES = frozenset([
+    "VideoMotionInfo",
+    "IntelliFrame",
+    "MDResult",
+])
+
+# Yield to the event loop after dispatching this many items in a row
+DISPATCH_BATCH_SIZE = 32
+
+
+class DahuaEventQueue:
+    """
+    DahuaEventQueue decouples reading events from the device from processing them. Readers put items on the queue and a
+    single dispatcher task takes them off and calls their handler.
+
+    The queue is bounded. When it's full:
+    - Informational events (VideoMotionInfo, IntelliFrame, MDResult) are dropped, and an informational event already
+      waiting in the queue for the same code and channel is replaced by the newer one (coalesced) at any time
+    - Alarm events are never dropped. An informational event is evicted to make room, and if there isn't one put() waits
+      until the dispatcher caught up. Since the reader then stops reading, the device is slowed down by TCP itself.
+
+    All methods must be called from the HA loop, except put_threadsafe.
+    """
+
+    def __init__(self, hass: HomeAssistant, name: str, maxsize: int = DEFAULT_QUEUE_SIZE,
+                 informational: Iterable[str] = INFORMATIONAL_EVENT_CODES):
+        self._hass = hass
+        self.name = name
+        self._maxsize = maxsize
+        self._informational = frozenset(informational)
+
+        # Items are lists of [handler, args, coalesce key]. Alarms are dispatched before informational events
+        self._alarms = deque()
+        self._info = deque()
+        # coalesce key to the item waiting in self._info
+        self._coalesce: Dict[tuple, list] = {}
+
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.max_depth = 0
+        self.processed = 0
+        self.dropped: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+        self.waits = 0
+
+    def start(self):
+        """ Starts the dispatcher task """
+        if self._task is None:
+            self._task = self._hass.loop.create_task(self._async_dispatch())
+
+    def stop(self):
+        """ Stops the dispatcher task. Items still in the queue are discarded """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._alarms.clear()
+        self._info.clear()
+        self._coalesce.clear()
+
+    def depth(self) -> int:
+        """ Number of items waiting to be dispatched """
+        return len(self._alarms) + len(self._info)
+
+    def put_nowait(self, handler: Callable, args: tuple, codes: list, channel=None, force: bool = False) -> bool:
+        """
+        Queues handler(*args) for the event(s) with the given codes. Returns False if the queue is full of alarms and the
+        caller should wait (see put). With force the item is queued anyway, the queue can then go over its size.
+        """
+        if codes and all(code in self._informational for code in codes):
+            key = (handler, tuple(codes), channel)
+            queued = self._coalesce.get(key)
+            if queued is not None:
+                # Only the latest state matters, replace the one waiting in the queue
+                queued[1] = args
+                self._count(self.coalesced, codes)
+                return True
+            if self.depth() >= self._maxsize:
+                self._count(self.dropped, codes)
+                return True
+            item = [handler, args, key]
+            self._coalesce[key] = item
+            self._info.append(item)
+        else:
+            if self.depth() >= self._maxsize:
+                if self._info:
+                    self._evict_info()
+                elif not force:
+                    self._not_full.clear()
+                    return False
+            self._alarms.append([handler, args, None])
+
+        depth = self.depth()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        self._not_empty.set()
+        return True
+
+    async def put(self, handler: Callable, args: tuple, codes: list, channel=None):
+        """ Queues handler(*args), waits for room in the queue if it's full of alarms """
+        while not self.put_nowait(handler, args, codes, channel):
+            self.waits += 1
+            await self._not_full.wait()
+
+    def put_threadsafe(self, handler: Callable, args: tuple, codes: list, channel=None):
+        """ Queues handler(*args) from another thread. We can't wait here so alarms are always accepted """
+        self._hass.loop.call_soon_threadsafe(self.put_nowait, handler, args, codes, channel, True)
+
+    def _evict_info(self):
+        """ Drops the oldest informational item to make room for an alarm """
+        item = self._info.popleft()
+        self._coalesce.pop(item[2], None)
+        self._count(self.dropped, item[2][1])
+
+    @staticmethod
+    def _count(counters: Dict[str, int], codes):
+        for code in codes:
+            counters[code] = counters.get(code, 0) + 1
+
+    async def _async_dispatch(self):
+        """ Takes items off the queue and calls their handlers """
+        dispatched = 0
+        while True:
+            if self._alarms:
+                item = self._alarms.popleft()
+            elif self._info:
+                item = self._info.popleft()
+                self._coalesce.pop(item[2], None)
+            else:
+                self._not_empty.clear()
+                self._not_full.set()
+                dispatched = 0
+                await self._not_empty.wait()
+                continue
+
+            try:
+                item[0](*item[1])
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to process event from %s", self.name)
+
+            self.processed += 1
+            if self.depth() < self._maxsize:
+                self._not_full.set()
+
+            dispatched += 1
+            if dispatched >= DISPATCH_BATCH_SIZE:
+                # Don't hog the loop during a burst
+                dispatched = 0
+                await asyncio.sleep(0)
+
+    def as_dict(self) -> dict:
+        """ Returns the queue stats as a dictionary, useful for diagnostics """
+        return {
+            "name": self.name,
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "size": self._maxsize,
+            "processed": self.processed,
+            "dropped": dict(self.dropped),
+            "coalesced": dict(self.coalesced),
+            "waits": self.waits,
+        }
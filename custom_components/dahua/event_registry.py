@@ -0,0 +1,100 @@
+"""
+Publish/subscribe registry for Dahua events, indexed by (event name, channel)
+"""
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from .models import DahuaEvent
+
+_LOGGER: logging.Logger = logging.getLogger(__package__)
+
+
+class EventState:
+    """ The state of one (event name, channel): if it's active, since when and the last event received """
+    __slots__ = ("active", "since", "last_event", "last_event_time")
+
+    def __init__(self):
+        self.active = False
+        # Epoch seconds of when the event became active, 0 when not active
+        self.since = 0.0
+        self.last_event: Optional[DahuaEvent] = None
+        self.last_event_time = 0.0
+
+
+class DahuaEventRegistry:
+    """
+    DahuaEventRegistry dispatches events to subscribers by (event name, channel) and keeps a single EventState per key.
+
+    Any number of subscribers can subscribe to a key. Subscribing with event_name None subscribes to all events of a
+    channel (wildcard). subscribe returns a function that removes the subscription, entities pass it to async_on_remove.
+    Subscribers are called with the DahuaEvent after the state was updated.
+    """
+
+    def __init__(self):
+        # Subscribers are kept in tuples that are replaced on (un)subscribe, so (un)subscribing while dispatching is safe
+        self._subscribers: Dict[tuple, tuple] = {}
+        self._channel_subscribers: Dict[int, tuple] = {}
+        self._states: Dict[tuple, EventState] = {}
+
+    def subscribe(self, event_name: Optional[str], channel: int, callback: Callable[[DahuaEvent], None]) \
+            -> Callable[[], None]:
+        """ Subscribes callback to events with the given name and channel. Returns a function to unsubscribe """
+        if event_name is None:
+            subscribers, key = self._channel_subscribers, channel
+        else:
+            subscribers, key = self._subscribers, (event_name, channel)
+        subscribers[key] = subscribers.get(key, ()) + (callback,)
+
+        def unsubscribe():
+            remaining = tuple(cb for cb in subscribers.get(key, ()) if cb is not callback)
+            if remaining:
+                subscribers[key] = remaining
+            else:
+                subscribers.pop(key, None)
+
+        return unsubscribe
+
+    def is_subscribed(self, key: tuple) -> bool:
+        """ True if something subscribed to exactly this (event name, channel) """
+        return key in self._subscribers
+
+    def has_subscribers(self, key: tuple) -> bool:
+        """ True if something subscribed to this (event name, channel), including channel wide subscribers """
+        return key in self._subscribers or key[1] in self._channel_subscribers
+
+    def get_state(self, key: tuple) -> Optional[EventState]:
+        """ Returns the state of the (event name, channel), None if no event was received for it yet """
+        return self._states.get(key)
+
+    def states(self) -> Dict[tuple, EventState]:
+        """ Returns all states by (event name, channel) """
+        return self._states
+
+    def dispatch(self, event: DahuaEvent, active: Optional[bool] = None):
+        """
+        Updates the state of the event's key and calls its subscribers. active is True when the event starts, False when
+        it stops and None if the event doesn't change the state (for example informational events)
+        """
+        key = event.key
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = EventState()
+        now = time.time()
+        state.last_event = event
+        state.last_event_time = now
+        if active is not None and active != state.active:
+            state.active = active
+            state.since = now if active else 0.0
+
+        for callback in self._subscribers.get(key, ()):
+            self._call(callback, event)
+        for callback in self._channel_subscribers.get(key[1], ()):
+            self._call(callback, event)
+
+    @staticmethod
+    def _call(callback, event: DahuaEvent):
+        try:
+            callback(event)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error in event subscriber for %s", event)
@@ -0,0 +1,55 @@
+"""
+Ring buffer of the last raw frames of the event stream (HTTP) and VTO (DHIP) links, for diagnostics
+"""
+from collections import deque
+import re
+import time
+from typing import List
+
+# The number of frames kept per device, the oldest are dropped first
+FRAME_BUFFER_SIZE = 50
+# Frames are cut to this many bytes when read, they're kept whole
+MAX_FRAME_BYTES = 4096
+
+FRAME_EVENT_STREAM = "event_stream"
+FRAME_DHIP_IN = "dhip_in"
+FRAME_DHIP_OUT = "dhip_out"
+
+REDACTED = "**REDACTED**"
+
+# Credentials in the frames: the DHIP login sends the user name and password hash, the challenge has the random and
+# realm the hash is made of
+_JSON_SECRETS = re.compile(r'("(?:userName|password|random|realm|Password|UserName)"\s*:\s*)"[^"]*"')
+_TEXT_SECRETS = re.compile(r"((?:password|username|user|pwd)=)[^&;\s]*", re.IGNORECASE)
+_NON_PRINTABLE = re.compile(r"[^\t\n\r\x20-\x7e]")
+
+
+class FrameRecorder:
+    """
+    FrameRecorder keeps references to the last FRAME_BUFFER_SIZE frames as they were received or sent. Recording is a
+    deque append (thread safe, the VTO runs in its own thread). Frames are only decoded and redacted when read
+    """
+
+    def __init__(self, size: int = FRAME_BUFFER_SIZE):
+        self._frames: deque = deque(maxlen=size)
+        self.recorded = 0
+
+    def record(self, source: str, data: bytes):
+        self._frames.append((time.time(), source, data))
+        self.recorded += 1
+
+    def as_list(self) -> List[dict]:
+        """ Returns the frames, oldest first, as text with the credentials redacted """
+        return [{"time": timestamp, "source": source, "size": len(data), "data": redact_frame(data)}
+                for timestamp, source, data in list(self._frames)]
+
+
+def redact_frame(data: bytes) -> str:
+    """ Returns the frame as text, cut to MAX_FRAME_BYTES, with credentials redacted and binary bytes escaped """
+    text = data[:MAX_FRAME_BYTES].decode("utf-8", errors="backslashreplace")
+    text = _JSON_SECRETS.sub(r'\1"' + REDACTED + '"', text)
+    text = _TEXT_SECRETS.sub(r"\1" + REDACTED, text)
+    text = _NON_PRINTABLE.sub(lambda match: "\\x{0:02x}".format(ord(match.group(0))), text)
+    if len(data) > MAX_FRAME_BYTES:
+        text += "..."
+    return text
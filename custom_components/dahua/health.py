@@ -0,0 +1,74 @@
+"""
+Health of a device for the health sensors: poll durations, request errors and event throughput, sampled from in memory
+counters so they cost no requests to the device
+"""
+from collections import deque
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# How often the counters are sampled and the health sensors updated
+HEALTH_UPDATE_SECONDS = 60
+# The request error rate is over the last this many samples (10 minutes)
+HEALTH_WINDOW_SAMPLES = 10
+
+
+class DeviceHealth:
+    """
+    DeviceHealth counts the events of a device by code and samples them, with the request counters of the client, every
+    HEALTH_UPDATE_SECONDS. Rates are the differences between samples, so nothing is kept per event or request
+    """
+
+    def __init__(self):
+        # The number of events received per code since we started
+        self.event_counts: Dict[str, int] = {}
+        # How long the last poll took in seconds, None until the first poll is done
+        self.last_poll_duration: Optional[float] = None
+        # (monotonic time, requests, request errors, event counts per code)
+        self._samples: deque = deque(maxlen=HEALTH_WINDOW_SAMPLES + 1)
+        self._listeners: List[Callable[[], None]] = []
+
+    def count_event(self, code: str):
+        self.event_counts[code] = self.event_counts.get(code, 0) + 1
+
+    def poll_done(self, seconds: float):
+        self.last_poll_duration = seconds
+
+    def add_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """ Adds a listener called after every sample, returns a function removing it """
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def sample(self, requests: int, request_errors: int):
+        """ Takes a sample of the counters and calls the listeners """
+        self._samples.append((time.monotonic(), requests, request_errors, dict(self.event_counts)))
+        for listener in list(self._listeners):
+            listener()
+
+    def request_error_rate(self) -> Optional[float]:
+        """ Returns the percentage of requests that failed over the window, None if there were no requests """
+        if len(self._samples) < 2:
+            return None
+        _, first_requests, first_errors, _ = self._samples[0]
+        _, last_requests, last_errors, _ = self._samples[-1]
+        requests = last_requests - first_requests
+        if requests <= 0:
+            return None
+        return 100.0 * (last_errors - first_errors) / requests
+
+    def events_per_minute(self) -> Tuple[Optional[float], Dict[str, float]]:
+        """ Returns the number of events per minute between the last two samples, in total and by code """
+        if len(self._samples) < 2:
+            return None, {}
+        previous_time, _, _, previous_counts = self._samples[-2]
+        last_time, _, _, last_counts = self._samples[-1]
+        minutes = (last_time - previous_time) / 60
+        if minutes <= 0:
+            return None, {}
+        by_code = {}
+        total = 0
+        for code, count in last_counts.items():
+            delta = count - previous_counts.get(code, 0)
+            if delta:
+                by_code[code] = round(delta / minutes, 1)
+                total += delta
+        return round(total / minutes, 1), by_code
@@ -0,0 +1,163 @@
+"""
+In memory history of the recent events of a device, indexed for quick queries by event and channel
+"""
+from bisect import bisect_left, bisect_right
+import heapq
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .models import DahuaEvent
+
+# The number of events kept per device, the oldest are dropped first
+HISTORY_SIZE = 2048
+
+# Index lists are trimmed once this many evicted entries piled up at their start
+_TRIM_THRESHOLD = 64
+
+
+class EventRecord:
+    """ A compact record of an event: when, what, on which channel and the action """
+    __slots__ = ("seq", "time", "code", "name", "channel", "action")
+
+    def __init__(self, seq: int, timestamp: float, code: str, name: str, channel: int, action: str):
+        self.seq = seq
+        self.time = timestamp
+        self.code = code
+        # The event name the event was dispatched as, see translate_event_code. Usually the code
+        self.name = name
+        self.channel = channel
+        self.action = action
+
+    def as_dict(self) -> dict:
+        record = {"time": self.time, "code": self.code, "action": self.action, "index": self.channel}
+        if self.name != self.code:
+            record["name"] = self.name
+        return record
+
+
+class _KeyIndex:
+    """ The records of one (event name or code, channel) in time order. Evicted records are skipped by start """
+    __slots__ = ("times", "records", "start")
+
+    def __init__(self):
+        self.times: List[float] = []
+        self.records: List[EventRecord] = []
+        self.start = 0
+
+    def append(self, record: EventRecord):
+        self.times.append(record.time)
+        self.records.append(record)
+
+    def evict(self):
+        """ Drops the oldest record """
+        self.start += 1
+        if self.start >= _TRIM_THRESHOLD and self.start * 2 >= len(self.records):
+            del self.times[:self.start]
+            del self.records[:self.start]
+            self.start = 0
+
+    def __len__(self):
+        return len(self.records) - self.start
+
+    def between(self, since: Optional[float], until: Optional[float]) -> range:
+        """ Returns the positions of the records from since up to and including until, by binary search """
+        first = self.start if since is None else bisect_left(self.times, since, self.start)
+        last = len(self.times) if until is None else bisect_right(self.times, until, self.start)
+        return range(first, last)
+
+
+class EventHistory:
+    """
+    EventHistory keeps the last HISTORY_SIZE events of a device in a ring buffer. Each event is indexed by its code and
+    channel, and also by its event name when that differs (SmartMotionHuman for a CrossRegionDetection, DoorbellPressed
+    for a BackKeyLight). An index keeps its records in time order so queries are binary searches, not scans. When the
+    ring is full the oldest record is overwritten and dropped from the start of its indexes.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self._ring: List[Optional[EventRecord]] = [None] * size
+        self._seq = 0
+        self._last_time = 0.0
+        self._index: Dict[tuple, _KeyIndex] = {}
+
+    def __len__(self):
+        return min(self._seq, len(self._ring))
+
+    def add(self, event: DahuaEvent):
+        """ Records an event, after it was dispatched so its event name is known """
+        # Times must not go backwards for the binary searches, the clock can be adjusted
+        now = max(time.time(), self._last_time)
+        self._last_time = now
+        slot = self._seq % len(self._ring)
+        evicted = self._ring[slot]
+        if evicted is not None:
+            for key in self._keys(evicted):
+                index = self._index[key]
+                index.evict()
+                if not index:
+                    del self._index[key]
+
+        record = EventRecord(self._seq, now, event.code, event.key[0], event.channel, event.action_name)
+        self._ring[slot] = record
+        self._seq += 1
+        for key in self._keys(record):
+            index = self._index.get(key)
+            if index is None:
+                index = self._index[key] = _KeyIndex()
+            index.append(record)
+
+    @staticmethod
+    def _keys(record: EventRecord):
+        if record.name == record.code:
+            return ((record.code, record.channel),)
+        return (record.code, record.channel), (record.name, record.channel)
+
+    def _matching(self, event: Optional[str], channel: Optional[int]) -> List[_KeyIndex]:
+        """ Returns the indexes of the event (code or name) and channel, None matches any """
+        if event is not None and channel is not None:
+            index = self._index.get((event, channel))
+            return [index] if index is not None else []
+        return [index for (name, index_channel), index in self._index.items()
+                if (event is None or name == event) and (channel is None or index_channel == channel)]
+
+    def query(self, event: str = None, channel: int = None, since: float = None, until: float = None,
+              action: str = None, limit: int = None) -> List[EventRecord]:
+        """
+        Returns the records of the event (code or event name) and channel between since and until (epoch seconds),
+        newest first. None matches anything
+        """
+        iterators = [self._newest_first(index, since, until, action) for index in self._matching(event, channel)]
+        result = []
+        previous = None
+        # A record can be in two indexes (its code and its event name), these come out of the merge next to each other
+        for record in heapq.merge(*iterators, key=lambda record: -record.seq):
+            if record is previous:
+                continue
+            if limit is not None and len(result) >= limit:
+                break
+            result.append(record)
+            previous = record
+        return result
+
+    @staticmethod
+    def _newest_first(index: _KeyIndex, since, until, action) -> Iterator[EventRecord]:
+        records = index.records
+        for position in reversed(index.between(since, until)):
+            record = records[position]
+            if action is None or record.action == action:
+                yield record
+
+    def count(self, event: str = None, channel: int = None, since: float = None, action: str = None) -> int:
+        """ Returns the number of records of the event and channel since the time """
+        if action is None and event is not None:
+            return sum(len(index.between(since, None)) for index in self._matching(event, channel))
+        return len(self.query(event, channel, since=since, action=action))
+
+    def last(self, event: str, channel: int, action: str = None) -> Optional[EventRecord]:
+        """ Returns the latest record of the event and channel, optionally with the given action """
+        records = self.query(event, channel, action=action, limit=1)
+        return records[0] if records else None
+
+    def as_dict(self) -> dict:
+        """ Returns the size of the history, useful for diagnostics """
+        return {"size": len(self._ring), "records": len(self), "indexes": len(self._index)}
@@ -0,0 +1,250 @@
+"""
+Append only journal of the events received from all Dahua devices, for incident review. Separate from the recorder
+"""
+import asyncio
+from collections import deque
+import json
+import logging
+import os
+import struct
+import time
+from typing import Any, Iterator, List, Optional
+
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN_DATA
+from .models import DahuaEvent
+from .timer_wheel import WheelTimer, get_timer_wheel
+
+_LOGGER: logging.Logger = logging.getLogger(__package__)
+
+# The journal is kept in this directory under .storage
+JOURNAL_DIRECTORY = "dahua_journal"
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".seg"
+
+# Pending events are written every FLUSH_SECONDS, or right away when BATCH_SIZE events are pending
+FLUSH_SECONDS = 5
+BATCH_SIZE = 500
+# At most this many events wait to be written, the oldest are dropped when the disk can't keep up
+MAX_PENDING = 20000
+
+# A new segment is started when the current one is this big or this old
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+SEGMENT_MAX_SECONDS = 3600
+# Segments older than this are deleted, and the oldest segments are deleted while the journal is bigger than this
+RETENTION_SECONDS = 30 * 86400
+RETENTION_BYTES = 256 * 1024 * 1024
+# How often the retention is applied
+RETENTION_CHECK_SECONDS = 300
+
+# Each record is its length as a 4 byte big endian unsigned int followed by that many bytes of JSON:
+# [time, device name, code, action, index, data]
+_LENGTH = struct.Struct(">I")
+
+
+class EventJournal:
+    """
+    EventJournal appends events to rotated segment files of length prefixed records. It's shared by all devices.
+
+    Events are only queued on the event loop, with their data as received when nothing decoded it yet. They're encoded
+    and written in batches in the executor, one batch at a time, so the loop never waits for the disk nor decodes JSON.
+    The queue is bounded, so memory stays constant when the disk is slow.
+    Segments are rotated by size and age and deleted by the retention policy.
+    """
+
+    def __init__(self, hass: HomeAssistant, directory: str):
+        self._hass = hass
+        self._directory = directory
+        self._pending: deque = deque(maxlen=MAX_PENDING)
+        self._flush_timer: Optional[WheelTimer] = None
+        # The task writing a batch, there's at most one so writes never run concurrently
+        self._write_task: Optional[asyncio.Task] = None
+        # Only used in the executor
+        self._segment = None
+        self._segment_path: Optional[str] = None
+        self._segment_started = 0.0
+        self._retention_checked = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def append(self, device_name: str, event: DahuaEvent):
+        """ Queues an event to be written """
+        if len(self._pending) == MAX_PENDING:
+            self.dropped += 1
+        raw_data = event.raw_data()
+        data = event.data if raw_data is None and event.has_data() else None
+        self._pending.append((time.time(), device_name, event.code, event.action_name, event.channel, data, raw_data))
+        if len(self._pending) >= BATCH_SIZE:
+            self._flush()
+        elif self._flush_timer is None and self._write_task is None:
+            self._flush_timer = get_timer_wheel(self._hass).schedule(FLUSH_SECONDS, self._flush)
+
+    def _flush(self):
+        """ Writes the pending events in the executor, unless a write is still going on """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._write_task is not None or not self._pending:
+            return
+        batch = list(self._pending)
+        self._pending.clear()
+        self._write_task = self._hass.async_create_task(self._async_write(batch))
+
+    async def _async_write(self, batch: List[tuple], close: bool = False):
+        try:
+            await self._hass.async_add_executor_job(self._write, batch, close)
+        except Exception as exception:  # pylint: disable=broad-except
+            self.errors += 1
+            _LOGGER.warning("Failed to write %d events to the event journal: %s", len(batch), exception)
+        finally:
+            self._write_task = None
+        # Events that came in while writing
+        if len(self._pending) >= BATCH_SIZE:
+            self._flush()
+        elif self._pending and self._flush_timer is None:
+            self._flush_timer = get_timer_wheel(self._hass).schedule(FLUSH_SECONDS, self._flush)
+
+    async def async_flush(self):
+        """ Writes all pending events and closes the segment, for when Home Assistant stops """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        while self._write_task is not None:
+            await self._write_task
+        batch = list(self._pending)
+        self._pending.clear()
+        self._write_task = self._hass.async_create_task(self._async_write(batch, close=True))
+        await self._write_task
+
+    def _write(self, batch: List[tuple], close: bool = False):
+        """ Runs in the executor. Encodes and appends the batch to the current segment, closing it if asked """
+        if batch:
+            self._append(batch)
+        if close and self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _append(self, batch: List[tuple]):
+        now = time.time()
+        if self._segment is None or self._segment.tell() >= SEGMENT_MAX_BYTES \
+                or now - self._segment_started >= SEGMENT_MAX_SECONDS:
+            self._rotate(now)
+
+        chunks = []
+        for record in batch:
+            payload = _encode(record)
+            chunks.append(_LENGTH.pack(len(payload)))
+            chunks.append(payload)
+        self._segment.write(b"".join(chunks))
+        self._segment.flush()
+        self.written += len(batch)
+
+        if now - self._retention_checked >= RETENTION_CHECK_SECONDS:
+            self._retention_checked = now
+            self._apply_retention(now)
+
+    def _rotate(self, now: float):
+        if self._segment is not None:
+            self._segment.close()
+        os.makedirs(self._directory, exist_ok=True)
+        name = "{0}{1}{2}".format(SEGMENT_PREFIX, int(now * 1000), SEGMENT_SUFFIX)
+        self._segment_path = os.path.join(self._directory, name)
+        self._segment = open(self._segment_path, "ab")
+        self._segment_started = now
+
+    def _apply_retention(self, now: float):
+        """ Deletes segments older than RETENTION_SECONDS, then the oldest while the journal is over RETENTION_BYTES """
+        segments = []
+        for name in list_segments(self._directory):
+            path = os.path.join(self._directory, name)
+            if path == self._segment_path:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            segments.append((path, stat.st_mtime, stat.st_size))
+
+        total = sum(size for _, _, size in segments) + (self._segment.tell() if self._segment is not None else 0)
+        for path, modified, size in segments:
+            if now - modified < RETENTION_SECONDS and total <= RETENTION_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as exception:
+                _LOGGER.debug("Failed to remove journal segment %s: %s", path, exception)
+
+    def as_dict(self) -> dict:
+        """ Returns the journal counters, useful for diagnostics """
+        return {
+            "directory": self._directory,
+            "pending": len(self._pending),
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+def _encode(record: tuple) -> bytes:
+    """
+    Returns the JSON of a queued record. Data received as JSON text is written as is when it's valid JSON, otherwise
+    as a JSON string (devices send truncated or invalid data) so the record can always be read back
+    """
+    raw_data = record[6]
+    if raw_data is None:
+        return json.dumps(record[:6], separators=(",", ":"), default=str).encode("utf-8")
+    try:
+        json.loads(raw_data)
+    except ValueError:
+        raw_data = json.dumps(raw_data)
+    head = json.dumps(record[:5], separators=(",", ":"), default=str)
+    return "{0},{1}]".format(head[:-1], raw_data).encode("utf-8")
+
+
+def list_segments(directory: str) -> List[str]:
+    """ Returns the file names of the segments in the directory, oldest first """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = [name for name in names if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+    return sorted(segments, key=lambda name: int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)] or 0))
+
+
+def read_segment(path: str) -> Iterator[List[Any]]:
+    """
+    Yields the records of a segment: [time, device name, code, action, index, data]. Stops at a torn record, skips
+    corrupt records with a warning
+    """
+    skipped = 0
+    try:
+        with open(path, "rb") as segment:
+            while True:
+                header = segment.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    return
+                length = _LENGTH.unpack(header)[0]
+                payload = segment.read(length)
+                if len(payload) < length:
+                    return
+                try:
+                    record = json.loads(payload)
+                except ValueError:
+                    skipped += 1
+                    continue
+                yield record
+    finally:
+        if skipped:
+            _LOGGER.warning("Skipped %d corrupt records in journal segment %s", skipped, path)
+
+
+def get_event_journal(hass: HomeAssistant) -> EventJournal:
+    """ Returns the event journal shared by all Dahua devices, it's created on first use """
+    data = hass.data.setdefault(DOMAIN_DATA, {})
+    journal: Optional[EventJournal] = data.get("event_journal")
+    if journal is None:
+        journal = data["event_journal"] = EventJournal(hass, hass.config.path(".storage", JOURNAL_DIRECTORY))
+    return journal
@@ -0,0 +1,187 @@
+"""
+End to end event latency, from the device detecting an event to our entities being written, split into stages
+"""
+from datetime import datetime
+import math
+import time
+from typing import Dict, List, Optional
+
+from .models import DahuaEvent
+
+# The stages of an event. The device stamps the event (UTC, UTCMS), we read it from the socket, parse it, fire it on the
+# HA event bus and dispatch it to the entities, which write their state
+STAGE_DEVICE_TO_SOCKET = "device_to_socket"
+STAGE_SOCKET_TO_PARSE = "socket_to_parse"
+STAGE_PARSE_TO_BUS = "parse_to_bus"
+STAGE_BUS_TO_ENTITY = "bus_to_entity"
+STAGE_TOTAL = "device_to_entity"
+STAGES = (STAGE_DEVICE_TO_SOCKET, STAGE_SOCKET_TO_PARSE, STAGE_PARSE_TO_BUS, STAGE_BUS_TO_ENTITY, STAGE_TOTAL)
+
+PERCENTILES = (50, 90, 99)
+
+# Histogram buckets grow by this factor starting at HISTOGRAM_MIN_SECONDS. 24 buckets of x2 from 0.1ms go up to ~14
+# minutes, anything above lands in the last bucket
+HISTOGRAM_MIN_SECONDS = 0.0001
+HISTOGRAM_FACTOR = 2.0
+HISTOGRAM_BUCKETS = 24
+
+# The device clock is read again after this many seconds
+CLOCK_OFFSET_REFRESH_SECONDS = 600
+# The device clock is read in its own time zone, which might not be ours. Offsets are taken modulo a quarter hour (time
+# zones are whole quarter hours apart), so only drift of less than half of it is measured
+TIME_ZONE_STEP_SECONDS = 900
+# Some firmwares send the local time in the UTC field. If the event time is off by more than this but matches once
+# corrected by the time zone offset, the UTC field is taken as local time
+UTC_AS_LOCAL_THRESHOLD_SECONDS = 900
+
+
+class LatencyHistogram:
+    """ Latencies in log spaced buckets, fixed size whatever the number of samples. Percentiles are interpolated """
+    __slots__ = ("counts", "count", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.counts = [0] * (HISTOGRAM_BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds: float):
+        if seconds < 0:
+            seconds = 0.0
+        if seconds < HISTOGRAM_MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(HISTOGRAM_BUCKETS, 1 + int(math.log(seconds / HISTOGRAM_MIN_SECONDS, HISTOGRAM_FACTOR)))
+        self.counts[bucket] += 1
+        if self.count == 0 or seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.count += 1
+        self.total += seconds
+
+    @staticmethod
+    def _bounds(bucket: int):
+        if bucket == 0:
+            return 0.0, HISTOGRAM_MIN_SECONDS
+        lower = HISTOGRAM_MIN_SECONDS * HISTOGRAM_FACTOR ** (bucket - 1)
+        return lower, lower * HISTOGRAM_FACTOR
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """ Returns the latency in seconds below which percent of the samples are, None without samples """
+        if self.count == 0:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower, upper = self._bounds(bucket)
+                lower = max(lower, self.minimum)
+                upper = min(upper, self.maximum)
+                return lower + (upper - lower) * max(0.0, rank - seen) / count
+            seen += count
+        return self.maximum
+
+    def as_dict(self) -> dict:
+        """ Returns the count, mean, max and percentiles in milliseconds """
+        result = {"count": self.count}
+        if self.count:
+            result["mean_ms"] = round(self.total / self.count * 1000, 3)
+            result["max_ms"] = round(self.maximum * 1000, 3)
+            for percent in PERCENTILES:
+                result["p{0}_ms".format(percent)] = round(self.percentile(percent) * 1000, 3)
+        return result
+
+
+def event_device_time(event: DahuaEvent) -> Optional[float]:
+    """ Returns when the device says the event happened, epoch seconds from UTC and UTCMS. None if it doesn't say """
+    data = event.data_dict()
+    utc = data.get("UTC")
+    if isinstance(utc, bool) or not isinstance(utc, (int, float)) or utc <= 0:
+        return None
+    utcms = data.get("UTCMS")
+    if isinstance(utcms, (int, float)) and not isinstance(utcms, bool) and 0 <= utcms < 1000:
+        return float(int(utc)) + utcms / 1000.0
+    return float(utc)
+
+
+def parse_device_time(text: str, time_zone) -> float:
+    """ Parses the device time from getCurrentTime, for example 2021-7-3 21:02:32, in the time zone. Raises ValueError """
+    return datetime.strptime(text.strip(), "%Y-%m-%d %H:%M:%S").replace(tzinfo=time_zone).timestamp()
+
+
+class LatencyTracker:
+    """
+    LatencyTracker keeps a histogram per stage for a device. Device times are corrected by the device clock offset (how
+    far the device clock is ahead of ours), read from the device every CLOCK_OFFSET_REFRESH_SECONDS.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in STAGES}
+        # Seconds the device clock is ahead of ours, None until it was read
+        self.clock_offset: Optional[float] = None
+        # How far off the offset can be, the device time has whole seconds and the request takes time
+        self.clock_offset_error: Optional[float] = None
+        self._clock_read: Optional[float] = None
+        # True if the device puts its local time in the UTC field
+        self.utc_is_local = False
+
+    def should_read_clock(self) -> bool:
+        """ True when the device clock is due to be read, at most every CLOCK_OFFSET_REFRESH_SECONDS """
+        now = time.monotonic()
+        if self._clock_read is not None and now - self._clock_read < CLOCK_OFFSET_REFRESH_SECONDS:
+            return False
+        self._clock_read = now
+        return True
+
+    def set_clock_offset(self, device_time: float, requested: float, responded: float):
+        """ Sets the clock offset from a device time read between the requested and responded times (epoch) """
+        offset = device_time - (requested + responded) / 2
+        half_step = TIME_ZONE_STEP_SECONDS / 2
+        self.clock_offset = (offset + half_step) % TIME_ZONE_STEP_SECONDS - half_step
+        # The device time has whole seconds
+        self.clock_offset_error = 0.5 + (responded - requested) / 2
+
+    def event_time(self, event: DahuaEvent, received: float) -> Optional[float]:
+        """ Returns when the event happened on our clock, None if the device didn't say or we can't tell """
+        device_time = event_device_time(event)
+        if device_time is None or self.clock_offset is None:
+            return None
+        event_time = device_time - self.clock_offset
+        utc_offset = time.localtime(received).tm_gmtoff
+        if self.utc_is_local:
+            return event_time - utc_offset
+        if utc_offset and abs(received - event_time) > UTC_AS_LOCAL_THRESHOLD_SECONDS \
+                and abs(received - event_time + utc_offset) < UTC_AS_LOCAL_THRESHOLD_SECONDS:
+            self.utc_is_local = True
+            return event_time - utc_offset
+        return event_time
+
+    def observe(self, stage: str, seconds: float):
+        self.histograms[stage].add(seconds)
+
+    def observe_event(self, event: DahuaEvent, received: float, parsed: float, fired: float, dispatched: float):
+        """ Adds the stages of an event, all times are epoch seconds on our clock """
+        histograms = self.histograms
+        histograms[STAGE_SOCKET_TO_PARSE].add(parsed - received)
+        histograms[STAGE_PARSE_TO_BUS].add(fired - parsed)
+        histograms[STAGE_BUS_TO_ENTITY].add(dispatched - fired)
+        event_time = self.event_time(event, received)
+        if event_time is not None:
+            histograms[STAGE_DEVICE_TO_SOCKET].add(received - event_time)
+            histograms[STAGE_TOTAL].add(dispatched - event_time)
+
+    def percentiles(self, stage: str) -> List[Optional[float]]:
+        """ Returns the PERCENTILES of the stage in seconds """
+        histogram = self.histograms[stage]
+        return [histogram.percentile(percent) for percent in PERCENTILES]
+
+    def as_dict(self) -> dict:
+        """ Returns the clock offset and the stats of every stage, useful for diagnostics """
+        return {
+            "clock_offset": None if self.clock_offset is None else round(self.clock_offset, 3),
+            "clock_offset_error": None if self.clock_offset_error is None else round(self.clock_offset_error, 3),
+            "utc_is_local": self.utc_is_local,
+            "stages": {stage: histogram.as_dict() for stage, histogram in self.histograms.items()},
+        }
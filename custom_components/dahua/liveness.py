@@ -0,0 +1,60 @@
+"""
+Device liveness derived from the event stream heartbeats and VTO keep alives
+"""
+import time
+from typing import Optional
+
+# The event stream is attached with heartbeat=5, so the device sends us something at least every 5 seconds
+EVENT_STREAM_HEARTBEAT_SECONDS = 5
+# After this many seconds without a heartbeat (2 missed heartbeats plus some slack) we consider the device dead
+EVENT_STREAM_TIMEOUT_SECONDS = EVENT_STREAM_HEARTBEAT_SECONDS * 2 + 2
+# Extra time on top of the VTO keep alive interval before we consider the VTO dead
+VTO_TIMEOUT_SLACK_SECONDS = 10
+
+
+class DeviceLiveness:
+    """
+    DeviceLiveness tells if a device is alive based on the traffic we get from it. Every heartbeat, keep alive or event
+    calls seen() with how long that signal is good for. Once that time passes without a new signal the device is
+    considered dead.
+
+    Until the first signal arrives (for example the device doesn't support the event stream) liveness is unknown and
+    availability falls back to the poll results.
+    """
+
+    def __init__(self):
+        # monotonic time until which the device is considered alive. None while we are not tracking heartbeats
+        self._alive_until: Optional[float] = None
+        # Epoch time of the last signal, for diagnostics
+        self.last_seen: Optional[float] = None
+        self._last_state: Optional[bool] = None
+
+    def seen(self, valid_for: float):
+        """ Records a sign of life from the device that is good for valid_for seconds """
+        alive_until = time.monotonic() + valid_for
+        if self._alive_until is None or alive_until > self._alive_until:
+            self._alive_until = alive_until
+        self.last_seen = time.time()
+
+    def reset(self):
+        """ Stops tracking until the next heartbeat arrives, liveness will be unknown until then """
+        self._alive_until = None
+
+    def is_alive(self) -> Optional[bool]:
+        """ True if alive, False if the heartbeats stopped and None if we don't track heartbeats for this device """
+        if self._alive_until is None:
+            return None
+        return time.monotonic() <= self._alive_until
+
+    def check(self) -> bool:
+        """ Returns true if the liveness changed since the last call to check """
+        state = self.is_alive()
+        changed = state != self._last_state
+        self._last_state = state
+        return changed
+
+    def last_seen_age(self) -> Optional[float]:
+        """ Number of seconds since we last heard from the device, None if never """
+        if self.last_seen is None:
+            return None
+        return time.time() - self.last_seen
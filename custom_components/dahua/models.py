@@ -1,5 +1,8 @@
 from dataclasses import dataclass, InitVar
-from typing import Any
+from enum import IntEnum
+import json
+import sys
+from typing import Any, Callable, List, Optional
 
 
 @dataclass(unsafe_hash=True)
@@ -12,3 +15,124 @@ class CoaxialControlIOStatus:
         if api_response is not None:
             self.speaker = api_response["params"]["status"]["Speaker"] == "On"
             self.white_light = api_response["params"]["status"]["WhiteLight"] == "On"
+
+
+class EventAction(IntEnum):
+    """ The action of an event """
+    UNKNOWN = 0
+    START = 1
+    STOP = 2
+    PULSE = 3
+    STATE = 4
+
+
+EVENT_ACTIONS = {
+    "Start": EventAction.START,
+    "Stop": EventAction.STOP,
+    "Pulse": EventAction.PULSE,
+    "State": EventAction.STATE,
+}
+
+# Where an event came from
+EVENT_SOURCE_STREAM = 0
+EVENT_SOURCE_VTO = 1
+# Created by us to clear an event that didn't stop in time, these are never fired on the HA event bus
+EVENT_SOURCE_EXPIRED = 2
+
+
+class DahuaEvent:
+    """
+    DahuaEvent is a single event from the event stream (eventManager.cgi) or a VTO. Events are created for every event
+    the device sends us so this is kept small: the code is interned, the channel is an int, the action is parsed once,
+    the JSON data is only decoded when something reads it and the key used to dispatch the event to listeners is
+    computed once. to_dict returns the dictionary fired on the HA event bus.
+    """
+    __slots__ = ("code", "channel", "action", "action_name", "key", "source", "zones", "_data", "_raw_data", "_fields")
+
+    def __init__(self, code: str, channel: int, action_name: str, data: Any = None, raw_data: str = None,
+                 fields: dict = None, source: int = EVENT_SOURCE_STREAM):
+        self.code = sys.intern(code)
+        self.channel = channel
+        self.action_name = action_name
+        self.action = EVENT_ACTIONS.get(action_name, EventAction.UNKNOWN)
+        # The key listeners are registered with, (event name, channel). The event name starts out as the code, see
+        # set_event_name
+        self.key = (self.code, channel)
+        self.source = source
+        # The names of the spatial zones the objects of the event are in, set by the coordinator (see zones.py)
+        self.zones: Optional[List[str]] = None
+        self._data = data
+        # The undecoded JSON data, decoded on first access of data
+        self._raw_data = raw_data
+        # The event as received from a VTO, the event stream only has code, action, index and data
+        self._fields = fields
+
+    @classmethod
+    def from_vto_message(cls, message: dict, channel: int):
+        """ Creates an event from a VTO event, example: {"Action": "Pulse", "Code": "DoorStatus", "Data": {...}} """
+        return cls(message.get("Code", ""), channel, message.get("Action", ""), data=message.get("Data", {}),
+                   fields=message, source=EVENT_SOURCE_VTO)
+
+    @property
+    def data(self) -> Any:
+        """ The event data (payload), decoded from JSON on first access. An empty dict if the event has no data """
+        if self._raw_data is not None:
+            try:
+                self._data = json.loads(self._raw_data)
+            except ValueError:
+                # Keep the data as we got it, same as the event bus always did
+                self._data = self._raw_data
+            self._raw_data = None
+        if self._data is None:
+            return {}
+        return self._data
+
+    def data_dict(self) -> dict:
+        """ Returns the data if it's a JSON object, otherwise an empty dict """
+        data = self.data
+        return data if isinstance(data, dict) else {}
+
+    def has_data(self) -> bool:
+        """ True if the event came with data """
+        return self._raw_data is not None or self._data is not None
+
+    def raw_data(self) -> Optional[str]:
+        """ Returns the data as received (JSON text) if nothing decoded it yet, otherwise None """
+        return self._raw_data
+
+    def set_event_name(self, event_name: str):
+        """ Sets the (translated) event name used to dispatch this event, for example SmartMotionHuman """
+        if event_name != self.key[0]:
+            self.key = (sys.intern(event_name), self.channel)
+
+    def to_dict(self, device_name: str, projection: Callable[[Any], Any] = None) -> dict:
+        """
+        Returns the event as fired on the HA event bus. projection is an optional function applied to the data, for
+        example to drop bulky fields. If it returns None the data is left out. The spatial zones are added as zones
+        """
+        if self.source == EVENT_SOURCE_VTO:
+            event = dict(self._fields)
+            if projection is not None and "Data" in event:
+                data = projection(event["Data"])
+                if data is None:
+                    del event["Data"]
+                else:
+                    event["Data"] = data
+            event["DeviceName"] = device_name
+            if self.zones:
+                event["zones"] = self.zones
+            return event
+
+        event = {"Code": self.code, "action": self.action_name, "index": str(self.channel)}
+        if self.has_data():
+            data = self.data if projection is None else projection(self.data)
+            if data is not None:
+                event["data"] = data
+        event["name"] = device_name
+        event["DeviceName"] = device_name
+        if self.zones:
+            event["zones"] = self.zones
+        return event
+
+    def __repr__(self):
+        return "DahuaEvent(code={0}, action={1}, channel={2})".format(self.code, self.action_name, self.channel)
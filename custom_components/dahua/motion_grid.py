@@ -0,0 +1,243 @@
+"""
+Decodes the motion detection grid of VideoMotionInfo and MDResult events and tracks motion per user defined zone
+"""
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# The motion detect window contains 18 rows and 22 columns. Each row is sent as an int, one bit per column with the
+# first (left most) column in the highest bit
+GRID_ROWS = 18
+GRID_COLUMNS = 22
+
+# Events carrying the motion grid
+MOTION_GRID_CODES = ("VideoMotionInfo", "MDResult")
+
+# The heatmap halves in this many seconds without motion
+HEATMAP_HALF_LIFE_SECONDS = 60.0
+# The grid is cleared when no grid was received for this many seconds, devices don't always report the end of motion
+MOTION_GRID_TIMEOUT_SECONDS = 10
+
+
+def extract_row_masks(data: Any, rows: int = GRID_ROWS) -> Optional[List[int]]:
+    """
+    Returns the row bitmasks of all active regions in the event data combined, None if the data has no grid.
+
+    VideoMotionInfo data is a list of regions:
+    [{"Id": 0, "Region": [4194303, 4194303, ...], "RegionName": "Region1", "State": "Active", "Threshold": 54}]
+    Some devices send a single region object or a list of row lists per window, these are combined as well.
+    """
+    items = data if isinstance(data, list) else [data]
+    masks = None
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        region = item.get("Region")
+        if not isinstance(region, list):
+            continue
+        if masks is None:
+            masks = [0] * rows
+        if item.get("State", "Active") != "Active":
+            continue
+        windows = region if region and isinstance(region[0], list) else [region]
+        for window in windows:
+            for row, mask in enumerate(window[:rows]):
+                if isinstance(mask, int):
+                    masks[row] |= mask
+    return masks
+
+
+def parse_motion_zones(text: str, rows: int = GRID_ROWS, columns: int = GRID_COLUMNS) \
+        -> Dict[str, Tuple[int, int, int, int]]:
+    """
+    Parses the motion zones option, zones are rectangles of grid cells given as rows:columns (0 based, inclusive).
+    Example: "Driveway=0-5:0-10, Porch=10-17:15-21" returns {"Driveway": (0, 5, 0, 10), "Porch": (10, 17, 15, 21)}
+    Raises ValueError if it's not valid
+    """
+    zones = {}
+    for entry in (text or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, area = entry.partition("=")
+        name = name.strip()
+        row_range, sep2, column_range = area.partition(":")
+        if not sep or not sep2 or not name:
+            raise ValueError("Expected Name=rows:columns but got '{0}'".format(entry))
+        first_row, last_row = _parse_range(row_range, rows, entry)
+        first_column, last_column = _parse_range(column_range, columns, entry)
+        zones[name] = (first_row, last_row, first_column, last_column)
+    return zones
+
+
+def _parse_range(text: str, size: int, entry: str) -> Tuple[int, int]:
+    """ Parses "first-last" or a single number, both must be within 0 and size - 1 """
+    first, _, last = text.strip().partition("-")
+    try:
+        first = int(first)
+        last = int(last) if last.strip() else first
+    except ValueError:
+        raise ValueError("Invalid range '{0}' in '{1}'".format(text.strip(), entry)) from None
+    if not 0 <= first <= last < size:
+        raise ValueError("Range '{0}' must be within 0-{1} in '{2}'".format(text.strip(), size - 1, entry))
+    return first, last
+
+
+class MotionZone:
+    """ The state of a zone in the motion grid """
+    __slots__ = ("name", "bounds", "row_masks", "cell_mask", "cells", "active_cells", "heat")
+
+    def __init__(self, name: str, bounds: Tuple[int, int, int, int], rows: int, columns: int):
+        first_row, last_row, first_column, last_column = bounds
+        self.name = name
+        self.bounds = bounds
+        # The zone as row bitmasks, same layout as the grid rows
+        columns_mask = 0
+        for column in range(first_column, last_column + 1):
+            columns_mask |= 1 << (columns - 1 - column)
+        self.row_masks = [columns_mask if first_row <= row <= last_row else 0 for row in range(rows)]
+        self.cell_mask = None
+        if np is not None:
+            self.cell_mask = np.zeros((rows, columns), dtype=bool)
+            self.cell_mask[first_row:last_row + 1, first_column:last_column + 1] = True
+        self.cells = (last_row - first_row + 1) * (last_column - first_column + 1)
+        # Number of cells of the zone with motion in the latest grid
+        self.active_cells = 0
+        # The mean heat of the zone's cells
+        self.heat = 0.0
+
+    @property
+    def occupied(self) -> bool:
+        """ True if there's motion in the zone """
+        return self.active_cells > 0
+
+
+class MotionGrid:
+    """
+    MotionGrid keeps the latest motion grid of a channel, an exponentially decayed heatmap of it and the motion in each
+    zone. The grid arrives as one bitmask per row. With NumPy all rows are unpacked at once with vectorized shifts and
+    the heatmap and zones are array operations. Without NumPy the zones are checked with bitwise ands on the row ints
+    and the heatmap is updated per cell.
+
+    Listeners are called with the names of the zones whose occupancy changed.
+    """
+
+    def __init__(self, rows: int = GRID_ROWS, columns: int = GRID_COLUMNS,
+                 half_life: float = HEATMAP_HALF_LIFE_SECONDS):
+        self._rows = rows
+        self._columns = columns
+        self._half_life = half_life
+        self._full_row = (1 << columns) - 1
+        self.zones: Dict[str, MotionZone] = {}
+        self._listeners: List[Callable[[Set[str]], None]] = []
+        self.masks: List[int] = [0] * rows
+        self.updated: Optional[float] = None
+        self._heat_time = time.monotonic()
+        if np is not None:
+            # Right shifts that move each column's bit to bit 0
+            self._shifts = np.arange(columns - 1, -1, -1, dtype=np.uint32)
+            self._heat = np.zeros((rows, columns), dtype=np.float32)
+        else:
+            self._heat = [0.0] * (rows * columns)
+
+    def set_zones(self, zones: Dict[str, Tuple[int, int, int, int]]):
+        """ Sets the zones by name, see parse_motion_zones """
+        self.zones = {name: MotionZone(name, bounds, self._rows, self._columns) for name, bounds in zones.items()}
+
+    def has_zones(self) -> bool:
+        return bool(self.zones)
+
+    def add_listener(self, listener: Callable[[Set[str]], None]) -> Callable[[], None]:
+        """ Adds a listener called with the names of the zones that changed. Returns a function removing it """
+        self._listeners.append(listener)
+
+        def remove():
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+        return remove
+
+    def update(self, masks: List[int]):
+        """ Applies a new grid, given as one bitmask per row """
+        masks = [mask & self._full_row for mask in masks[:self._rows]]
+        masks.extend([0] * (self._rows - len(masks)))
+        self.masks = masks
+        self.updated = time.time()
+        if np is not None:
+            self._update_vectorized(masks)
+        else:
+            self._update_rows(masks)
+
+    def clear(self):
+        """ Clears the grid, for when the device stopped reporting motion """
+        self.update([])
+
+    def _decay(self) -> float:
+        """ Returns the factor the heatmap decayed by since the last update """
+        now = time.monotonic()
+        elapsed = now - self._heat_time
+        self._heat_time = now
+        return math.pow(0.5, elapsed / self._half_life)
+
+    def _update_vectorized(self, masks: List[int]):
+        grid = (np.asarray(masks, dtype=np.uint32)[:, None] >> self._shifts) & 1
+        self._heat *= self._decay()
+        self._heat += grid
+        active = grid.astype(bool)
+        changed = set()
+        for zone in self.zones.values():
+            occupied = zone.occupied
+            zone.active_cells = int(np.count_nonzero(active & zone.cell_mask))
+            zone.heat = float(self._heat[zone.cell_mask].mean())
+            if zone.occupied != occupied:
+                changed.add(zone.name)
+        self._notify(changed)
+
+    def _update_rows(self, masks: List[int]):
+        factor = self._decay()
+        columns = self._columns
+        heat = self._heat
+        for row, mask in enumerate(masks):
+            offset = row * columns
+            for column in range(columns):
+                heat[offset + column] = heat[offset + column] * factor + ((mask >> (columns - 1 - column)) & 1)
+        changed = set()
+        for zone in self.zones.values():
+            occupied = zone.occupied
+            zone.active_cells = sum(bin(mask & zone_mask).count("1") for mask, zone_mask in zip(masks, zone.row_masks))
+            first_row, last_row, first_column, last_column = zone.bounds
+            zone.heat = sum(heat[row * columns + column] for row in range(first_row, last_row + 1)
+                            for column in range(first_column, last_column + 1)) / zone.cells
+            if zone.occupied != occupied:
+                changed.add(zone.name)
+        self._notify(changed)
+
+    def _notify(self, changed: Set[str]):
+        if changed:
+            for listener in list(self._listeners):
+                listener(changed)
+
+    def heatmap(self) -> List[List[float]]:
+        """ Returns the heatmap as rows of cells, each cell is its decayed motion count """
+        if np is not None:
+            return [[round(float(value), 2) for value in row] for row in self._heat]
+        columns = self._columns
+        return [[round(value, 2) for value in self._heat[row * columns:(row + 1) * columns]]
+                for row in range(self._rows)]
+
+    def as_dict(self) -> dict:
+        """ Returns the grid state, useful for diagnostics """
+        return {
+            "vectorized": np is not None,
+            "updated": self.updated,
+            "rows": [format(mask, "0{0}b".format(self._columns)) for mask in self.masks],
+            "zones": {
+                name: {"active_cells": zone.active_cells, "cells": zone.cells, "heat": round(zone.heat, 3)}
+                for name, zone in self.zones.items()
+            },
+        }
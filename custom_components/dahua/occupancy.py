@@ -0,0 +1,162 @@
+"""
+Occupancy (number of humans, vehicles, etc in an area) from the lifetime of the objects reported in IVS events
+"""
+import time
+from typing import Callable, Dict, List, Optional
+
+from .models import DahuaEvent, EventAction
+
+# Events that report objects entering, moving in and leaving an area
+OCCUPANCY_CODES = ("CrossRegionDetection", "SmartMotionHuman", "SmartMotionVehicle")
+
+# Object actions that mean the object left. Appear, Move, Stay, Inside, etc keep it alive
+LEAVE_ACTIONS = ("Disappear", "Leave")
+
+# An object that isn't reported for this many seconds is considered gone, devices don't always report Disappear
+OBJECT_TIMEOUT_SECONDS = 30.0
+# The occupancy goes up right away but only goes down once it has been lower for this many seconds. Detection drops
+# out for a frame every now and then and we don't want the count to flap
+OCCUPANCY_HOLD_SECONDS = 5.0
+# How often the tracker is swept for timed out objects and held counts while it tracks anything
+SWEEP_SECONDS = 2.0
+
+
+class TrackedObject:
+    """ An object that is in an area """
+    __slots__ = ("object_id", "object_type", "first_seen", "last_seen")
+
+    def __init__(self, object_id, object_type: str, now: float):
+        self.object_id = object_id
+        self.object_type = object_type
+        self.first_seen = now
+        self.last_seen = now
+
+
+class OccupancyArea:
+    """ The objects in an area (an IVS rule or smart motion type) and the occupancy reported for it """
+    __slots__ = ("name", "objects", "count", "_lower_since")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.objects: Dict[object, TrackedObject] = {}
+        # The reported occupancy, follows len(objects) with hysteresis
+        self.count = 0
+        self._lower_since: Optional[float] = None
+
+    def counts_by_type(self) -> Dict[str, int]:
+        """ Returns the number of objects in the area per object type """
+        counts = {}
+        for obj in self.objects.values():
+            counts[obj.object_type] = counts.get(obj.object_type, 0) + 1
+        return counts
+
+    def settle(self, now: float) -> bool:
+        """ Updates the reported occupancy, returns True if it changed """
+        current = len(self.objects)
+        if current >= self.count:
+            self._lower_since = None
+            changed = current != self.count
+            self.count = current
+            return changed
+        if self._lower_since is None:
+            self._lower_since = now
+        if now - self._lower_since >= OCCUPANCY_HOLD_SECONDS:
+            self._lower_since = None
+            self.count = current
+            return True
+        return False
+
+    def is_settled(self) -> bool:
+        """ True if there are no objects and no pending decrease, the area doesn't need sweeping """
+        return not self.objects and self._lower_since is None
+
+
+def event_objects(event: DahuaEvent) -> List[dict]:
+    """ Returns the objects of an IVS event, the data has an Object or a list of Objects """
+    data = event.data_dict()
+    objects = data.get("Objects", data.get("Object"))
+    if isinstance(objects, dict):
+        return [objects]
+    if isinstance(objects, list):
+        return [obj for obj in objects if isinstance(obj, dict)]
+    return []
+
+
+class OccupancyTracker:
+    """
+    OccupancyTracker keeps a table of the live objects per area, by ObjectID. Objects are added or refreshed by the
+    events that report them and removed when they disappear, when the event stops or when they time out. Memory is
+    bounded by the number of objects actually in view.
+
+    Listeners are called with the area name and True if the area is new whenever the reported occupancy changed.
+    """
+
+    def __init__(self):
+        self.areas: Dict[str, OccupancyArea] = {}
+        self._listeners: List[Callable[[str, bool], None]] = []
+
+    def add_listener(self, listener: Callable[[str, bool], None]) -> Callable[[], None]:
+        """ Adds a listener called when the occupancy of an area changed. Returns a function removing it """
+        self._listeners.append(listener)
+
+        def remove():
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+        return remove
+
+    def track(self, event: DahuaEvent):
+        """ Updates the objects of the event's area """
+        data = event.data_dict()
+        # CrossRegionDetection areas are the IVS rules, smart motion is an area of its own
+        name = (data.get("Name") or event.code) if event.code == "CrossRegionDetection" else event.code
+        area = self.areas.get(name)
+        is_new = area is None
+        if is_new:
+            area = self.areas[name] = OccupancyArea(name)
+
+        now = time.monotonic()
+        if event.action is EventAction.STOP and event.code != "CrossRegionDetection":
+            # Smart motion stopped, nothing is moving in view anymore
+            area.objects.clear()
+        else:
+            for obj in event_objects(event):
+                object_id = obj.get("ObjectID")
+                if object_id is None:
+                    continue
+                if obj.get("Action") in LEAVE_ACTIONS:
+                    area.objects.pop(object_id, None)
+                    continue
+                tracked = area.objects.get(object_id)
+                if tracked is None:
+                    area.objects[object_id] = TrackedObject(object_id, obj.get("ObjectType") or "Unknown", now)
+                else:
+                    tracked.last_seen = now
+
+        if area.settle(now) or is_new:
+            self._notify(name, is_new)
+
+    def sweep(self) -> bool:
+        """ Removes timed out objects and updates held counts. Returns True while another sweep is needed """
+        now = time.monotonic()
+        needs_sweep = False
+        for name, area in self.areas.items():
+            expired = [object_id for object_id, obj in area.objects.items()
+                       if now - obj.last_seen > OBJECT_TIMEOUT_SECONDS]
+            for object_id in expired:
+                del area.objects[object_id]
+            if area.settle(now):
+                self._notify(name, False)
+            needs_sweep = needs_sweep or not area.is_settled()
+        return needs_sweep
+
+    def _notify(self, name: str, is_new: bool):
+        for listener in list(self._listeners):
+            listener(name, is_new)
+
+    def as_dict(self) -> dict:
+        """ Returns the occupancy per area, useful for diagnostics """
+        return {
+            name: {"occupancy": area.count, "objects": len(area.objects), "by_type": area.counts_by_type()}
+            for name, area in self.areas.items()
+        }
@@ -0,0 +1,123 @@
+"""
+Projections of the event data (payload) fired on the HA event bus, to keep bulky fields out of the recorder
+"""
+from typing import Any, Callable, Dict, Optional
+
+# Forward the data as is
+FIELDS_ALL = "all"
+# Don't forward any data
+FIELDS_NONE = "none"
+# Sets the projection for all codes without their own projection, example: *=UTC
+DEFAULT_FIELDS_CODE = "*"
+
+# When slimming, lists longer than this are dropped. Region bitmasks, detect lines and the like are bulky, short lists
+# such as RegionName or a BoundingBox are kept
+MAX_SLIM_LIST_LENGTH = 8
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def parse_payload_fields(text: str) -> Dict[str, Any]:
+    """
+    Parses the payload fields option into projections by code, example:
+    "CrossLineDetection=Name|Direction|Object.ObjectType|UTC, VideoMotionInfo=none, *=all"
+    A projection is FIELDS_ALL, FIELDS_NONE or a tree of the fields to keep, for example
+    {"Name": True, "Object": {"ObjectType": True}}
+    Raises ValueError if it's not valid
+    """
+    projections = {}
+    for entry in (text or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        code, sep, fields = entry.partition("=")
+        code = code.strip()
+        fields = fields.strip()
+        if not sep or not code or not fields:
+            raise ValueError("Expected Code=Field|Field but got '{0}'".format(entry))
+        if fields.lower() in (FIELDS_ALL, FIELDS_NONE):
+            projections[code] = fields.lower()
+            continue
+
+        tree = {}
+        for path in fields.split("|"):
+            parts = [part.strip() for part in path.split(".")]
+            if not all(parts):
+                raise ValueError("Invalid field '{0}' in '{1}'".format(path, entry))
+            node = tree
+            for part in parts[:-1]:
+                child = node.get(part)
+                if child is True:
+                    # The parent is already forwarded as a whole
+                    break
+                node = node.setdefault(part, {})
+            else:
+                node[parts[-1]] = True
+        projections[code] = tree
+    return projections
+
+
+def project(data: Any, tree: dict) -> Any:
+    """ Returns a copy of data with only the fields in the tree. Fields that aren't there are skipped """
+    if not isinstance(data, dict):
+        return data
+    result = {}
+    for key, sub_tree in tree.items():
+        if key not in data:
+            continue
+        value = data[key]
+        if sub_tree is True:
+            result[key] = value
+        elif isinstance(value, dict):
+            result[key] = project(value, sub_tree)
+    return result
+
+
+def slim(data: Any) -> Any:
+    """ Returns a copy of data without bulky lists (long ones or lists of lists or objects), also in nested objects """
+    if isinstance(data, dict):
+        result = {}
+        for key, value in data.items():
+            if isinstance(value, list):
+                if len(value) > MAX_SLIM_LIST_LENGTH or not all(isinstance(item, _SCALAR_TYPES) for item in value):
+                    continue
+                result[key] = value
+            elif isinstance(value, dict):
+                result[key] = slim(value)
+            else:
+                result[key] = value
+        return result
+    return data
+
+
+class PayloadProjector:
+    """
+    PayloadProjector decides which fields of an event's data are fired on the HA event bus. Codes with a projection
+    get only those fields. All other codes get their data as is, or slimmed (bulky lists removed) when slimming is on.
+    Code, action and index aren't part of the data, they're always fired.
+    """
+
+    def __init__(self, projections: Optional[Dict[str, Any]] = None, slim_payloads: bool = False):
+        projections = dict(projections or {})
+        default = projections.pop(DEFAULT_FIELDS_CODE, None)
+        self._default = self._to_function(default) if default is not None else (slim if slim_payloads else None)
+        self._functions: Dict[str, Optional[Callable]] = {
+            code: self._to_function(projection) for code, projection in projections.items()
+        }
+
+    @staticmethod
+    def _to_function(projection) -> Optional[Callable]:
+        """ Returns the function that projects the data, None to forward it as is """
+        if projection == FIELDS_ALL:
+            return None
+        if projection == FIELDS_NONE:
+            return _no_data
+        return lambda data: project(data, projection)
+
+    def get_projection(self, code: str) -> Optional[Callable]:
+        """ Returns the function applied to the data of events with the code, None if the data is forwarded as is """
+        return self._functions.get(code, self._default)
+
+
+def _no_data(data: Any) -> Any:
+    return None
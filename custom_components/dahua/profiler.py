@@ -0,0 +1,156 @@
+"""
+On demand profiling of the integration: a cProfile of the event loop and a tracemalloc snapshot of the allocations made
+by this integration, written to the config directory
+"""
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from typing import Optional
+
+import voluptuous as vol
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, ServiceCall
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.service import async_register_admin_service
+
+from .const import DOMAIN
+
+_LOGGER: logging.Logger = logging.getLogger(__package__)
+
+SERVICE_START_PROFILE = "start_profile"
+SERVICE_STOP_PROFILE = "stop_profile"
+# Fired when a profile is written, with the paths of the files
+EVENT_PROFILE_WRITTEN = "dahua_profile_written"
+
+DEFAULT_PROFILE_SECONDS = 60
+MAX_PROFILE_SECONDS = 1800
+# The number of functions and allocation sites in the summary
+SUMMARY_TOP = 30
+# Frames kept per allocation, more frames cost more memory while tracing
+TRACEMALLOC_FRAMES = 5
+
+# Functions and allocations of this integration
+_MODULE_PATTERN = r"custom_components[/\\]dahua"
+_MODULE_FILTER = "*custom_components*dahua*"
+
+START_PROFILE_SCHEMA = vol.Schema({
+    vol.Optional("seconds", default=DEFAULT_PROFILE_SECONDS):
+        vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_PROFILE_SECONDS)),
+})
+
+
+class DahuaProfiler:
+    """
+    DahuaProfiler profiles the event loop thread, where the coroutines and callbacks of the integration run, and traces
+    allocations for a bounded time. The summary is restricted to the functions and allocation sites of this integration,
+    the cProfile dump has everything so the share of the integration in the loop can be worked out. The event stream
+    and VTO threads are not profiled.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._profile: Optional[cProfile.Profile] = None
+        self._started = 0.0
+        # True if tracemalloc was started by us, so we stop it when done
+        self._owns_tracemalloc = False
+        self._unsub_timeout: Optional[CALLBACK_TYPE] = None
+        # True while the results of the last profile are written, tracemalloc is still in use until then
+        self._writing = False
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    async def async_start(self, call: ServiceCall):
+        """ Handles SERVICE_START_PROFILE, profiles until SERVICE_STOP_PROFILE or for the given seconds """
+        if self.running:
+            _LOGGER.warning("A profile is already running, call %s.%s first", DOMAIN, SERVICE_STOP_PROFILE)
+            return
+        if self._writing:
+            _LOGGER.warning("The last profile is still being written")
+            return
+        seconds = call.data["seconds"]
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as exception:
+            # Another profiler is active on this thread
+            _LOGGER.warning("Could not start profiling: %s", exception)
+            return
+        self._profile = profile
+        self._started = time.time()
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._unsub_timeout = async_call_later(self._hass, seconds, self._async_timeout)
+        _LOGGER.info("Profiling for up to %s seconds", seconds)
+
+    async def _async_timeout(self, now=None):
+        self._unsub_timeout = None
+        await self.async_stop()
+
+    async def async_stop(self, call: Optional[ServiceCall] = None):
+        """ Handles SERVICE_STOP_PROFILE, stops profiling and writes the results """
+        if not self.running:
+            if call is not None:
+                _LOGGER.warning("No profile is running")
+            return
+        if self._unsub_timeout is not None:
+            self._unsub_timeout()
+            self._unsub_timeout = None
+        profile = self._profile
+        profile.disable()
+        self._profile = None
+
+        base = self._hass.config.path("dahua_profile_{0}".format(int(self._started)))
+        duration = time.time() - self._started
+        self._writing = True
+        try:
+            await self._hass.async_add_executor_job(_write_results, base, profile, self._owns_tracemalloc, duration)
+        finally:
+            self._writing = False
+        _LOGGER.info("Wrote the profile to %s.prof and its summary to %s.txt", base, base)
+        self._hass.bus.async_fire(EVENT_PROFILE_WRITTEN, {
+            "profile": base + ".prof",
+            "summary": base + ".txt",
+            "seconds": round(duration, 1),
+        })
+
+
+def _write_results(base: str, profile: cProfile.Profile, stop_tracemalloc: bool, duration: float):
+    """
+    Runs in the executor. Takes the tracemalloc snapshot, which copies every traced allocation, then writes the cProfile
+    dump and a text summary of the top functions and allocation sites of the integration
+    """
+    snapshot = tracemalloc.take_snapshot()
+    if stop_tracemalloc:
+        tracemalloc.stop()
+    profile.dump_stats(base + ".prof")
+
+    summary = io.StringIO()
+    summary.write("Profiled for {0:.1f} seconds\n\n".format(duration))
+    summary.write("Top {0} functions of the integration by cumulative time\n".format(SUMMARY_TOP))
+    stats = pstats.Stats(profile, stream=summary)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_MODULE_PATTERN, SUMMARY_TOP)
+    summary.write("Top {0} functions of the integration by own time\n".format(SUMMARY_TOP))
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(_MODULE_PATTERN, SUMMARY_TOP)
+
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(True, _MODULE_FILTER),))
+    allocations = snapshot.statistics("lineno")
+    summary.write("Top {0} allocation sites of the integration, {1:.1f} KiB in {2} sites\n".format(
+        SUMMARY_TOP, sum(stat.size for stat in allocations) / 1024, len(allocations)))
+    for stat in allocations[:SUMMARY_TOP]:
+        summary.write("{0}\n".format(stat))
+
+    with open(base + ".txt", "w", encoding="utf-8") as file:
+        file.write(summary.getvalue())
+
+
+def async_register_profiler_services(hass: HomeAssistant):
+    """ Registers the admin only start_profile and stop_profile services """
+    profiler = DahuaProfiler(hass)
+    async_register_admin_service(hass, DOMAIN, SERVICE_START_PROFILE, profiler.async_start, START_PROFILE_SCHEMA)
+    async_register_admin_service(hass, DOMAIN, SERVICE_STOP_PROFILE, profiler.async_stop)
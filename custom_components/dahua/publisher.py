@@ -0,0 +1,208 @@
+"""
+Publishes Dahua events on the HA event bus according to per-code policies
+"""
+import logging
+import time
+from typing import Callable, Dict, List
+
+from homeassistant.core import HomeAssistant
+
+from . import tracing
+from .models import DahuaEvent
+from .payload import PayloadProjector
+
+_LOGGER: logging.Logger = logging.getLogger(__package__)
+
+# Fired for every published event
+BUS_EVENT = "dahua_event_received"
+# Fired for a batch of events, the events are in the "events" list of the event data
+BATCH_BUS_EVENT = "dahua_events_batch"
+
+# Fire every event right away, this is the default
+POLICY_IMMEDIATE = "immediate"
+# Collect the events and fire them as a single dahua_events_batch event. batch fires once per loop iteration,
+# batch:N every N seconds
+POLICY_BATCH = "batch"
+# Fire at most N events per second, events in between are dropped unless the action changed. sample:N
+POLICY_SAMPLE = "sample"
+# Don't fire these events on the bus at all, only entities get them
+POLICY_NONE = "none"
+
+# Sets the policy for all codes without their own policy, example: *=batch
+DEFAULT_POLICY_CODE = "*"
+
+
+class PublishPolicy:
+    """ How events of a code are published: kind is one of the POLICY_ constants """
+    __slots__ = ("kind", "value")
+
+    def __init__(self, kind: str, value: float = 0.0):
+        self.kind = kind
+        # Seconds between batches for batch, events per second for sample
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, PublishPolicy) and self.kind == other.kind and self.value == other.value
+
+    def __repr__(self):
+        if self.value:
+            return "{0}:{1:g}".format(self.kind, self.value)
+        return self.kind
+
+
+IMMEDIATE = PublishPolicy(POLICY_IMMEDIATE)
+
+
+def parse_publish_policies(text: str) -> Dict[str, PublishPolicy]:
+    """
+    Parses the publish policies option, example: "VideoMotionInfo=sample:1, IntelliFrame=none, *=immediate"
+    Raises ValueError if it's not valid
+    """
+    policies = {}
+    for entry in (text or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        code, sep, policy = entry.partition("=")
+        code = code.strip()
+        kind, _, value = policy.strip().partition(":")
+        kind = kind.strip().lower()
+        if not sep or not code:
+            raise ValueError("Expected Code=policy but got '{0}'".format(entry))
+        if kind in (POLICY_IMMEDIATE, POLICY_NONE):
+            if value:
+                raise ValueError("Policy {0} takes no value in '{1}'".format(kind, entry))
+            policies[code] = PublishPolicy(kind)
+        elif kind in (POLICY_BATCH, POLICY_SAMPLE):
+            try:
+                number = float(value) if value else 0.0
+            except ValueError:
+                number = -1.0
+            if number < 0 or (kind == POLICY_SAMPLE and number <= 0):
+                raise ValueError("Invalid value for policy {0} in '{1}'".format(kind, entry))
+            policies[code] = PublishPolicy(kind, number)
+        else:
+            raise ValueError("Unknown policy '{0}' in '{1}'".format(kind, entry))
+    return policies
+
+
+class EventPublisher:
+    """
+    EventPublisher fires the events of one device on the HA event bus. Every event code has a policy, see the POLICY_
+    constants. Counters per code tell what happened to the events. Must only be used from the HA loop.
+    """
+
+    def __init__(self, hass: HomeAssistant, get_device_name: Callable[[], str]):
+        self._hass = hass
+        self._get_device_name = get_device_name
+        self._policies: Dict[str, PublishPolicy] = {}
+        self._default = IMMEDIATE
+        # Events waiting to be fired as a batch, by batch interval
+        self._batches: Dict[float, List[dict]] = {}
+        self._batch_handles: Dict[float, object] = {}
+        # For sampled codes: (code, channel) to [monotonic time of the last published event, its action]
+        self._last_sampled: Dict[tuple, list] = {}
+        # code to [published, batched, sampled out, not published]
+        self._counters: Dict[str, List[int]] = {}
+        # Decides which fields of the event data are fired
+        self._projector = PayloadProjector()
+
+    def set_policies(self, policies: Dict[str, PublishPolicy]):
+        """ Sets the policies by event code. DEFAULT_POLICY_CODE sets the policy for all other codes """
+        policies = dict(policies)
+        self._default = policies.pop(DEFAULT_POLICY_CODE, IMMEDIATE)
+        self._policies = policies
+        self._last_sampled.clear()
+
+    def set_payload_projector(self, projector: PayloadProjector):
+        """ Sets the projector that decides which fields of the event data are fired """
+        self._projector = projector
+
+    def get_policy(self, code: str) -> PublishPolicy:
+        """ Returns the policy for the event code """
+        return self._policies.get(code, self._default)
+
+    def publishes(self, code: str) -> bool:
+        """ Returns true if events with the given code are fired on the HA event bus in any way """
+        return self.get_policy(code).kind != POLICY_NONE
+
+    @tracing.traced(tracing.SPAN_PUBLISH)
+    def publish(self, event: DahuaEvent):
+        """ Publishes the event according to the policy of its code """
+        code = event.code
+        policy = self.get_policy(code)
+        counters = self._counters.get(code)
+        if counters is None:
+            counters = self._counters[code] = [0, 0, 0, 0]
+
+        kind = policy.kind
+        if kind == POLICY_IMMEDIATE:
+            counters[0] += 1
+            self._hass.bus.async_fire(BUS_EVENT, self._to_dict(event))
+        elif kind == POLICY_NONE:
+            counters[3] += 1
+        elif kind == POLICY_SAMPLE:
+            if self._sample(event, policy.value):
+                counters[0] += 1
+                self._hass.bus.async_fire(BUS_EVENT, self._to_dict(event))
+            else:
+                counters[2] += 1
+        else:
+            counters[1] += 1
+            self._add_to_batch(policy.value, self._to_dict(event))
+
+    def _to_dict(self, event: DahuaEvent) -> dict:
+        """ Returns the event data fired on the bus """
+        return event.to_dict(self._get_device_name(), self._projector.get_projection(event.code))
+
+    def _sample(self, event: DahuaEvent, rate: float) -> bool:
+        """ Returns true if the sampled event should be published """
+        now = time.monotonic()
+        key = (event.code, event.channel)
+        last = self._last_sampled.get(key)
+        if last is not None and now - last[0] < 1.0 / rate and last[1] == event.action:
+            return False
+        self._last_sampled[key] = [now, event.action]
+        return True
+
+    def _add_to_batch(self, interval: float, event_data: dict):
+        batch = self._batches.get(interval)
+        if batch is None:
+            batch = self._batches[interval] = []
+            if interval > 0:
+                handle = self._hass.loop.call_later(interval, self._flush, interval)
+            else:
+                handle = self._hass.loop.call_soon(self._flush, interval)
+            self._batch_handles[interval] = handle
+        batch.append(event_data)
+
+    def _flush(self, interval: float):
+        """ Fires the batch collected for the interval """
+        self._batch_handles.pop(interval, None)
+        batch = self._batches.pop(interval, None)
+        if batch:
+            device_name = self._get_device_name()
+            self._hass.bus.async_fire(BATCH_BUS_EVENT, {"name": device_name, "DeviceName": device_name,
+                                                        "events": batch})
+
+    def stop(self):
+        """ Fires the batches that are still waiting """
+        for interval, handle in list(self._batch_handles.items()):
+            handle.cancel()
+            self._flush(interval)
+
+    def as_dict(self) -> dict:
+        """ Returns the policies and counters per code, useful for diagnostics """
+        return {
+            "default_policy": repr(self._default),
+            "policies": {code: repr(policy) for code, policy in self._policies.items()},
+            "codes": {
+                code: {
+                    "published": counters[0],
+                    "batched": counters[1],
+                    "sampled_out": counters[2],
+                    "not_published": counters[3],
+                }
+                for code, counters in self._counters.items()
+            },
+        }
@@ -0,0 +1,252 @@
+"""
+Local event rules, evaluated on every event before it's fired on the HA event bus or dispatched to entities. Rules
+drop noise (low confidence humans, motion at night, etc) or drive virtual binary sensors
+"""
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .models import DahuaEvent, EventAction
+
+# The target of rules that drop the events they match
+RULE_DROP = "drop"
+# Rule sensors are kept in the event registry under this prefix plus the rule name, so they get the same state and
+# expiry handling as the device's own events
+RULE_EVENT_PREFIX = "Rule:"
+
+# Fields that aren't in the event data
+FIELD_CODE = "Code"
+FIELD_ACTION = "action"
+FIELD_INDEX = "index"
+# The local hour (0-23) the event was received
+FIELD_HOUR = "hour"
+# The spatial zones the objects of the event are in, see zones.py. zones=Driveway is true if any object is in Driveway
+FIELD_ZONES = "zones"
+
+_CONDITION = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*(!=|<=|>=|=|<|>|~)\s*(.*?)\s*$")
+
+_NUMERIC_OPERATORS = {
+    "<": lambda value, limit: value < limit,
+    "<=": lambda value, limit: value <= limit,
+    ">": lambda value, limit: value > limit,
+    ">=": lambda value, limit: value >= limit,
+}
+
+
+class Rule:
+    """ A compiled rule: the target (drop or a sensor name), the codes it applies to and its test """
+    __slots__ = ("target", "codes", "test", "text", "matches")
+
+    def __init__(self, target: str, codes: Optional[Tuple[str, ...]], test: Callable[[DahuaEvent], bool], text: str):
+        self.target = target
+        # The codes the rule applies to, None for all codes
+        self.codes = codes
+        self.test = test
+        self.text = text
+        self.matches = 0
+
+    @property
+    def drops(self) -> bool:
+        return self.target == RULE_DROP
+
+
+def parse_rules(text: str) -> List[Rule]:
+    """
+    Parses the rules option. Rules are separated by ; and look like target: condition & condition. The target is drop
+    or the name of a sensor. A condition is field operator value, the field is Code, action, index, hour, zones or a
+    field of the event data such as Object.ObjectType. Operators are = and != (the value can list alternatives as A|B),
+    <, <=, > and >= for numbers and ~ for a regular expression. Example:
+    "drop: Code=SmartMotionHuman & Object.Confidence<60; Driveway Car: Code=CrossRegionDetection & Name=Driveway &
+    Object.ObjectType=Vehicle"
+    Raises ValueError if it's not valid
+    """
+    rules = []
+    for entry in (text or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        target, sep, conditions = entry.partition(":")
+        target = target.strip()
+        if not sep or not target or not conditions.strip():
+            raise ValueError("Expected target: condition & condition but got '{0}'".format(entry))
+        if target.lower() == RULE_DROP:
+            target = RULE_DROP
+        if target.startswith(RULE_EVENT_PREFIX):
+            raise ValueError("Invalid rule name '{0}'".format(target))
+
+        codes = None
+        tests = []
+        for condition in conditions.split("&"):
+            match = _CONDITION.match(condition)
+            if match is None or not match.group(3):
+                raise ValueError("Invalid condition '{0}' in '{1}'".format(condition.strip(), entry))
+            field, operator, value = match.groups()
+            if field == FIELD_CODE and operator == "=" and codes is None:
+                # The rule is indexed by its codes, so this condition doesn't need testing
+                codes = tuple(code.strip() for code in value.split("|"))
+                continue
+            tests.append(_compile_condition(field, operator, value, entry))
+        rules.append(Rule(target, codes, _compile_all(tests), entry))
+    return rules
+
+
+def _compile_condition(field: str, operator: str, value: str, entry: str) -> Callable[[DahuaEvent], bool]:
+    """ Returns a function testing the condition on an event """
+    if field == FIELD_ZONES and operator in ("=", "!="):
+        zones = frozenset(alternative.strip() for alternative in value.split("|"))
+        if operator == "=":
+            return lambda event: not zones.isdisjoint(event.zones or ())
+        return lambda event: zones.isdisjoint(event.zones or ())
+
+    get_value = _compile_field(field)
+    if operator in ("=", "!="):
+        expected = frozenset(alternative.strip() for alternative in value.split("|"))
+        if operator == "=":
+            return lambda event: _to_text(get_value(event)) in expected
+        return lambda event: _to_text(get_value(event)) not in expected
+    if operator == "~":
+        try:
+            pattern = re.compile(value)
+        except re.error as exception:
+            raise ValueError("Invalid expression '{0}' in '{1}': {2}".format(value, entry, exception)) from None
+        return lambda event: pattern.search(_to_text(get_value(event))) is not None
+
+    try:
+        limit = float(value)
+    except ValueError:
+        raise ValueError("Expected a number but got '{0}' in '{1}'".format(value, entry)) from None
+    compare = _NUMERIC_OPERATORS[operator]
+
+    def test(event: DahuaEvent) -> bool:
+        number = get_value(event)
+        if isinstance(number, bool) or not isinstance(number, (int, float)):
+            try:
+                number = float(number)
+            except (TypeError, ValueError):
+                return False
+        return compare(number, limit)
+
+    return test
+
+
+def _compile_field(field: str) -> Callable[[DahuaEvent], object]:
+    """ Returns a function reading the field from an event, None if the event doesn't have it """
+    if field == FIELD_CODE:
+        return lambda event: event.code
+    if field == FIELD_ACTION:
+        return lambda event: event.action_name
+    if field == FIELD_INDEX:
+        return lambda event: event.channel
+    if field == FIELD_HOUR:
+        return lambda event: time.localtime().tm_hour
+    if field == FIELD_ZONES:
+        return lambda event: "|".join(event.zones or ())
+    path = tuple(field.split("."))
+
+    def get_value(event: DahuaEvent):
+        value = event.data_dict()
+        for part in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+    return get_value
+
+
+def _compile_all(tests: List[Callable[[DahuaEvent], bool]]) -> Callable[[DahuaEvent], bool]:
+    """ Returns a function that is true when all tests are true """
+    if not tests:
+        return lambda event: True
+    if len(tests) == 1:
+        return tests[0]
+    tests = tuple(tests)
+
+    def test_all(event: DahuaEvent) -> bool:
+        for test in tests:
+            if not test(event):
+                return False
+        return True
+
+    return test_all
+
+
+def _to_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class RuleEngine:
+    """
+    RuleEngine evaluates the rules of a device on its events. Rules are compiled once and indexed by the codes they
+    apply to, so an event is only tested against the rules of its code and the rules for all codes, in the order they
+    were configured. A matching drop rule drops the event, nothing else sees it. Drop rules don't apply to Stop events:
+    the data of a Stop can differ from its Start (a confidence of 0 for example), and dropping the Stop of a Start that
+    was let through would leave the sensors on until the event expires.
+
+    Sensor rules turn their sensor on with the events they match. The coordinator turns the sensor off with the Stop of
+    the event that turned it on (code and index), the Stop doesn't need to match the rule since its data can differ.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        # Rules for all codes, and the rules per code including the rules for all codes, in configured order
+        self._any_code: Tuple[Rule, ...] = tuple(rule for rule in rules if rule.codes is None)
+        by_code: Dict[str, List[Rule]] = {}
+        for rule in rules:
+            for code in rule.codes or ():
+                by_code.setdefault(code, [])
+        for code, code_rules in by_code.items():
+            code_rules.extend(rule for rule in rules if rule.codes is None or code in rule.codes)
+        self._by_code: Dict[str, Tuple[Rule, ...]] = {code: tuple(code_rules) for code, code_rules in by_code.items()}
+        self.evaluated = 0
+        self.dropped = 0
+
+    def sensor_names(self) -> List[str]:
+        """ Returns the names of the rule sensors, in configured order """
+        names = []
+        for rule in self.rules:
+            if not rule.drops and rule.target not in names:
+                names.append(rule.target)
+        return names
+
+    def wants_code(self, code: str) -> bool:
+        """ True if a sensor rule applies to events with the code """
+        for rule in self._by_code.get(code, self._any_code):
+            if not rule.drops:
+                return True
+        return False
+
+    def evaluate(self, event: DahuaEvent) -> Optional[List[str]]:
+        """ Returns None if the event is dropped, otherwise the names of the rule sensors the event matches """
+        rules = self._by_code.get(event.code, self._any_code)
+        if not rules:
+            return []
+
+        self.evaluated += 1
+        matched = []
+        for rule in rules:
+            if rule.drops and event.action is EventAction.STOP:
+                continue
+            if not rule.test(event):
+                continue
+            rule.matches += 1
+            if rule.drops:
+                self.dropped += 1
+                return None
+            if rule.target not in matched:
+                matched.append(rule.target)
+        return matched
+
+    def as_dict(self) -> dict:
+        """ Returns the rules and their match counts, useful for diagnostics """
+        return {
+            "evaluated": self.evaluated,
+            "dropped": self.dropped,
+            "rules": [{"rule": rule.text, "matches": rule.matches} for rule in self.rules],
+        }
@@ -0,0 +1,304 @@
+"""Sensor platform for dahua."""
+import time
+
+from homeassistant.components.sensor import SensorEntity
+from homeassistant.core import HomeAssistant
+from custom_components.dahua import DahuaDataUpdateCoordinator
+
+from .const import DOMAIN, COUNTER_ICON, OCCUPANCY_ICON, LATENCY_ICON
+from .entity import DahuaBaseEntity
+from .latency import PERCENTILES, STAGE_TOTAL, STAGES
+
+# The health sensors of a device by key (see DahuaDataUpdateCoordinator.get_health_stats): name, unit and icon
+HEALTH_SENSORS = {
+    "poll_duration": ("Poll Duration", "ms", "mdi:timer-sand"),
+    "request_error_rate": ("Request Error Rate", "%", "mdi:alert-circle-outline"),
+    "link_uptime": ("Event Stream Uptime", "s", "mdi:lan-connect"),
+    "reconnects": ("Event Stream Reconnects", None, "mdi:lan-disconnect"),
+    "events_per_minute": ("Events Per Minute", "events/min", "mdi:chart-line"),
+    "heartbeat_age": ("Last Heartbeat Age", "s", "mdi:heart-pulse"),
+    "vto_keep_alive_rtt": ("VTO Keep Alive RTT", "ms", "mdi:timer-outline"),
+}
+
+
+async def async_setup_entry(hass: HomeAssistant, entry, async_add_devices):
+    """Setup sensor platform."""
+    coordinator: DahuaDataUpdateCoordinator = hass.data[DOMAIN][entry.entry_id]
+
+    async_add_devices([DahuaLatencySensor(coordinator, entry)])
+    # Health sensors are disabled by default, the VTO keep alive is only for doorbells
+    async_add_devices([DahuaHealthSensor(coordinator, entry, key) for key in HEALTH_SENSORS
+                       if key != "vto_keep_alive_rtt" or coordinator.is_doorbell()])
+
+    # Object counters show up as the device reports crossings, so their sensors are added when they're first counted
+    counters = coordinator.get_object_counters()
+    if counters is not None:
+        async_add_devices([DahuaObjectCountSensor(coordinator, entry, key) for key in counters.counters])
+
+        def counter_changed(key: tuple, is_new: bool):
+            if is_new:
+                async_add_devices([DahuaObjectCountSensor(coordinator, entry, key)])
+
+        entry.async_on_unload(counters.add_listener(counter_changed))
+
+    # Occupancy sensors are added for the areas as objects are first reported in them
+    occupancy = coordinator.get_occupancy()
+    if occupancy is not None:
+        async_add_devices([DahuaOccupancySensor(coordinator, entry, name) for name in occupancy.areas])
+
+        def area_changed(name: str, is_new: bool):
+            if is_new:
+                async_add_devices([DahuaOccupancySensor(coordinator, entry, name)])
+
+        entry.async_on_unload(occupancy.add_listener(area_changed))
+
+
+class DahuaObjectCountSensor(DahuaBaseEntity, SensorEntity):
+    """
+    Counts the objects crossing an IVS rule in a direction, for example humans crossing Rule1 from left to right. The
+    state is the count of the last hour. Counts are kept in memory and start over when Home Assistant restarts
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry, key: tuple):
+        DahuaBaseEntity.__init__(self, coordinator, config_entry)
+        SensorEntity.__init__(self)
+
+        # key is (rule, direction, object type)
+        self._key = key
+        self._coordinator = coordinator
+        rule, direction, object_type = key
+        self._name = "{0} {1} {2} {3} Count".format(coordinator.get_device_name(), rule, direction, object_type)
+        unique_id = "{0}_count_{1}_{2}_{3}".format(coordinator.get_serial_number(), rule, direction, object_type)
+        self._unique_id = unique_id.lower().replace(" ", "_")
+
+    @property
+    def unique_id(self):
+        """Return the entity unique ID."""
+        return self._unique_id
+
+    @property
+    def name(self):
+        """Return the name of the sensor. Example: Cam14 Rule1 LeftToRight Human Count"""
+        return self._name
+
+    @property
+    def icon(self) -> str:
+        return COUNTER_ICON
+
+    @property
+    def state(self):
+        """Return the count of the last hour"""
+        counter = self._coordinator.get_object_counters().counters.get(self._key)
+        return counter.count(3600, time.time()) if counter is not None else 0
+
+    @property
+    def extra_state_attributes(self):
+        """Return the counts of the last minute, day, 30 days and since Home Assistant started"""
+        attributes = dict(super().extra_state_attributes)
+        counter = self._coordinator.get_object_counters().counters.get(self._key)
+        if counter is not None:
+            now = time.time()
+            attributes["last_minute"] = counter.count(60, now)
+            attributes["last_day"] = counter.count(86400, now)
+            attributes["last_30_days"] = counter.count(30 * 86400, now)
+            attributes["total"] = counter.total
+        return attributes
+
+    async def async_added_to_hass(self):
+        """Connect to the object counters"""
+        await super().async_added_to_hass()
+        self.async_on_remove(self._coordinator.get_object_counters().add_listener(self._handle_counter_changed))
+
+    def _handle_counter_changed(self, key: tuple, is_new: bool):
+        """ Called when a counter changed """
+        if key == self._key:
+            self.async_write_ha_state()
+
+    @property
+    def should_poll(self) -> bool:
+        """Return True if entity has to be polled for state.  False if entity pushes its state to HA"""
+        return False
+
+
+class DahuaOccupancySensor(DahuaBaseEntity, SensorEntity):
+    """
+    The number of objects (humans, vehicles, etc) in an area, an IVS rule or the smart motion view. Objects are tracked
+    by the ObjectID the device gives them from when they appear until they disappear or time out
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry, area_name: str):
+        DahuaBaseEntity.__init__(self, coordinator, config_entry)
+        SensorEntity.__init__(self)
+
+        self._area_name = area_name
+        self._coordinator = coordinator
+        self._name = "{0} {1} Occupancy".format(coordinator.get_device_name(), area_name)
+        self._unique_id = "{0}_occupancy_{1}".format(
+            coordinator.get_serial_number(), area_name.lower().replace(" ", "_"))
+
+    @property
+    def unique_id(self):
+        """Return the entity unique ID."""
+        return self._unique_id
+
+    @property
+    def name(self):
+        """Return the name of the sensor. Example: Cam14 Rule1 Occupancy"""
+        return self._name
+
+    @property
+    def icon(self) -> str:
+        return OCCUPANCY_ICON
+
+    @property
+    def state(self):
+        """Return the number of objects in the area"""
+        area = self._coordinator.get_occupancy().areas.get(self._area_name)
+        return area.count if area is not None else 0
+
+    @property
+    def extra_state_attributes(self):
+        """Return the number of objects in the area per object type, for example Human: 2"""
+        attributes = dict(super().extra_state_attributes)
+        area = self._coordinator.get_occupancy().areas.get(self._area_name)
+        if area is not None:
+            attributes.update(area.counts_by_type())
+        return attributes
+
+    async def async_added_to_hass(self):
+        """Connect to the occupancy tracker"""
+        await super().async_added_to_hass()
+        self.async_on_remove(self._coordinator.get_occupancy().add_listener(self._handle_area_changed))
+
+    def _handle_area_changed(self, name: str, is_new: bool):
+        """ Called when the occupancy of an area changed """
+        if name == self._area_name:
+            self.async_write_ha_state()
+
+    @property
+    def should_poll(self) -> bool:
+        """Return True if entity has to be polled for state.  False if entity pushes its state to HA"""
+        return False
+
+
+class DahuaLatencySensor(DahuaBaseEntity, SensorEntity):
+    """
+    The median time in milliseconds from the device detecting an event until our entities were updated. The attributes
+    have the percentiles of every stage (device to socket, socket to parse, parse to bus, bus to entity) and the device
+    clock offset. Updated with every poll, disabled by default
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry):
+        DahuaBaseEntity.__init__(self, coordinator, config_entry)
+        SensorEntity.__init__(self)
+
+        self._coordinator = coordinator
+        self._name = "{0} Event Latency".format(coordinator.get_device_name())
+        self._unique_id = "{0}_event_latency".format(coordinator.get_serial_number())
+
+    @property
+    def unique_id(self):
+        """Return the entity unique ID."""
+        return self._unique_id
+
+    @property
+    def name(self):
+        """Return the name of the sensor. Example: Cam14 Event Latency"""
+        return self._name
+
+    @property
+    def icon(self) -> str:
+        return LATENCY_ICON
+
+    @property
+    def unit_of_measurement(self) -> str:
+        return "ms"
+
+    @property
+    def entity_registry_enabled_default(self) -> bool:
+        """Diagnostics only, users enable it when they need it"""
+        return False
+
+    @property
+    def state(self):
+        """Return the median end to end latency in milliseconds, None until the device clock was read"""
+        median = self._coordinator.get_latency_tracker().percentiles(STAGE_TOTAL)[0]
+        return round(median * 1000, 1) if median is not None else None
+
+    @property
+    def extra_state_attributes(self):
+        """Return the percentiles of every stage in milliseconds, for example bus_to_entity_p99: 0.4"""
+        attributes = dict(super().extra_state_attributes)
+        tracker = self._coordinator.get_latency_tracker()
+        for stage in STAGES:
+            attributes[stage + "_count"] = tracker.histograms[stage].count
+            for percent, value in zip(PERCENTILES, tracker.percentiles(stage)):
+                if value is not None:
+                    attributes["{0}_p{1}".format(stage, percent)] = round(value * 1000, 1)
+        if tracker.clock_offset is not None:
+            attributes["clock_offset"] = round(tracker.clock_offset, 3)
+        return attributes
+
+
+class DahuaHealthSensor(DahuaBaseEntity, SensorEntity):
+    """
+    A health metric of the device for dashboards and alerts on the integration itself: poll duration, request error
+    rate, event stream uptime and reconnects, events per minute, heartbeat age or VTO keep alive round trip. Updated
+    every minute from in memory counters, so they don't add requests to the device. Disabled by default
+    """
+
+    def __init__(self, coordinator: DahuaDataUpdateCoordinator, config_entry, key: str):
+        DahuaBaseEntity.__init__(self, coordinator, config_entry)
+        SensorEntity.__init__(self)
+
+        self._key = key
+        self._coordinator = coordinator
+        name, self._unit, self._icon = HEALTH_SENSORS[key]
+        self._name = "{0} {1}".format(coordinator.get_device_name(), name)
+        self._unique_id = "{0}_health_{1}".format(coordinator.get_serial_number(), key)
+
+    @property
+    def unique_id(self):
+        """Return the entity unique ID."""
+        return self._unique_id
+
+    @property
+    def name(self):
+        """Return the name of the sensor. Example: Cam14 Poll Duration"""
+        return self._name
+
+    @property
+    def icon(self) -> str:
+        return self._icon
+
+    @property
+    def unit_of_measurement(self):
+        return self._unit
+
+    @property
+    def available(self) -> bool:
+        """Health is most interesting when the device is unavailable, so it stays available"""
+        return True
+
+    @property
+    def entity_registry_enabled_default(self) -> bool:
+        """Diagnostics only, users enable it when they need it"""
+        return False
+
+    @property
+    def state(self):
+        """Return the value of the health metric"""
+        return self._coordinator.get_health_stats()[self._key]
+
+    @property
+    def extra_state_attributes(self):
+        """Events Per Minute has the events per minute by code, for example VideoMotion: 2.0"""
+        attributes = dict(super().extra_state_attributes)
+        if self._key == "events_per_minute":
+            attributes.update(self._coordinator.get_health_stats()["events_per_minute_by_code"])
+        return attributes
+
+    async def async_added_to_hass(self):
+        """Connect to the health samples"""
+        await super().async_added_to_hass()
+        self.async_on_remove(self._coordinator.get_health().add_listener(self.async_write_ha_state))
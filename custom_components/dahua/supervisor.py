@@ -0,0 +1,123 @@
+"""
+Connection supervisor shared by the event stream (HTTP) and VTO (DHIP) links
+"""
+from collections import deque
+import random
+import time
+from typing import Optional
+
+# The first retry waits around this many seconds, each following failure doubles it up to MAX_DELAY_SECONDS
+BASE_DELAY_SECONDS = 2.0
+MAX_DELAY_SECONDS = 120.0
+
+# A connection that stayed up this long is considered healthy. If it then closes cleanly we reconnect right away
+STABLE_AFTER_SECONDS = 60.0
+
+# The number of connects and disconnects kept in the history
+HISTORY_SIZE = 20
+
+
+class ConnectionSupervisor:
+    """
+    ConnectionSupervisor decides how long a link waits before reconnecting and keeps track of the link state.
+
+    Delays grow exponentially (capped at max_delay) and half of each delay is randomized, so a fleet of devices that
+    dropped at the same moment doesn't reconnect in lock step. A connection that was up for at least stable_after
+    seconds and then closed without an error is retried immediately.
+
+    connected() and disconnected() are called from the thread driving the link. The state is only read elsewhere, so
+    plain attribute assignments are good enough here.
+    """
+
+    def __init__(self, name: str, base_delay: float = BASE_DELAY_SECONDS, max_delay: float = MAX_DELAY_SECONDS,
+                 stable_after: float = STABLE_AFTER_SECONDS):
+        self.name = name
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._stable_after = stable_after
+
+        # Number of failed attempts in a row, used as the backoff exponent
+        self._failures = 0
+        self._connected_monotonic: Optional[float] = None
+
+        # Epoch seconds of when the current connection was established. None when not connected
+        self.connected_since: Optional[float] = None
+        # Number of times the link connected again after the first successful connection
+        self.reconnect_count = 0
+        self.connect_count = 0
+        self.last_error: Optional[str] = None
+        self.last_error_time: Optional[float] = None
+        self.last_disconnect_time: Optional[float] = None
+        # The last connects and disconnects, oldest first: (epoch seconds, "connected" or "disconnected", seconds
+        # waited before the next attempt, error). Delay and error are None for connects
+        self.history: deque = deque(maxlen=HISTORY_SIZE)
+
+    def connected(self):
+        """ Records that the link is established """
+        if self.connect_count > 0:
+            self.reconnect_count += 1
+        self.connect_count += 1
+        self.connected_since = time.time()
+        self._connected_monotonic = time.monotonic()
+        self.history.append((self.connected_since, "connected", None, None))
+
+    def disconnected(self, error: Optional[BaseException] = None) -> float:
+        """
+        Records that the link went down (or never came up) and returns the number of seconds to wait before the next
+        connection attempt
+        """
+        uptime = 0.0
+        if self._connected_monotonic is not None:
+            uptime = time.monotonic() - self._connected_monotonic
+
+        self.connected_since = None
+        self._connected_monotonic = None
+        self.last_disconnect_time = time.time()
+        if error is not None:
+            self.last_error = "{0}: {1}".format(type(error).__name__, error)
+            self.last_error_time = self.last_disconnect_time
+
+        if uptime >= self._stable_after:
+            # The previous connection was healthy, start over with the backoff
+            self._failures = 0
+            if error is None:
+                return self._record_disconnect(0.0, None)
+
+        self._failures += 1
+        return self._record_disconnect(self.next_delay(), error)
+
+    def _record_disconnect(self, delay: float, error: Optional[BaseException]) -> float:
+        """ Adds the disconnect to the history and returns the delay """
+        self.history.append((self.last_disconnect_time, "disconnected", delay,
+                             self.last_error if error is not None else None))
+        return delay
+
+    def next_delay(self) -> float:
+        """ Returns a jittered delay for the current number of failures """
+        if self._failures <= 0:
+            return 0.0
+        # Cap the exponent, 2**20 is already way past any sane max_delay
+        delay = min(self._max_delay, self._base_delay * (2 ** min(self._failures - 1, 20)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def is_connected(self) -> bool:
+        """ True if the link is currently up """
+        return self.connected_since is not None
+
+    def as_dict(self) -> dict:
+        """ Returns the link state as a dictionary, useful for diagnostics """
+        return {
+            "name": self.name,
+            "connected": self.is_connected(),
+            "connected_since": self.connected_since,
+            "connect_count": self.connect_count,
+            "reconnect_count": self.reconnect_count,
+            "consecutive_failures": self._failures,
+            "last_error": self.last_error,
+            "last_error_time": self.last_error_time,
+            "last_disconnect_time": self.last_disconnect_time,
+            "history": [
+                {"time": timestamp, "event": event, "delay": delay, "error": error}
+                for timestamp, event, delay, error in self.history
+            ],
+        }
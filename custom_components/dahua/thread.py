@@ -1,17 +1,25 @@
 """ Dahua Thread """
 
 import asyncio
+import concurrent.futures
 import sys
 import threading
 import logging
 import time
+from typing import Dict, Optional
 
 from homeassistant.core import HomeAssistant
 from custom_components.dahua.client import DahuaClient
+from custom_components.dahua.supervisor import ConnectionSupervisor
 from custom_components.dahua.vto import DahuaVTOClient
 
 _LOGGER: logging.Logger = logging.getLogger(__package__)
 
+# How long the old and new event streams may overlap while resubscribing before we stop looking for duplicates
+OVERLAP_MAX_SECONDS = 30.0
+# After the new stream took over we keep suppressing duplicates for this long while the old stream closes
+OVERLAP_GRACE_SECONDS = 2.0
+
 
 class DahuaEventThread(threading.Thread):
     """Connects to device and subscribes to events. Mainly to capture motion detection events. """
@@ -26,6 +34,19 @@ class DahuaEventThread(threading.Thread):
         self.events = events
         self.started = False
         self.channel = channel
+        # Decides when to reconnect and tracks the state of the event stream
+        self.supervisor = ConnectionSupervisor("event_stream")
+
+        # The future of the stream currently delivering events. When the event codes change a new stream is opened and
+        # replaces this one once the device accepted it, see resubscribe
+        self._future: Optional[concurrent.futures.Future] = None
+        self._generation = 0
+        # While two streams overlap we count the chunks seen per generation so the same event isn't handled twice.
+        # Maps chunk bytes to the times each generation delivered them. None when no resubscribe is in progress
+        self._overlap_chunks: Optional[Dict[bytes, Dict[int, int]]] = None
+        self._overlap_until = 0.0
+        # Set when the current stream is aborted from the outside, for example because the heartbeats stopped
+        self._abort_error: Optional[Exception] = None
 
     def run(self):
         """Fetch events"""
@@ -37,29 +58,115 @@ class DahuaEventThread(threading.Thread):
                 _LOGGER.debug("Exiting DahuaEventThread")
                 return
             # submit the coroutine to the event loop thread
-            coro = self.client.stream_events(self.on_receive, self.events, self.channel)
-            future = asyncio.run_coroutine_threadsafe(coro, self.hass.loop)
-            start_time = int(time.time())
+            future = self._subscribe(self.events, self.supervisor.connected)
+            error = None
+            self._abort_error = None
 
-            try:
-                # wait for the coroutine to finish
-                future.result()
-            except asyncio.TimeoutError as ex:
-                _LOGGER.warning("TimeoutError connecting to camera")
-                future.cancel()
-            except Exception as ex:  # pylint: disable=broad-except
-                _LOGGER.debug("%s", ex)
+            while True:
+                try:
+                    # wait for the coroutine to finish
+                    future.result()
+                except concurrent.futures.CancelledError:
+                    pass
+                except asyncio.TimeoutError as ex:
+                    _LOGGER.warning("TimeoutError connecting to camera")
+                    future.cancel()
+                    error = ex
+                except Exception as ex:  # pylint: disable=broad-except
+                    _LOGGER.debug("%s", ex)
+                    error = ex
+
+                # If a newer stream took over (the event codes changed) then keep following that one
+                if self.started and self._future is not future:
+                    future = self._future
+                    error = None
+                    continue
+                break
+
+            if error is None:
+                error = self._abort_error
 
             if not self.started:
                 _LOGGER.debug("Exiting DahuaEventThread")
                 return
 
-            end_time = int(time.time())
-            if (end_time - start_time) < 10:
-                # We are failing fast when trying to connect to the camera. Let's retry slowly
-                time.sleep(60)
+            delay = self.supervisor.disconnected(error)
+            _LOGGER.debug("reconnecting to camera's event stream in %.1f seconds...", delay)
+            if self.stopped.wait(delay):
+                _LOGGER.debug("Exiting DahuaEventThread")
+                return
+
+    def resubscribe(self, events: list):
+        """
+        Changes the subscribed event codes without a gap in coverage (make before break). A new attach stream is opened
+        with the new codes and only once the device accepted it is the old stream closed. Chunks delivered by both
+        streams while they overlap are only handled once.
+        """
+        self.events = events
+        if not self.started or self._future is None or self._future.done():
+            # Not streaming right now, the new codes will be used on the next connect
+            return
+
+        self._overlap_chunks = {}
+        self._overlap_until = time.monotonic() + OVERLAP_MAX_SECONDS
+
+        def take_over():
+            _LOGGER.debug("New event stream accepted, closing the old one")
+            # The thread might have reconnected in the meantime, so close whatever stream is current at this point
+            old_future = self._future
+            self._future = new_future
+            # Keep suppressing duplicates for a little while as the old stream might still be flushing
+            self._overlap_until = time.monotonic() + OVERLAP_GRACE_SECONDS
+            old_future.cancel()
 
-            _LOGGER.debug("reconnecting to camera's event stream...")
+        def on_done(future: concurrent.futures.Future):
+            if self._future is not future and not future.cancelled() and future.exception() is not None:
+                _LOGGER.warning("Failed to resubscribe to events %s, keeping the current stream: %s", events,
+                                future.exception())
+                self._overlap_chunks = None
+
+        new_future = self._subscribe(events, take_over, track=False)
+        new_future.add_done_callback(on_done)
+
+    def abort_stream(self, error: Exception):
+        """
+        Closes the current event stream, the thread will reconnect as usual. Used when the device stopped sending
+        heartbeats as a half open connection would otherwise hang forever
+        """
+        future = self._future
+        if future is not None and not future.done():
+            self._abort_error = error
+            future.cancel()
+
+    def _subscribe(self, events: list, on_connect, track: bool = True) -> concurrent.futures.Future:
+        """ Submits a new event stream to the HA loop and returns its future """
+        self._generation += 1
+        generation = self._generation
+
+        def on_receive(data: bytes, channel: int):
+            if self._overlap_chunks is not None and self._is_duplicate(generation, data):
+                return None
+            return self.on_receive(data, channel)
+
+        coro = self.client.stream_events(on_receive, events, self.channel, on_connect=on_connect)
+        future = asyncio.run_coroutine_threadsafe(coro, self.hass.loop)
+        if track:
+            self._future = future
+        return future
+
+    def _is_duplicate(self, generation: int, data: bytes) -> bool:
+        """
+        Returns true if data was already delivered by the other stream while both streams overlap. Events without data
+        are byte identical every time they happen, so occurrences are matched: the nth time a stream delivers a chunk
+        it's a duplicate only if the other stream delivered that chunk at least n times
+        """
+        if time.monotonic() > self._overlap_until:
+            self._overlap_chunks = None
+            return False
+        counts = self._overlap_chunks.setdefault(data, {})
+        occurrence = counts.get(generation, 0) + 1
+        counts[generation] = occurrence
+        return any(count >= occurrence for other, count in counts.items() if other != generation)
 
     def stop(self):
         """ Signals to the thread loop that we should stop """
@@ -73,12 +180,15 @@ class DahuaVtoEventThread(threading.Thread):
     """Connects to device and subscribes to events. Mainly to capture motion detection events. """
 
     def __init__(self, hass: HomeAssistant, client: DahuaClient, on_receive_vto_event, host: str,
-                 port: int, username: str, password: str):
+                 port: int, username: str, password: str, on_alive=None, event_filter=None, on_frame=None):
         """Construct a thread listening for events."""
         threading.Thread.__init__(self)
         self.hass = hass
         self.stopped = threading.Event()
         self.on_receive_vto_event = on_receive_vto_event
+        self.on_alive = on_alive
+        self.event_filter = event_filter
+        self.on_frame = on_frame
         self.client = client
         self.started = False
         self._host = host
@@ -87,6 +197,8 @@ class DahuaVtoEventThread(threading.Thread):
         self._password = password
         self._is_ssl = False
         self.vto_client = None
+        # Decides when to reconnect and tracks the state of the VTO connection
+        self.supervisor = ConnectionSupervisor("vto")
 
     def run(self):
         """Fetch VTO events"""
@@ -113,18 +225,23 @@ class DahuaVtoEventThread(threading.Thread):
                     # which is done through loop.create_connection. This makes it awkward to capture... which is why
                     # I've done this. I'm sure there's a better way :)
                     self.vto_client = DahuaVTOClient(self._host, self._username, self._password, self._is_ssl,
-                                                     self.on_receive_vto_event)
+                                                     self.on_receive_vto_event, self.on_alive, self.event_filter,
+                                                     self.on_frame)
                     return self.vto_client
 
                 client = loop.create_connection(vto_client_lambda, host=self._host, port=self._port)
 
                 loop.run_until_complete(client)
+                self.supervisor.connected()
                 loop.run_forever()
                 loop.close()
 
-                _LOGGER.warning("Disconnected from VTO, will try to connect in 5 seconds")
+                if not self.started:
+                    _LOGGER.debug("Exiting DahuaVtoEventThread")
+                    return
 
-                time.sleep(5)
+                delay = self.supervisor.disconnected(self.vto_client.connection_error)
+                _LOGGER.warning("Disconnected from VTO, will try to connect in %.1f seconds", delay)
 
             except Exception as ex:
                 if not self.started:
@@ -133,9 +250,13 @@ class DahuaVtoEventThread(threading.Thread):
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 line = exc_tb.tb_lineno
 
-                _LOGGER.error(f"Connection to VTO failed will try to connect in 30 seconds, error: {ex}, Line: {line}")
+                delay = self.supervisor.disconnected(ex)
+                _LOGGER.error("Connection to VTO failed will try to connect in %.1f seconds, error: %s, Line: %s",
+                              delay, ex, line)
 
-                time.sleep(30)
+            if self.stopped.wait(delay):
+                _LOGGER.debug("Exiting DahuaVtoEventThread")
+                return
 
     def stop(self):
         """ Signals to the thread loop that we should stop """
@@ -0,0 +1,142 @@
+"""
+Hashed timer wheel shared by all Dahua devices, used to expire event states
+"""
+import logging
+import math
+import time
+from typing import Callable, List, Optional, Set
+
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN_DATA
+
+_LOGGER: logging.Logger = logging.getLogger(__package__)
+
+# Timers fire on a whole tick, so this is also the precision of the timers
+TICK_SECONDS = 1.0
+# Number of slots in the wheel. Timers further out than this many ticks simply stay in their slot for more rounds
+WHEEL_SIZE = 512
+
+
+class WheelTimer:
+    """ A timer scheduled on the TimerWheel. Call cancel() to cancel it """
+    __slots__ = ("when", "tick", "callback", "args", "_wheel")
+
+    def __init__(self, wheel, when: float, tick: int, callback: Callable, args: tuple):
+        # monotonic time the timer is due
+        self.when = when
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self._wheel = wheel
+
+    def cancel(self):
+        """ Cancels the timer, does nothing if it already fired or was cancelled """
+        if self._wheel is not None:
+            self._wheel.cancel(self)
+
+    def remaining(self) -> float:
+        """ Seconds until the timer is due """
+        return max(0.0, self.when - time.monotonic())
+
+
+class TimerWheel:
+    """
+    TimerWheel runs many timers from a single loop callback. Timers are put in one of size slots by the tick they are
+    due (tick modulo size), so scheduling and cancelling is O(1) no matter how many timers there are. While timers are
+    pending the wheel wakes up once per tick and fires the timers of the slots it passed. When there are no timers it
+    doesn't wake up at all.
+
+    Precision is one tick, timers fire up to a tick late. That's fine for clearing event states but don't use it for
+    anything that needs to be precise. Must only be used from the HA loop.
+    """
+
+    def __init__(self, hass: HomeAssistant, tick: float = TICK_SECONDS, size: int = WHEEL_SIZE):
+        self._hass = hass
+        self._tick = tick
+        self._size = size
+        self._slots: List[Set[WheelTimer]] = [set() for _ in range(size)]
+        self._origin = time.monotonic()
+        # The last tick that was processed, all timers due on or before it fired
+        self._current = 0
+        self._count = 0
+        self._handle = None
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay: float, callback: Callable, *args) -> WheelTimer:
+        """ Calls callback(*args) in delay seconds (rounded up to the next tick). Returns the timer """
+        when = time.monotonic() + delay
+        tick = max(math.ceil((when - self._origin) / self._tick), self._current + 1)
+        timer = WheelTimer(self, when, tick, callback, args)
+        self._slots[tick % self._size].add(timer)
+        self._count += 1
+        if self._handle is None:
+            self._schedule_next()
+        return timer
+
+    def cancel(self, timer: WheelTimer):
+        """ Cancels the timer """
+        slot = self._slots[timer.tick % self._size]
+        if timer in slot:
+            slot.remove(timer)
+            self._count -= 1
+        timer._wheel = None
+        if self._count == 0 and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def stop(self):
+        """ Cancels all timers """
+        for slot in self._slots:
+            for timer in slot:
+                timer._wheel = None
+            slot.clear()
+        self._count = 0
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule_next(self):
+        """ Wakes up on the next tick boundary """
+        self._handle = self._hass.loop.call_at(self._hass.loop.time() + self._tick, self._advance)
+
+    def _advance(self):
+        """ Fires all timers due up to now. If the loop was late we catch up on all ticks we missed """
+        self._handle = None
+        now = math.floor((time.monotonic() - self._origin) / self._tick)
+        # There's no point in looking at the same slot twice in one pass
+        last = min(now, self._current + self._size)
+        while self._current < last:
+            self._current += 1
+            slot = self._slots[self._current % self._size]
+            due = [timer for timer in slot if timer.tick <= now]
+            for timer in due:
+                if timer not in slot:
+                    # Cancelled by the callback of a timer that fired before it
+                    continue
+                slot.remove(timer)
+                self._count -= 1
+                timer._wheel = None
+                self._fire(timer)
+        self._current = max(self._current, now)
+
+        if self._count > 0 and self._handle is None:
+            self._schedule_next()
+
+    @staticmethod
+    def _fire(timer: WheelTimer):
+        try:
+            timer.callback(*timer.args)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error in timer callback %s", timer.callback)
+
+
+def get_timer_wheel(hass: HomeAssistant) -> TimerWheel:
+    """ Returns the timer wheel shared by all Dahua devices, it's created on first use """
+    data = hass.data.setdefault(DOMAIN_DATA, {})
+    wheel: Optional[TimerWheel] = data.get("timer_wheel")
+    if wheel is None:
+        wheel = data["timer_wheel"] = TimerWheel(hass)
+    return wheel
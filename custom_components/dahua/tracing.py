@@ -0,0 +1,198 @@
+"""
+Lightweight tracing of the hot paths: HTTP requests (by endpoint, including the digest auth handshake), parsing and
+event dispatch. Spans are timed and handed to the sinks. Tracing is off while there are no sinks, a span then costs a
+global lookup
+"""
+from abc import ABC, abstractmethod
+import asyncio
+import functools
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN_DATA
+from .latency import LatencyHistogram
+
+# Span names
+SPAN_HTTP_PREFIX = "http."
+SPAN_HTTP_AUTH = "http.auth"
+SPAN_PARSE_API_RESPONSE = "parse.api_response"
+SPAN_PARSE_EVENT = "parse.event"
+SPAN_PARSE_VTO = "parse.vto"
+SPAN_PUBLISH = "dispatch.publish"
+SPAN_DISPATCH = "dispatch.entities"
+
+# /cgi-bin/configManager.cgi?action=getConfig&name=Lighting becomes http.configManager.getConfig
+_ENDPOINT_PATTERN = re.compile(r"/([^/?]+?)(?:\.cgi)?(?:\?(?:.*&)?action=([^&]+))?(?:[&?]|$)")
+
+# True while there are sinks, checked before any timing
+enabled = False
+_sinks: List["TraceSink"] = []
+
+
+class TraceSink(ABC):
+    """
+    A sink receives every finished span. record is called where the span ended, that's the event loop except for VTO
+    parsing which happens on the VTO thread, so it must be quick, not block and be thread safe
+    """
+
+    @abstractmethod
+    def record(self, name: str, seconds: float, error: bool):
+        """ Receives a finished span """
+
+
+def add_sink(sink: TraceSink) -> Callable[[], None]:
+    """ Adds a sink and turns tracing on. Returns a function removing the sink """
+    global enabled
+    _sinks.append(sink)
+    enabled = True
+    return lambda: remove_sink(sink)
+
+
+def remove_sink(sink: TraceSink):
+    """ Removes a sink, tracing is turned off with the last sink """
+    global enabled
+    if sink in _sinks:
+        _sinks.remove(sink)
+    enabled = bool(_sinks)
+
+
+def record(name: str, seconds: float, error: bool = False):
+    """ Hands a span to the sinks """
+    for sink in tuple(_sinks):
+        sink.record(name, seconds, error)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """ Returns a context manager timing the block as a span, it does nothing when tracing is off """
+    return _Span(name) if enabled else _NULL_SPAN
+
+
+def request_span(url: str):
+    """ Returns a span for an HTTP request named after its endpoint class, the name is only worked out when tracing """
+    return _Span(endpoint_name(url)) if enabled else _NULL_SPAN
+
+
+def endpoint_name(url: str) -> str:
+    """ Returns the endpoint class of a URL, the CGI and its action. Example: http.configManager.getConfig """
+    path = url.split("://", 1)[-1]
+    path = path[path.find("/"):] if "/" in path else "/"
+    match = _ENDPOINT_PATTERN.search(path)
+    if match is None:
+        return SPAN_HTTP_PREFIX + "other"
+    cgi, action = match.groups()
+    return SPAN_HTTP_PREFIX + (cgi if action is None else cgi + "." + action)
+
+
+def traced(name: str):
+    """ Decorates a function or coroutine function so its calls are spans """
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled:
+                    return await func(*args, **kwargs)
+                with _Span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TraceStats(TraceSink):
+    """
+    A sink keeping the count, errors and a latency histogram per span name. Spans are recorded from the VTO thread too,
+    so the histograms are only read and written under the lock
+    """
+
+    def __init__(self):
+        self.spans: Dict[str, LatencyHistogram] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, error: bool):
+        with self._lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = LatencyHistogram()
+            histogram.add(seconds)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def as_dict(self) -> dict:
+        """ Returns the stats of every span in milliseconds, useful for diagnostics """
+        result = {}
+        with self._lock:
+            for name, histogram in sorted(self.spans.items()):
+                stats = histogram.as_dict()
+                stats["errors"] = self.errors.get(name, 0)
+                result[name] = stats
+        return result
+
+
+def acquire_trace_stats(hass: HomeAssistant, owner) -> TraceStats:
+    """ Returns the trace stats shared by all Dahua devices, tracing is on until every owner released them """
+    data = hass.data.setdefault(DOMAIN_DATA, {})
+    stats: Optional[TraceStats] = data.get("trace_stats")
+    if stats is None:
+        stats = data["trace_stats"] = TraceStats()
+        data["trace_owners"] = set()
+        add_sink(stats)
+    data["trace_owners"].add(owner)
+    return stats
+
+
+def release_trace_stats(hass: HomeAssistant, owner):
+    """ Releases the trace stats, the last owner turns them off """
+    data = hass.data.get(DOMAIN_DATA, {})
+    stats: Optional[TraceStats] = data.get("trace_stats")
+    if stats is None:
+        return
+    owners = data["trace_owners"]
+    owners.discard(owner)
+    if not owners:
+        remove_sink(stats)
+        del data["trace_stats"]
+        del data["trace_owners"]
@@ -2,17 +2,21 @@
 Copied and modified from https://github.com/elad-bar/DahuaVTO2MQTT
 Thanks to @elad-bar
 """
+import re
 import struct
 import sys
 import logging
 import json
 import asyncio
 import hashlib
+import time
 from threading import Timer
 from typing import Optional, Callable
 import requests
 from requests.auth import HTTPDigestAuth
 
+from . import tracing
+
 PROTOCOLS = {
     True: "https",
     False: "http"
@@ -32,6 +36,10 @@ DAHUA_CONFIG_MANAGER_GETCONFIG = "configManager.getConfig"
 DAHUA_MAGICBOX_GETSOFTWAREVERSION = "magicBox.getSoftwareVersion"
 DAHUA_MAGICBOX_GETDEVICETYPE = "magicBox.getDeviceType"
 
+# Used to look at the event codes of a message without decoding it
+EVENT_STREAM_METHOD_PATTERN = re.compile(r'"method"\s*:\s*"client\.notifyEventStream"')
+EVENT_CODE_PATTERN = re.compile(r'"Code"\s*:\s*"([^"]*)"')
+
 DAHUA_ALLOWED_DETAILS = [
     DAHUA_DEVICE_TYPE,
     DAHUA_SERIAL_NUMBER
@@ -54,7 +62,8 @@ class DahuaVTOClient(asyncio.Protocol):
     auth: HTTPDigestAuth
     data_handlers: {}
 
-    def __init__(self, host: str, username: str, password: str, is_ssl: bool, on_receive_vto_event):
+    def __init__(self, host: str, username: str, password: str, is_ssl: bool, on_receive_vto_event, on_alive=None,
+                 event_filter=None, on_frame=None):
         self.dahua_details = {}
         self.host = host
         self.username = username
@@ -67,13 +76,23 @@ class DahuaVTOClient(asyncio.Protocol):
         self.request_id = 1
         self.sessionId = 0
         self.keep_alive_interval = 0
+        # Seconds the last keep alive took to be answered, None until the first answer
+        self.keep_alive_rtt = None
         self.transport = None
         self.hold_time = 0
         self.lock_status = {}
         self.data_handlers = {}
+        # The exception the connection was lost with, None when the device closed the connection cleanly
+        self.connection_error = None
 
         # This is the hook back into HA
         self.on_receive_vto_event = on_receive_vto_event
+        # Called whenever the VTO sends us anything (events, keep alive responses), used to track if the VTO is alive
+        self.on_alive = on_alive
+        # Optional function of the event code, returns False for events nobody wants so they aren't decoded
+        self.event_filter = event_filter
+        # Optional function of (direction, data) called with every DHIP frame received ("in") and sent ("out")
+        self.on_frame = on_frame
         self._loop = asyncio.get_event_loop()
 
     def connection_made(self, transport):
@@ -89,9 +108,13 @@ class DahuaVTOClient(asyncio.Protocol):
             _LOGGER.error(f"Failed to handle message, error: {ex}, Line: {exc_tb.tb_lineno}")
 
     def data_received(self, data):
-        _LOGGER.debug(f"Event data {self.host}: '{data}'")
+        _LOGGER.debug("Event data %s: '%s'", self.host, data)
+        if self.on_frame is not None:
+            self.on_frame("in", data)
+        if self.on_alive is not None:
+            self.on_alive()
         try:
-            messages = self.parse_response(data)
+            messages = self.parse_response(data, self.event_filter)
             for message in messages:
                 message_id = message.get("id")
 
@@ -128,6 +151,7 @@ class DahuaVTOClient(asyncio.Protocol):
 
     def connection_lost(self, exc):
         _LOGGER.error('server closed the connection')
+        self.connection_error = exc
 
         self._loop.stop()
 
@@ -149,6 +173,8 @@ class DahuaVTOClient(asyncio.Protocol):
 
         if not self.transport.is_closing():
             message = self.convert_message(message_data)
+            if self.on_frame is not None:
+                self.on_frame("out", message)
 
             self.transport.write(message)
 
@@ -322,8 +348,10 @@ class DahuaVTOClient(asyncio.Protocol):
 
     def keep_alive(self):
         _LOGGER.debug("Keep alive")
+        sent = time.monotonic()
 
         def handle_keep_alive(message):
+            self.keep_alive_rtt = time.monotonic() - sent
             Timer(self.keep_alive_interval, self.keep_alive).start()
 
         request_data = {
@@ -334,7 +362,12 @@ class DahuaVTOClient(asyncio.Protocol):
         self.send(DAHUA_GLOBAL_KEEPALIVE, handle_keep_alive, request_data)
 
     @staticmethod
-    def parse_response(response):
+    @tracing.traced(tracing.SPAN_PARSE_VTO)
+    def parse_response(response, event_filter=None):
+        """
+        Parses the messages in the response. event_filter is an optional function of the event code. Event stream
+        messages where it returns False for every event are skipped without being decoded.
+        """
         result = []
 
         try:
@@ -353,6 +386,10 @@ class DahuaVTOClient(asyncio.Protocol):
                     end = response_part.rfind("}") + 1
                     if end > 0:
                         message = response_part[0:end]
+                        if event_filter is not None and EVENT_STREAM_METHOD_PATTERN.search(message) is not None:
+                            codes = EVENT_CODE_PATTERN.findall(message)
+                            if codes and not any(event_filter(code) for code in codes):
+                                continue
                         result.append(json.loads(message))
                     else:
                         _LOGGER.error(f"Malformed or truncated message returned from device '{response_part}'")
@@ -0,0 +1,215 @@
+"""
+Spatial zones (polygons and lines) matched against the objects of IVS events. Dahua reports object positions in
+coordinates normalized to 8192x8192, whatever the resolution of the stream
+"""
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .models import DahuaEvent
+
+# Size of the normalized coordinate space of IVS events
+COORDINATE_SPACE = 8192
+
+# IVS events whose objects are matched against the zones
+ZONE_CODES = frozenset((
+    "CrossLineDetection",
+    "CrossRegionDetection",
+    "SmartMotionHuman",
+    "SmartMotionVehicle",
+    "LeftDetection",
+    "TakenAwayDetection",
+    "WanderDetection",
+    "StayDetection",
+    "ParkingDetection",
+    "MoveDetection",
+    "RioterDetection",
+    "FaceDetection",
+))
+
+# Zone sensors are kept in the event registry under this prefix plus the zone name, like rule sensors
+ZONE_EVENT_PREFIX = "Zone:"
+
+# The coordinate space is split into GRID_SIZE x GRID_SIZE cells, each cell lists the zones that overlap it so an
+# object is only tested against the zones near it
+GRID_SIZE = 16
+_CELL_SIZE = COORDINATE_SPACE // GRID_SIZE
+
+Point = Tuple[int, int]
+Box = Tuple[int, int, int, int]
+
+
+def parse_spatial_zones(text: str) -> Dict[str, Tuple[Point, ...]]:
+    """
+    Parses the spatial zones option. Zones are separated by ; and are a name and a list of x,y points in the 8192x8192
+    space of IVS events. Two points make a line, three or more a polygon. Example:
+    "Driveway=0,4000 8191,4000 8191,8191 0,8191; Gate=4096,0 4096,8191"
+    Raises ValueError if it's not valid
+    """
+    zones = {}
+    for entry in (text or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, points_text = entry.partition("=")
+        name = name.strip()
+        if not sep or not name:
+            raise ValueError("Expected Name=x,y x,y ... but got '{0}'".format(entry))
+        points = []
+        for point in points_text.split():
+            x, sep, y = point.partition(",")
+            try:
+                x, y = int(x), int(y)
+            except ValueError:
+                raise ValueError("Invalid point '{0}' in '{1}'".format(point, entry)) from None
+            if not sep or not 0 <= x < COORDINATE_SPACE or not 0 <= y < COORDINATE_SPACE:
+                raise ValueError("Point '{0}' must be x,y within 0-{1} in '{2}'".format(
+                    point, COORDINATE_SPACE - 1, entry))
+            points.append((x, y))
+        if len(points) < 2:
+            raise ValueError("A zone needs 2 points (line) or more (polygon) in '{0}'".format(entry))
+        zones[name] = tuple(points)
+    return zones
+
+
+class SpatialZone:
+    """ A compiled zone: its bounding box and edges """
+    __slots__ = ("name", "is_line", "bounds", "edges", "matches")
+
+    def __init__(self, name: str, points: Sequence[Point]):
+        self.name = name
+        self.is_line = len(points) == 2
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        self.bounds: Box = (min(xs), min(ys), max(xs), max(ys))
+        if self.is_line:
+            self.edges = ((points[0][0], points[0][1], points[1][0], points[1][1]),)
+        else:
+            self.edges = tuple((x1, y1, x2, y2) for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]))
+        self.matches = 0
+
+    def contains(self, x: float, y: float) -> bool:
+        """ True if the point is in the polygon, by ray casting """
+        min_x, min_y, max_x, max_y = self.bounds
+        if x < min_x or x > max_x or y < min_y or y > max_y:
+            return False
+        inside = False
+        for x1, y1, x2, y2 in self.edges:
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+        return inside
+
+    def crosses(self, box: Box) -> bool:
+        """ True if the line goes through the box, by clipping the line to the box (Liang-Barsky) """
+        left, top, right, bottom = box
+        x1, y1, x2, y2 = self.edges[0]
+        dx = x2 - x1
+        dy = y2 - y1
+        start, end = 0.0, 1.0
+        for p, q in ((-dx, x1 - left), (dx, right - x1), (-dy, y1 - top), (dy, bottom - y1)):
+            if p == 0:
+                if q < 0:
+                    return False
+                continue
+            t = q / p
+            if p < 0:
+                start = max(start, t)
+            else:
+                end = min(end, t)
+            if start > end:
+                return False
+        return True
+
+
+def object_position(obj: dict) -> Tuple[Optional[Point], Optional[Box]]:
+    """ Returns the center and bounding box of an IVS object, the center is that of the box if it isn't given """
+    box = obj.get("BoundingBox")
+    if isinstance(box, list) and len(box) == 4:
+        box = (min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3]))
+    else:
+        box = None
+    center = obj.get("Center")
+    if isinstance(center, list) and len(center) == 2:
+        center = (center[0], center[1])
+    elif box is not None:
+        center = ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+    else:
+        center = None
+    return center, box
+
+
+class SpatialZoneIndex:
+    """
+    SpatialZoneIndex matches the objects of IVS events against the zones of a channel. The zones are compiled once
+    into a grid of cells, each cell listing the zones overlapping it. An object is in a polygon zone when its center is
+    in the polygon, and in a line zone when its bounding box crosses the line. All objects of an event are matched in
+    one pass, each object only against the zones of the cells it covers.
+    """
+
+    def __init__(self, zones: Dict[str, Sequence[Point]]):
+        self.zones: List[SpatialZone] = [SpatialZone(name, points) for name, points in zones.items()]
+        cells: List[List[SpatialZone]] = [[] for _ in range(GRID_SIZE * GRID_SIZE)]
+        for zone in self.zones:
+            for cell in _cells(zone.bounds):
+                cells[cell].append(zone)
+        self._cells: List[Tuple[SpatialZone, ...]] = [tuple(zones) for zones in cells]
+        self.evaluated = 0
+
+    def names(self) -> List[str]:
+        return [zone.name for zone in self.zones]
+
+    def match(self, event: DahuaEvent) -> List[str]:
+        """ Returns the names of the zones the objects of the event are in, in configured order """
+        data = event.data_dict()
+        objects = data.get("Objects", data.get("Object"))
+        if isinstance(objects, dict):
+            objects = (objects,)
+        elif not isinstance(objects, list):
+            return []
+
+        self.evaluated += 1
+        matched = set()
+        for obj in objects:
+            if not isinstance(obj, dict):
+                continue
+            center, box = object_position(obj)
+            if center is None:
+                continue
+            candidates = set(self._cells[_cell(center)])
+            if box is not None:
+                for cell in _cells(box):
+                    candidates.update(self._cells[cell])
+            for zone in candidates:
+                if zone in matched:
+                    continue
+                if zone.is_line:
+                    if box is not None and zone.crosses(box):
+                        matched.add(zone)
+                elif zone.contains(center[0], center[1]):
+                    matched.add(zone)
+
+        for zone in matched:
+            zone.matches += 1
+        return [zone.name for zone in self.zones if zone in matched]
+
+    def as_dict(self) -> dict:
+        """ Returns the zones and their match counts, useful for diagnostics """
+        return {
+            "evaluated": self.evaluated,
+            "zones": {zone.name: {"line": zone.is_line, "matches": zone.matches} for zone in self.zones},
+        }
+
+
+def _cell(point) -> int:
+    x = min(max(int(point[0]), 0), COORDINATE_SPACE - 1)
+    y = min(max(int(point[1]), 0), COORDINATE_SPACE - 1)
+    return (y // _CELL_SIZE) * GRID_SIZE + x // _CELL_SIZE
+
+
+def _cells(box) -> Iterator[int]:
+    """ Yields the cells overlapping the box """
+    first = _cell((box[0], box[1]))
+    last = _cell((box[2], box[3]))
+    first_row, first_column = divmod(first, GRID_SIZE)
+    last_row, last_column = divmod(last, GRID_SIZE)
+    for row in range(first_row, last_row + 1):
+        for column in range(first_column, last_column + 1):
+            yield row * GRID_SIZE + column
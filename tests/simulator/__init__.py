@@ -0,0 +1,21 @@
+"""
+A simulated Dahua device for tests and benchmarks that need no real camera: the CGI API, the event stream, RPC2 and the
+DHIP protocol of doorbells, with digest authentication, latency and faults. See simulator.py
+"""
+from .events import ACTION_PULSE, ACTION_START, ACTION_STOP, ScriptedEvent, SimulatedEvent
+from .faults import Faults
+from .simulator import DahuaSimulator
+from .state import DEVICE_CAMERA, DEVICE_DOORBELL, DeviceState
+
+__all__ = [
+    "ACTION_PULSE",
+    "ACTION_START",
+    "ACTION_STOP",
+    "DEVICE_CAMERA",
+    "DEVICE_DOORBELL",
+    "DahuaSimulator",
+    "DeviceState",
+    "Faults",
+    "ScriptedEvent",
+    "SimulatedEvent",
+]
@@ -0,0 +1,69 @@
+"""
+Runs a simulated device until interrupted, from the root of the repository:
+
+    python -m tests.simulator --port 8080
+    python -m tests.simulator --device doorbell --port 8080 --vto-port 5000
+    python -m tests.simulator --latency 0.05 --jitter 0.02 --drop-rate 0.01 --event VideoMotion:0.5:Start:2
+
+--event is CODE:RATE[:ACTION[:HOLD]], RATE in events per second, ACTION Pulse (the default) or Start, which is followed
+by a Stop after HOLD seconds
+"""
+import argparse
+import asyncio
+import logging
+
+from .events import ACTION_PULSE, ScriptedEvent
+from .faults import Faults
+from .simulator import DahuaSimulator
+from .state import DEVICE_CAMERA, DEVICE_DOORBELL, DeviceState
+
+
+def parse_event(text: str) -> ScriptedEvent:
+    parts = text.split(":")
+    if len(parts) < 2:
+        raise argparse.ArgumentTypeError("expected CODE:RATE[:ACTION[:HOLD]], got " + text)
+    action = parts[2] if len(parts) > 2 else ACTION_PULSE
+    hold = float(parts[3]) if len(parts) > 3 else 1.0
+    return ScriptedEvent(parts[0], float(parts[1]), action, hold=hold)
+
+
+async def async_main(args):
+    faults = Faults(latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate, seed=args.seed)
+    state = DeviceState(args.device, args.model)
+    simulator = DahuaSimulator(username=args.username, password=args.password, host=args.host, http_port=args.port,
+                               vto_port=args.vto_port, faults=faults, state=state)
+    async with simulator:
+        logging.info("Simulating a %s (%s) on http://%s:%s", state.device, state.model, args.host, simulator.http_port)
+        if state.device == DEVICE_DOORBELL:
+            logging.info("DHIP on %s:%s", args.host, simulator.vto_port)
+        for scripted in args.event:
+            simulator.start_script(scripted)
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tests.simulator", description="A simulated Dahua device")
+    parser.add_argument("--device", choices=(DEVICE_CAMERA, DEVICE_DOORBELL), default=DEVICE_CAMERA)
+    parser.add_argument("--model", help="the device type, for example IPC-HDW5831R-ZE or VTO2202F-P")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="the HTTP port")
+    parser.add_argument("--vto-port", type=int, default=5000, help="the DHIP port of doorbells")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every response and event is delayed")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds the latency varies by, up or down")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="the fraction of requests that are dropped")
+    parser.add_argument("--seed", type=int, help="the seed of the random numbers, for repeatable runs")
+    parser.add_argument("--event", type=parse_event, action="append", default=[],
+                        help="publish an event at a rate, CODE:RATE[:ACTION[:HOLD]]")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(async_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+The server side of HTTP digest authentication (RFC 2617 with qop=auth) and of the RPC2/DHIP login challenge
+"""
+import hashlib
+import os
+from typing import Dict, Optional
+
+
+def _md5(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def parse_authorization(header: str) -> Optional[Dict[str, str]]:
+    """ Parses an Authorization: Digest header into its fields, None if it isn't a digest authorization """
+    scheme, _, fields = header.partition(" ")
+    if scheme.lower() != "digest":
+        return None
+    result = {}
+    for field in _split_fields(fields):
+        key, _, value = field.strip().partition("=")
+        result[key.strip().lower()] = value.strip().strip('"')
+    return result
+
+
+def _split_fields(fields: str):
+    """ Splits on the commas that aren't in a quoted value """
+    start, quoted = 0, False
+    for position, char in enumerate(fields):
+        if char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            yield fields[start:position]
+            start = position + 1
+    yield fields[start:]
+
+
+class DigestAuthenticator:
+    """
+    DigestAuthenticator checks the digest authorization of requests. Nonces are issued by challenge and stay valid
+    until expire_nonces is called, like a device that was rebooted
+    """
+
+    def __init__(self, username: str, password: str, realm: str):
+        self.username = username
+        self.password = password
+        self.realm = realm
+        self.opaque = os.urandom(16).hex()
+        self._nonces = set()
+
+    def challenge(self) -> str:
+        """ Returns the WWW-Authenticate header of a 401 response with a new nonce """
+        nonce = os.urandom(8).hex()
+        self._nonces.add(nonce)
+        return 'Digest realm="{0}", qop="auth", nonce="{1}", opaque="{2}"'.format(self.realm, nonce, self.opaque)
+
+    def expire_nonces(self):
+        self._nonces.clear()
+
+    def is_authorized(self, method: str, authorization: Optional[str]) -> bool:
+        """ True if the Authorization header has a valid digest response for the method """
+        if not authorization:
+            return False
+        fields = parse_authorization(authorization)
+        if fields is None or fields.get("username") != self.username or fields.get("nonce") not in self._nonces:
+            return False
+        algorithm = fields.get("algorithm", "MD5").upper()
+        ha1 = _md5("{0}:{1}:{2}".format(self.username, self.realm, self.password))
+        if algorithm == "MD5-SESS":
+            ha1 = _md5("{0}:{1}:{2}".format(ha1, fields["nonce"], fields.get("cnonce", "")))
+        elif algorithm != "MD5":
+            return False
+        ha2 = _md5("{0}:{1}".format(method, fields.get("uri", "")))
+        if fields.get("qop"):
+            expected = _md5(":".join([ha1, fields["nonce"], fields.get("nc", ""), fields.get("cnonce", ""),
+                                      fields["qop"], ha2]))
+        else:
+            expected = _md5("{0}:{1}:{2}".format(ha1, fields["nonce"], ha2))
+        return fields.get("response") == expected
+
+
+def login_hash(username: str, password: str, realm: str, random: str) -> str:
+    """ The password hash of an RPC2 or DHIP global.login, see DahuaVTOClient._get_hashed_password """
+    password_hash = _md5("{0}:{1}:{2}".format(username, realm, password)).upper()
+    return _md5("{0}:{1}:{2}".format(username, random, password_hash)).upper()
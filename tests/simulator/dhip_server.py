@@ -0,0 +1,135 @@
+"""
+The DHIP protocol of a simulated doorbell (VTO): JSON RPC messages behind a 32 byte header, on port 5000 of real devices
+"""
+import asyncio
+import json
+import logging
+import struct
+import time
+from typing import Optional, Set
+
+from .events import EventHub, Subscription
+from .faults import Faults
+from .rpc import ATTACH_METHOD, EVENT_STREAM_SID, KEEP_ALIVE_INTERVAL, RpcHandler
+
+_LOGGER: logging.Logger = logging.getLogger(__name__)
+
+DHIP_HEADER_SIZE = 32
+DHIP_MAGIC = struct.pack(">L", 0x20000000) + b"DHIP"
+# Clients that don't keep alive for this long are disconnected
+KEEP_ALIVE_SLACK_SECONDS = 10
+
+
+def encode_message(message: dict, session_id: int = 0, request_id: int = 0) -> bytes:
+    """ Returns the DHIP packet of a message, like a VTO sends it """
+    payload = (json.dumps(message) + "\n").encode("utf-8")
+    header = DHIP_MAGIC + struct.pack("<LL", session_id or 0, request_id or 0)
+    header += struct.pack("<LLLL", len(payload), 0, len(payload), 0)
+    return header + payload
+
+
+class DhipProtocol(asyncio.Protocol):
+    """
+    DhipProtocol is one DHIP connection. Requests are answered by the RpcHandler, except eventManager.attach after
+    which the events of the hub are sent as client.notifyEventStream messages with the ID of the attach request.
+    Everything is sent through a queue so latency and half open periods delay it in order
+    """
+
+    def __init__(self, rpc: RpcHandler, hub: EventHub, faults: Faults, connections: Set["DhipProtocol"]):
+        self._rpc = rpc
+        self._hub = hub
+        self._faults = faults
+        self._connections = connections
+        self._transport: Optional[asyncio.Transport] = None
+        self._buffer = b""
+        self._session_id = 0
+        self._subscription: Optional[Subscription] = None
+        self._outgoing: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._connections.add(self)
+        self._outgoing = asyncio.Queue()
+        self._tasks.append(asyncio.ensure_future(self._async_write()))
+        self._tasks.append(asyncio.ensure_future(self._async_watch_keep_alive()))
+
+    def connection_lost(self, exc):
+        self._connections.discard(self)
+        if self._subscription is not None:
+            self._hub.unsubscribe(self._subscription)
+        for task in self._tasks:
+            task.cancel()
+        self._rpc.end_session(self._session_id)
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= DHIP_HEADER_SIZE:
+            if not self._buffer.startswith(DHIP_MAGIC):
+                _LOGGER.warning("Closing DHIP connection, bad header: %s", self._buffer[:DHIP_HEADER_SIZE])
+                self.close()
+                return
+            length = struct.unpack("<L", self._buffer[16:20])[0]
+            if len(self._buffer) < DHIP_HEADER_SIZE + length:
+                return
+            payload = self._buffer[DHIP_HEADER_SIZE:DHIP_HEADER_SIZE + length]
+            self._buffer = self._buffer[DHIP_HEADER_SIZE + length:]
+            if self._faults.should_drop():
+                self._transport.abort()
+                return
+            self._handle(json.loads(payload))
+
+    def _handle(self, request: dict):
+        if request.get("method") == ATTACH_METHOD:
+            session = self._rpc.get_session(request.get("session"))
+            if session is None or not session.logged_in:
+                self._send(self._rpc.handle(request))
+                return
+            self._send({"id": request.get("id"), "params": {"SID": EVENT_STREAM_SID}, "result": True,
+                        "session": self._session_id})
+            if self._subscription is None:
+                codes = request.get("params", {}).get("codes") or ["All"]
+                self._subscription = self._hub.subscribe(None if "All" in codes else codes)
+                self._tasks.append(asyncio.ensure_future(self._async_forward_events(request.get("id"))))
+            return
+
+        response = self._rpc.handle(request)
+        if response.get("session"):
+            self._session_id = response["session"]
+        self._send(response)
+
+    def _send(self, message: dict):
+        self._outgoing.put_nowait(encode_message(message, self._session_id, message.get("id") or 0))
+
+    async def _async_write(self):
+        while True:
+            packet = await self._outgoing.get()
+            await self._faults.async_delay()
+            if self._transport.is_closing():
+                return
+            self._transport.write(packet)
+
+    async def _async_forward_events(self, attach_id: int):
+        while True:
+            event = await self._subscription.get()
+            if event is None:
+                self.close()
+                return
+            self._send({"id": attach_id, "method": "client.notifyEventStream",
+                        "params": {"SID": EVENT_STREAM_SID, "eventList": [event.to_vto()]},
+                        "session": self._session_id})
+
+    async def _async_watch_keep_alive(self):
+        """ Disconnects clients that stopped keeping alive, like a VTO does """
+        while True:
+            await asyncio.sleep(KEEP_ALIVE_SLACK_SECONDS)
+            session = self._rpc.get_session(self._session_id)
+            if session is not None and session.logged_in and \
+                    time.monotonic() - session.last_keep_alive > KEEP_ALIVE_INTERVAL + KEEP_ALIVE_SLACK_SECONDS:
+                _LOGGER.info("Closing DHIP connection of session %s, no keep alive", self._session_id)
+                self.close()
+                return
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
@@ -0,0 +1,141 @@
+"""
+Events of a simulated device: published by tests or at scripted rates and sent to every event stream (eventManager.cgi)
+and DHIP connection attached to them
+"""
+import asyncio
+import json
+import random
+from typing import Any, Callable, Iterable, List, Optional, Set
+
+# The heartbeat of the event stream, sent when there were no events for the heartbeat interval
+HEARTBEAT = b"--myboundary\r\nContent-Type: text/plain\r\nContent-Length:9\r\n\r\nHeartbeat\r\n\r\n"
+
+ACTION_PULSE = "Pulse"
+ACTION_START = "Start"
+ACTION_STOP = "Stop"
+
+
+class SimulatedEvent:
+    """ An event as a device sends it, on the event stream as a multipart part and to a VTO client in an eventList """
+    __slots__ = ("code", "action", "index", "data")
+
+    def __init__(self, code: str, action: str = ACTION_PULSE, index: int = 0, data: Any = None):
+        self.code = code
+        self.action = action
+        self.index = index
+        self.data = data
+
+    def to_stream_part(self) -> bytes:
+        body = "Code={0};action={1};index={2}".format(self.code, self.action, self.index)
+        if self.data is not None:
+            body += ";data=" + json.dumps(self.data, indent=3)
+        return "--myboundary\r\nContent-Type: text/plain\r\nContent-Length:{0}\r\n\r\n{1}\r\n\r\n".format(
+            len(body), body).encode("utf-8")
+
+    def to_vto(self) -> dict:
+        return {"Action": self.action, "Code": self.code, "Data": self.data if self.data is not None else {},
+                "Index": self.index}
+
+    def __repr__(self):
+        return "SimulatedEvent({0}, {1}, {2})".format(self.code, self.action, self.index)
+
+
+class Subscription:
+    """ The events for one event stream or DHIP connection, codes None means all codes """
+
+    def __init__(self, codes: Optional[Set[str]]):
+        self.codes = codes
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def wants(self, event: SimulatedEvent) -> bool:
+        return self.codes is None or event.code in self.codes
+
+    async def get(self) -> Optional[SimulatedEvent]:
+        """ Returns the next event, None when the connection should be closed """
+        return await self.queue.get()
+
+
+class EventHub:
+    """
+    EventHub sends published events to the subscriptions that want them. The data of dict events is stamped with the
+    device time (UTC and UTCMS) when published, like IVS events, unless it already has a UTC
+    """
+
+    def __init__(self, device_time: Callable[[], float]):
+        self._device_time = device_time
+        self._subscriptions: List[Subscription] = []
+        self.published = 0
+
+    def subscribe(self, codes: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(set(codes) if codes is not None else None)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, event: SimulatedEvent):
+        if isinstance(event.data, dict) and "UTC" not in event.data:
+            now = self._device_time()
+            event.data = dict(event.data, UTC=int(now), UTCMS=int(now * 1000) % 1000)
+        self.published += 1
+        for subscription in self._subscriptions:
+            if subscription.wants(event):
+                subscription.queue.put_nowait(event)
+
+    def disconnect_all(self):
+        """ Closes every event stream and DHIP connection, like a device that reboots """
+        for subscription in self._subscriptions:
+            subscription.queue.put_nowait(None)
+
+
+class ScriptedEvent:
+    """
+    ScriptedEvent publishes an event at a rate (events per second), at fixed intervals or, with poisson, at random
+    intervals averaging the rate. With the action Start, every event is followed by its Stop after hold seconds. count
+    limits the number of events, None publishes until stopped
+    """
+
+    def __init__(self, code: str, rate: float, action: str = ACTION_PULSE, index: int = 0, data: Any = None,
+                 hold: float = 0.0, poisson: bool = False, count: Optional[int] = None):
+        self.code = code
+        self.rate = rate
+        self.action = action
+        self.index = index
+        self.data = data
+        self.hold = hold
+        self.poisson = poisson
+        self.count = count
+
+    async def async_run(self, hub: EventHub, rng: random.Random):
+        """ Publishes the events until count is reached or the task is cancelled """
+        published = 0
+        stops = set()
+        try:
+            while self.count is None or published < self.count:
+                await asyncio.sleep(rng.expovariate(self.rate) if self.poisson else 1.0 / self.rate)
+                hub.publish(SimulatedEvent(self.code, self.action, self.index, _copy(self.data)))
+                published += 1
+                if self.action == ACTION_START:
+                    stop = asyncio.ensure_future(self._async_stop_later(hub))
+                    stops.add(stop)
+                    stop.add_done_callback(stops.discard)
+            if stops:
+                await asyncio.wait(stops)
+        finally:
+            for stop in stops:
+                stop.cancel()
+
+    async def _async_stop_later(self, hub: EventHub):
+        await asyncio.sleep(self.hold)
+        hub.publish(SimulatedEvent(self.code, ACTION_STOP, self.index, _copy(self.data)))
+
+
+def _copy(data: Any) -> Any:
+    # Publishing stamps the time in the data, every event gets its own
+    return dict(data) if isinstance(data, dict) else data
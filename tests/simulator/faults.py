@@ -0,0 +1,61 @@
+"""
+Latency and faults injected by the simulator: slow responses, dropped connections, half open sockets and 401 storms
+"""
+import asyncio
+import random
+from typing import Optional
+
+# How often what's held back by a half open period checks if it ended
+HALF_OPEN_POLL_SECONDS = 0.05
+
+
+class Faults:
+    """
+    Faults are the network and device conditions of a simulator, changed at any time while it runs:
+
+    latency, jitter: every response (and every event) is delayed by latency seconds plus or minus up to jitter seconds
+    drop_rate: the fraction of requests whose connection is closed without a response
+    half_open: when True, connections stay open but nothing is sent anymore, not even heartbeats or keep alives, like
+        a device that lost power behind a NAT. What was held back is sent when it's set back to False
+    unauthorized: the number of upcoming requests answered with 401 no matter their authorization (a 401 storm)
+    seed: the seed of the random numbers, for repeatable runs
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, drop_rate: float = 0.0, half_open: bool = False,
+                 unauthorized: int = 0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.half_open = half_open
+        self.unauthorized = unauthorized
+        self._random = random.Random(seed)
+
+    def start_401_storm(self, requests: int):
+        """ Answers the next number of requests with 401 """
+        self.unauthorized = requests
+
+    def delay(self) -> float:
+        if self.jitter:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        return self.latency
+
+    async def async_delay(self):
+        """ Waits for the latency, and for the end of a half open period """
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while self.half_open:
+            await asyncio.sleep(HALF_OPEN_POLL_SECONDS)
+
+    def should_drop(self) -> bool:
+        return self.drop_rate > 0 and self._random.random() < self.drop_rate
+
+    def take_unauthorized(self) -> bool:
+        """ True if this request is part of a 401 storm """
+        if self.unauthorized <= 0:
+            return False
+        self.unauthorized -= 1
+        return True
+
+    def random(self) -> random.Random:
+        return self._random
@@ -0,0 +1,200 @@
+"""
+The HTTP API of a simulated device: the CGI endpoints DahuaClient uses, behind digest authentication, and RPC2
+"""
+import asyncio
+import json
+import time
+from typing import Optional
+
+from aiohttp import web
+
+from .auth import DigestAuthenticator
+from .events import HEARTBEAT, EventHub
+from .faults import Faults
+from .rpc import RpcHandler
+from .state import DEVICE_CAMERA, SNAPSHOT_JPEG, DeviceState
+
+# Like devices answer requests they don't understand
+BAD_REQUEST = "Error\r\nBad Request!\r\n"
+# Paths that use the RPC2 login instead of digest authentication
+RPC2_PATHS = ("/RPC2_Login", "/RPC2")
+
+
+def _text(values: dict) -> web.Response:
+    """ A key=value response """
+    return web.Response(text="".join("{0}={1}\r\n".format(key, value) for key, value in values.items()))
+
+
+def _ok() -> web.Response:
+    return web.Response(text="OK\r\n")
+
+
+def _bad_request() -> web.Response:
+    return web.Response(status=400, text=BAD_REQUEST)
+
+
+class HttpDevice:
+    """
+    HttpDevice serves the CGI API and RPC2 of a DeviceState. Every request goes through the faults first (dropped,
+    delayed or held by a half open period), then digest authentication (or a 401 storm). The number of requests per
+    endpoint is counted in requests, for example requests["configManager.getConfig"]. heartbeat_seconds, when set,
+    replaces the heartbeat interval event streams ask for so tests don't wait for it
+    """
+
+    def __init__(self, state: DeviceState, hub: EventHub, faults: Faults, authenticator: DigestAuthenticator,
+                 rpc: RpcHandler):
+        self._state = state
+        self._hub = hub
+        self._faults = faults
+        self._authenticator = authenticator
+        self._rpc = rpc
+        self.requests = {}
+        self.unauthorized = 0
+        self.heartbeat_seconds: Optional[float] = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._faults_middleware, self._auth_middleware])
+        app.router.add_get("/cgi-bin/magicBox.cgi", self._magic_box)
+        app.router.add_get("/cgi-bin/global.cgi", self._global)
+        app.router.add_get("/cgi-bin/configManager.cgi", self._config_manager)
+        app.router.add_get("/cgi-bin/snapshot.cgi", self._snapshot)
+        app.router.add_get("/cgi-bin/coaxialControlIO.cgi", self._coaxial_control_io)
+        app.router.add_get("/cgi-bin/accessControl.cgi", self._access_control)
+        app.router.add_get("/cgi-bin/eventManager.cgi", self._event_manager)
+        app.router.add_post("/RPC2_Login", self._rpc2)
+        app.router.add_post("/RPC2", self._rpc2)
+        return app
+
+    @web.middleware
+    async def _faults_middleware(self, request: web.Request, handler):
+        if self._faults.should_drop():
+            request.transport.close()
+            return web.Response(status=500)
+        await self._faults.async_delay()
+        return await handler(request)
+
+    @web.middleware
+    async def _auth_middleware(self, request: web.Request, handler):
+        endpoint = request.path.rsplit("/", 1)[-1].replace(".cgi", "")
+        action = request.query.get("action")
+        endpoint = "{0}.{1}".format(endpoint, action) if action else endpoint
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+        if request.path in RPC2_PATHS:
+            return await handler(request)
+        authorization = request.headers.get("Authorization")
+        if self._faults.take_unauthorized() or not self._authenticator.is_authorized(request.method, authorization):
+            self.unauthorized += 1
+            return web.Response(status=401, text="Error\r\nInvalid Authority!\r\n",
+                                headers={"WWW-Authenticate": self._authenticator.challenge()})
+        return await handler(request)
+
+    async def _magic_box(self, request: web.Request) -> web.Response:
+        action = request.query.get("action")
+        if action == "getSystemInfo":
+            return _text(self._state.system_info())
+        if action == "getDeviceType":
+            return _text({"type": self._state.model})
+        if action == "getSoftwareVersion":
+            return _text({"version": self._state.software_version})
+        if action == "getMachineName":
+            return _text({"name": self._state.config.get("General.MachineName", "")})
+        if action == "getVendor":
+            return _text({"vendor": self._state.vendor})
+        if action == "getProductDefinition" and request.query.get("name") == "MaxExtraStream":
+            return _text({"table.MaxExtraStreams": "2"})
+        if action == "reboot":
+            self._state.reboots += 1
+            self._authenticator.expire_nonces()
+            self._hub.disconnect_all()
+            return _ok()
+        return _bad_request()
+
+    async def _global(self, request: web.Request) -> web.Response:
+        if request.query.get("action") == "getCurrentTime":
+            now = time.localtime(self._state.device_time())
+            return _text({"result": time.strftime("%Y-%m-%d %H:%M:%S", now)})
+        return _bad_request()
+
+    async def _config_manager(self, request: web.Request) -> web.Response:
+        action = request.query.get("action")
+        if action == "getConfig":
+            config = self._state.get_config(request.query.get("name", ""))
+            if not config:
+                return _bad_request()
+            return _text({"table." + key: value for key, value in config.items()})
+        if action == "setConfig":
+            values = {key: value for key, value in request.query.items() if key != "action"}
+            if not values or not self._state.set_config(values):
+                return _bad_request()
+            return _ok()
+        return _bad_request()
+
+    async def _snapshot(self, request: web.Request) -> web.Response:
+        # Channel numbers start at 1, the channel index + 1
+        channel = request.query.get("channel", "1")
+        if not channel.isdigit() or not 1 <= int(channel) <= self._state.channels:
+            return _bad_request()
+        return web.Response(body=SNAPSHOT_JPEG, content_type="image/jpeg")
+
+    async def _coaxial_control_io(self, request: web.Request) -> web.Response:
+        if self._state.device != DEVICE_CAMERA:
+            return _bad_request()
+        action = request.query.get("action")
+        if action == "getStatus":
+            return _text({"status.status." + key: value for key, value in self._state.coaxial_status.items()})
+        if action == "control":
+            # Type 1 is the white light, 2 the speaker (siren). IO 1 is on, 2 is off
+            name = {"1": "WhiteLight", "2": "Speaker"}.get(request.query.get("info[0].Type"))
+            io = request.query.get("info[0].IO")
+            if name is None or io not in ("1", "2"):
+                return _bad_request()
+            self._state.coaxial_status[name] = "On" if io == "1" else "Off"
+            return _ok()
+        return _bad_request()
+
+    async def _access_control(self, request: web.Request) -> web.Response:
+        if request.query.get("action") == "openDoor" and request.query.get("channel", "").isdigit():
+            self._state.opened_doors.append(int(request.query["channel"]))
+            return _ok()
+        return _bad_request()
+
+    async def _event_manager(self, request: web.Request) -> web.StreamResponse:
+        """ eventManager.cgi?action=attach&codes=[VideoMotion,CrossLineDetection]&heartbeat=5, codes=[All] for all """
+        if request.query.get("action") != "attach":
+            return _bad_request()
+        codes = [code for code in request.query.get("codes", "[All]").strip("[]").split(",") if code]
+        heartbeat = request.query.get("heartbeat", "")
+        heartbeat = int(heartbeat) if heartbeat.isdigit() else None
+        if heartbeat is not None and self.heartbeat_seconds is not None:
+            heartbeat = self.heartbeat_seconds
+
+        response = web.StreamResponse(headers={"Content-Type": "multipart/x-mixed-replace; boundary=myboundary"})
+        await response.prepare(request)
+        subscription = self._hub.subscribe(None if not codes or "All" in codes else codes)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    chunk = HEARTBEAT
+                else:
+                    if event is None:
+                        # Disconnected, like a device that reboots
+                        if request.transport is not None:
+                            request.transport.close()
+                        return response
+                    chunk = event.to_stream_part()
+                await self._faults.async_delay()
+                await response.write(chunk)
+        except ConnectionResetError:
+            return response
+        finally:
+            self._hub.unsubscribe(subscription)
+
+    async def _rpc2(self, request: web.Request) -> web.Response:
+        try:
+            message = json.loads(await request.text())
+        except ValueError:
+            return _bad_request()
+        return web.json_response(self._rpc.handle(message))
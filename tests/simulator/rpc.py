@@ -0,0 +1,139 @@
+"""
+The JSON RPC of a simulated device, shared by RPC2 over HTTP (/RPC2_Login and /RPC2) and DHIP on the VTO port
+"""
+import os
+import time
+from typing import Dict, Optional
+
+from .auth import login_hash
+from .faults import Faults
+from .state import DeviceState
+
+# Error codes and messages as sent by devices
+ERROR_LOGIN_CHALLENGE = (268632079, "Component error: login challenge!")
+ERROR_INVALID_PASSWORD = (268632085, "Component error: User or password not valid!")
+ERROR_INVALID_SESSION = (287637505, "Invalid session in request data!")
+ERROR_UNKNOWN_METHOD = (268894210, "Method not found!")
+ERROR_NO_CONFIG = (268959743, "Unknown error! error code was not set in service!")
+
+# The keep alive interval the device asks for at login
+KEEP_ALIVE_INTERVAL = 60
+# The ID of the event stream of eventManager.attach
+EVENT_STREAM_SID = 513
+
+LOGIN_METHOD = "global.login"
+ATTACH_METHOD = "eventManager.attach"
+MULTICALL_METHOD = "system.multicall"
+
+
+class RpcSession:
+    __slots__ = ("id", "random", "logged_in", "last_keep_alive")
+
+    def __init__(self, session_id: int):
+        self.id = session_id
+        self.random = os.urandom(4).hex()
+        self.logged_in = False
+        self.last_keep_alive = time.monotonic()
+
+
+class RpcHandler:
+    """
+    RpcHandler answers RPC requests. global.login works in two steps: the first call gets the realm and random of a new
+    session, the second logs the session in with the password hashed with them. Every other method needs a logged in
+    session
+    """
+
+    def __init__(self, state: DeviceState, username: str, password: str, realm: str, faults: Faults):
+        self._state = state
+        self._username = username
+        self._password = password
+        self._realm = realm
+        self._faults = faults
+        self._sessions: Dict[int, RpcSession] = {}
+        self._next_session = int.from_bytes(os.urandom(3), "big") | 0x1000000
+        self.calls: Dict[str, int] = {}
+
+    def get_session(self, session_id) -> Optional[RpcSession]:
+        return self._sessions.get(session_id)
+
+    def end_session(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    def handle(self, request: dict) -> dict:
+        """ Returns the response to the request """
+        method = request.get("method", "")
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == LOGIN_METHOD:
+            return self._login(request)
+
+        session = self._sessions.get(request.get("session"))
+        if session is None or not session.logged_in:
+            return _error(request, ERROR_INVALID_SESSION)
+        if method == MULTICALL_METHOD:
+            responses = [self.handle(dict(call, session=session.id)) for call in request.get("params") or []]
+            return _result(request, True, responses)
+
+        params = request.get("params") or {}
+        if method == "global.keepAlive":
+            session.last_keep_alive = time.monotonic()
+            return _result(request, True, {"timeout": KEEP_ALIVE_INTERVAL})
+        if method == "global.logout":
+            self.end_session(session.id)
+            return _result(request, True)
+        if method == "global.getCurrentTime":
+            return _result(request, True, {"time": time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                 time.localtime(self._state.device_time()))})
+        if method == "magicBox.getSerialNo":
+            return _result(request, True, {"sn": self._state.serial_number})
+        if method == "magicBox.getDeviceType":
+            return _result(request, True, {"type": self._state.model})
+        if method == "magicBox.getSoftwareVersion":
+            version, _, build_date = self._state.software_version.partition(",build:")
+            return _result(request, True, {"version": {"BuildDate": build_date, "Version": version}})
+        if method == "configManager.getConfig":
+            table = self._state.get_config_table(params.get("name", ""))
+            if table is None:
+                return _error(request, ERROR_NO_CONFIG)
+            return _result(request, True, {"table": table})
+        if method == "CoaxialControlIO.getStatus":
+            return _result(request, True, {"status": dict(self._state.coaxial_status)})
+        if method == "console.runCmd":
+            return _result(request, True)
+        return _error(request, ERROR_UNKNOWN_METHOD)
+
+    def _login(self, request: dict) -> dict:
+        params = request.get("params") or {}
+        session = self._sessions.get(request.get("session"))
+        if session is None or not params.get("password"):
+            # The first step, the client gets the realm and random to hash the password with
+            session = RpcSession(self._next_session)
+            self._next_session += 1
+            self._sessions[session.id] = session
+            response = _error(request, ERROR_LOGIN_CHALLENGE, {"encryption": "Default", "random": session.random,
+                                                               "realm": self._realm})
+            response["session"] = session.id
+            return response
+
+        expected = login_hash(self._username, self._password, self._realm, session.random)
+        if params.get("userName") != self._username or params.get("password") != expected \
+                or self._faults.take_unauthorized():
+            self.end_session(session.id)
+            return _error(request, ERROR_INVALID_PASSWORD, {"remainLockSecond": 0, "remainLoginTimes": 4})
+        session.logged_in = True
+        session.last_keep_alive = time.monotonic()
+        response = _result(request, True, {"keepAliveInterval": KEEP_ALIVE_INTERVAL})
+        response["session"] = session.id
+        return response
+
+
+def _result(request: dict, result, params=None) -> dict:
+    response = {"id": request.get("id"), "result": result, "session": request.get("session")}
+    if params is not None:
+        response["params"] = params
+    return response
+
+
+def _error(request: dict, error: tuple, params=None) -> dict:
+    response = _result(request, False, params)
+    response["error"] = {"code": error[0], "message": error[1]}
+    return response
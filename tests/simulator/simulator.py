@@ -0,0 +1,107 @@
+"""
+DahuaSimulator runs a simulated Dahua camera or doorbell on local ports: the HTTP API and, for doorbells, DHIP
+"""
+import asyncio
+import socket
+from typing import Any, List, Optional
+
+from aiohttp import web
+
+from .auth import DigestAuthenticator
+from .dhip_server import DhipProtocol
+from .events import ACTION_PULSE, EventHub, ScriptedEvent, SimulatedEvent
+from .faults import Faults
+from .http_server import HttpDevice
+from .rpc import RpcHandler
+from .state import DEVICE_CAMERA, DEVICE_DOORBELL, DeviceState
+
+
+class DahuaSimulator:
+    """
+    DahuaSimulator is a Dahua device for tests, all in memory on the event loop it's started on. Ports of 0 are picked
+    by the OS, read them from http_port and vto_port once started. The DHIP (VTO) server only runs for doorbells. Use it
+    as an async context manager:
+
+        async with DahuaSimulator(faults=Faults(latency=0.05, jitter=0.02)) as simulator:
+            simulator.publish("VideoMotion", "Start")
+            simulator.start_script(ScriptedEvent("CrossLineDetection", rate=5, data={...}))
+            client = DahuaClient("admin", "password", "127.0.0.1", simulator.http_port, 554, session)
+    """
+
+    def __init__(self, device: str = DEVICE_CAMERA, username: str = "admin", password: str = "password",
+                 host: str = "127.0.0.1", http_port: int = 0, vto_port: int = 0, faults: Optional[Faults] = None,
+                 state: Optional[DeviceState] = None):
+        self.host = host
+        self.state = state if state is not None else DeviceState(device)
+        self.faults = faults if faults is not None else Faults()
+        realm = "Login to " + self.state.serial_number
+        self.authenticator = DigestAuthenticator(username, password, realm)
+        self.hub = EventHub(self.state.device_time)
+        self.rpc = RpcHandler(self.state, username, password, realm, self.faults)
+        self.http = HttpDevice(self.state, self.hub, self.faults, self.authenticator, self.rpc)
+        self.http_port = http_port
+        self.vto_port = vto_port
+        self._runner: Optional[web.AppRunner] = None
+        self._vto_server: Optional[asyncio.AbstractServer] = None
+        self._vto_connections = set()
+        self._scripts: List[asyncio.Task] = []
+
+    async def async_start(self):
+        self._runner = web.AppRunner(self.http.create_app())
+        await self._runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.http_port))
+        self.http_port = sock.getsockname()[1]
+        await web.SockSite(self._runner, sock).start()
+
+        if self.state.device == DEVICE_DOORBELL:
+            loop = asyncio.get_event_loop()
+            self._vto_server = await loop.create_server(
+                lambda: DhipProtocol(self.rpc, self.hub, self.faults, self._vto_connections), self.host, self.vto_port)
+            self.vto_port = self._vto_server.sockets[0].getsockname()[1]
+
+    async def async_stop(self):
+        for script in self._scripts:
+            script.cancel()
+        self._scripts.clear()
+        self.hub.disconnect_all()
+        if self._vto_server is not None:
+            self._vto_server.close()
+            for connection in list(self._vto_connections):
+                connection.close()
+            await self._vto_server.wait_closed()
+            self._vto_server = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "DahuaSimulator":
+        await self.async_start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.async_stop()
+
+    def publish(self, code: str, action: str = ACTION_PULSE, index: int = 0, data: Any = None):
+        """ Sends an event to every attached event stream and VTO client """
+        self.hub.publish(SimulatedEvent(code, action, index, data))
+
+    def start_script(self, scripted: ScriptedEvent) -> asyncio.Task:
+        """ Publishes events at the rate of the script until it's done, cancelled or the simulator stops """
+        task = asyncio.ensure_future(scripted.async_run(self.hub, self.faults.random()))
+        self._scripts.append(task)
+        task.add_done_callback(self._scripts.remove)
+        return task
+
+    def disconnect(self):
+        """ Drops every event stream and DHIP connection, clients have to reconnect and log in again """
+        self.hub.disconnect_all()
+        for connection in list(self._vto_connections):
+            connection.close()
+
+    def reboot(self):
+        """ Like a device that reboots: connections are dropped and the nonces of digest authentication expire """
+        self.state.reboots += 1
+        self.authenticator.expire_nonces()
+        self.disconnect()
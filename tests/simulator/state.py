@@ -0,0 +1,189 @@
+"""
+The state of a simulated device: what it says it is and its configuration tables, changed by setConfig like on a real
+device so a value that was set is read back by the next getConfig
+"""
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+DEVICE_CAMERA = "camera"
+DEVICE_DOORBELL = "doorbell"
+
+# Returned by snapshot.cgi, the start and end of image markers of a JPEG around a JFIF header. The integration passes
+# snapshots on without decoding them
+SNAPSHOT_JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00" + b"\x00" * 1024 + b"\xff\xd9"
+
+_CAMERA_CONFIG = {
+    "ChannelTitle[0].Name": "Simulated Camera",
+    "DisableLinkage.Enable": "false",
+    "General.MachineName": "SimulatedCamera",
+    "MotionDetect[0].DetectVersion": "V3.0",
+    "MotionDetect[0].Enable": "true",
+    "RecordMode[0].Mode": "0",
+    "SmartMotionDetect[0].Enable": "true",
+    "SmartMotionDetect[0].ObjectTypes.Human": "true",
+    "SmartMotionDetect[0].ObjectTypes.Vehicle": "false",
+    "SmartMotionDetect[0].Sensitivity": "Middle",
+    "VideoAnalyseRule[0][0].Enable": "true",
+    "VideoAnalyseRule[0][0].Name": "Rule1",
+    "VideoAnalyseRule[0][0].Type": "CrossLineDetection",
+    "VideoAnalyseRule[0][1].Enable": "false",
+    "VideoAnalyseRule[0][1].Name": "Rule2",
+    "VideoAnalyseRule[0][1].Type": "CrossRegionDetection",
+    "VideoInDayNight[0][0].Mode": "Color",
+    "VideoInMode[0].Config[0]": "2",
+    "VideoInMode[0].Mode": "0",
+    "VideoInMode[0].TimeSection[0][0]": "0 00:00:00-24:00:00",
+    "VideoInOptions[0].NightOptions.SwitchMode": "0",
+    "VideoWidget[0].ChannelTitle.EncodeBlend": "true",
+    "VideoWidget[0].CustomTitle[1].EncodeBlend": "false",
+    "VideoWidget[0].CustomTitle[1].Text": "",
+    "VideoWidget[0].TimeTitle.EncodeBlend": "true",
+    "VideoWidget[0].UserDefinedTitle[1].EncodeBlend": "false",
+    "VideoWidget[0].UserDefinedTitle[1].Text": "",
+}
+
+# The infrared light, per profile mode (0=day, 1=night, 2=scene)
+for _profile_mode in range(3):
+    _CAMERA_CONFIG.update({
+        "Lighting[0][{0}].Correction".format(_profile_mode): "50",
+        "Lighting[0][{0}].MiddleLight[0].Angle".format(_profile_mode): "50",
+        "Lighting[0][{0}].MiddleLight[0].Light".format(_profile_mode): "50",
+        "Lighting[0][{0}].Mode".format(_profile_mode): "Auto",
+        "Lighting[0][{0}].Sensitive".format(_profile_mode): "3",
+    })
+
+# The white light of cameras like the IPC-HDW3849HP-AS-PV
+_LIGHTING_V2_CONFIG = {}
+for _profile_mode in range(3):
+    _LIGHTING_V2_CONFIG.update({
+        "Lighting_V2[0][{0}][0].LightType".format(_profile_mode): "WhiteLight",
+        "Lighting_V2[0][{0}][0].MiddleLight[0].Light".format(_profile_mode): "100",
+        "Lighting_V2[0][{0}][0].Mode".format(_profile_mode): "Off",
+        "Lighting_V2[0][{0}][0].PercentOfMaxBrightness".format(_profile_mode): "100",
+        "Lighting_V2[0][{0}][1].LightType".format(_profile_mode): "SecurityLight",
+        "Lighting_V2[0][{0}][1].Mode".format(_profile_mode): "Off",
+        "Lighting_V2[0][{0}][1].State".format(_profile_mode): "Off",
+    })
+
+_DOORBELL_CONFIG = {
+    "AccessControl[0].AccessProtocol": "Local",
+    "AccessControl[0].UnlockReloadInterval": "10",
+    "General.MachineName": "SimulatedDoorbell",
+    "LightGlobal[0].Enable": "true",
+    "T2UServer.UUID": "SIMVTO0000000001",
+}
+
+# The parts of a configuration key, a field name or an index, for example General.MachineName or [0]
+_KEY_PART_PATTERN = re.compile(r"\.?(\w+)|\[(\d+)\]")
+
+# name[0] in a setConfig is name on devices with a single table, for example DisableLinkage[0].Enable
+_FIRST_INDEX_PATTERN = re.compile(r"^(\w+)\[0\]\.")
+
+
+class DeviceState:
+    """
+    DeviceState is what a simulated device knows: its system info, the configuration tables (by key without the
+    "table." prefix, for example MotionDetect[0].Enable), the coaxial control IO status and the doors opened
+    """
+
+    def __init__(self, device: str = DEVICE_CAMERA, model: Optional[str] = None, serial_number: str = "SIM0000000001",
+                 channels: int = 1, time_offset: float = 0.0):
+        self.device = device
+        if model is None:
+            model = "VTO2202F-P" if device == DEVICE_DOORBELL else "IPC-HDW3849HP-AS-PV"
+        self.model = model
+        self.serial_number = serial_number
+        self.software_version = "2.800.0000016.0.R,build:2020-06-05"
+        self.vendor = "Dahua"
+        self.channels = channels
+        # Seconds the device clock is ahead of ours, for the event latency clock offset
+        self.time_offset = time_offset
+        self.config: Dict[str, str] = {}
+        if device == DEVICE_DOORBELL:
+            self.config.update(_DOORBELL_CONFIG)
+        else:
+            self.config.update(_CAMERA_CONFIG)
+            if "-AS-PV" in model:
+                self.config.update(_LIGHTING_V2_CONFIG)
+        self.coaxial_status = {"Speaker": "Off", "WhiteLight": "Off"}
+        self.opened_doors: List[int] = []
+        self.reboots = 0
+
+    def system_info(self) -> Dict[str, str]:
+        return {
+            "appAutoStart": "true",
+            "deviceType": self.model,
+            "hardwareVersion": "1.00",
+            "processor": "S3LM",
+            "serialNumber": self.serial_number,
+            "updateSerial": self.model,
+        }
+
+    def device_time(self) -> float:
+        return time.time() + self.time_offset
+
+    def get_config(self, name: str) -> Dict[str, str]:
+        """ Returns the keys of the table (or the key) with the given name, empty if there's no such table """
+        if name in self.config:
+            return {name: self.config[name]}
+        return {key: value for key, value in self.config.items()
+                if key.startswith(name) and key[len(name)] in ".["}
+
+    def get_config_table(self, name: str) -> Any:
+        """
+        Returns the table with the given name as an RPC2 configManager.getConfig returns it, nested dicts and lists, for
+        example {"MachineName": "Cam4"} for General. None if there's no such table
+        """
+        table = None
+        for key, value in self.get_config(name).items():
+            parts = [int(index) if index else field for field, index in _KEY_PART_PATTERN.findall(key[len(name):])]
+            table = _insert(table, parts, _to_json_value(value))
+        return table
+
+    def set_config(self, values: Dict[str, str]) -> bool:
+        """ Sets the values, all or none. Returns False if a value is for a table the device doesn't have """
+        resolved = {}
+        for key, value in values.items():
+            key = self._resolve_key(key)
+            if key is None:
+                return False
+            resolved[key] = value
+        self.config.update(resolved)
+        return True
+
+    def _resolve_key(self, key: str) -> Optional[str]:
+        if key in self.config:
+            return key
+        single = _FIRST_INDEX_PATTERN.sub(r"\1.", key)
+        if single != key and single in self.config:
+            return single
+        # New keys are fine as long as the table exists, like new fields of a rule
+        table = re.split(r"[.\[]", key, 1)[0]
+        if any(existing.startswith(table) and existing[len(table)] in ".[" for existing in self.config):
+            return key
+        return None
+
+
+def _insert(node: Any, parts: list, value: Any) -> Any:
+    """ Inserts the value at the path of parts into the nested dicts (for fields) and lists (for indexes) """
+    if not parts:
+        return value
+    part, rest = parts[0], parts[1:]
+    if isinstance(part, int):
+        node = node if isinstance(node, list) else []
+        node.extend([None] * (part + 1 - len(node)))
+        node[part] = _insert(node[part], rest, value)
+    else:
+        node = node if isinstance(node, dict) else {}
+        node[part] = _insert(node.get(part), rest, value)
+    return node
+
+
+def _to_json_value(value: str) -> Any:
+    """ Config values are text in the CGI API but typed in RPC2 """
+    if value in ("true", "false"):
+        return value == "true"
+    if value.lstrip("-").isdigit():
+        return int(value)
+    return value
@@ -0,0 +1,50 @@
+"""Tests for the options flow."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.dahua.config_flow import DahuaOptionsFlowHandler
+from custom_components.dahua.const import (
+    CONF_JOURNAL,
+    CONF_PAYLOAD_FIELDS,
+    CONF_PUBLISH_POLICIES,
+    CONF_RULES,
+    CONF_USERNAME,
+)
+
+OPTIONS = {CONF_PUBLISH_POLICIES: "VideoMotionInfo=sample:1", CONF_RULES: "", CONF_JOURNAL: False}
+
+
+@pytest.fixture
+def flow():
+    return DahuaOptionsFlowHandler(SimpleNamespace(options=dict(OPTIONS), data={CONF_USERNAME: "admin"}))
+
+
+def _defaults(result) -> dict:
+    return {str(key): key.default() for key in result["data_schema"].schema if callable(key.default)}
+
+
+@pytest.mark.parametrize("field, value", [
+    (CONF_PUBLISH_POLICIES, "VideoMotionInfo=often"),
+    (CONF_PAYLOAD_FIELDS, "CrossLineDetection=Object..Type"),
+])
+def test_invalid_options_are_not_stored(flow, field, value):
+    user_input = {CONF_PUBLISH_POLICIES: "*=batch", CONF_JOURNAL: True, field: value}
+    result = asyncio.run(flow.async_step_user(user_input))
+
+    assert result["type"] == "form"
+    assert list(result["errors"]) == [field]
+    assert flow.options == OPTIONS
+    # The form shows what was entered so it can be corrected
+    defaults = _defaults(result)
+    assert defaults[field] == value
+    assert defaults[CONF_JOURNAL] is True
+
+
+def test_valid_options_are_stored(flow):
+    result = asyncio.run(flow.async_step_user({CONF_PUBLISH_POLICIES: "*=batch", CONF_JOURNAL: True}))
+
+    assert result["type"] == "create_entry"
+    assert result["data"] == {CONF_PUBLISH_POLICIES: "*=batch", CONF_RULES: "", CONF_JOURNAL: True}
+    assert flow.options == result["data"]
@@ -0,0 +1,107 @@
+"""Tests for the event deduplicator."""
+import pytest
+
+from custom_components.dahua import dedup
+from custom_components.dahua.dedup import EventDeduplicator, event_dedup_key
+from custom_components.dahua.models import DahuaEvent
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(dedup, "time", clock)
+    return clock
+
+
+def _event(seq, code="CrossLineDetection", action="Start", channel=0):
+    return DahuaEvent(code, channel, action, data={"EventSeq": seq, "GroupID": seq, "UTC": 1620000000, "UTCMS": 180})
+
+
+@pytest.mark.parametrize("data, identified", [
+    ({"EventSeq": 1}, True),
+    ({"UTCMS": 180}, True),
+    ({"UTC": 1620000000}, False),
+    ({}, False),
+    (None, False),
+])
+def test_event_dedup_key(data, identified):
+    key = event_dedup_key("nvr", DahuaEvent("VideoMotion", 0, "Start", data=data))
+    assert (key is not None) == identified
+
+
+def test_key_ignores_the_channel():
+    assert event_dedup_key("nvr", _event(1, channel=0)) == event_dedup_key("nvr", _event(1, channel=3))
+    assert event_dedup_key("nvr", _event(1)) != event_dedup_key("nvr", _event(1, action="Stop"))
+    assert event_dedup_key("nvr", _event(1)) != event_dedup_key("other", _event(1))
+
+
+def test_duplicates_within_the_window(clock):
+    deduplicator = EventDeduplicator(window=30)
+
+    assert not deduplicator.is_duplicate("nvr", _event(1))
+    clock.now += 10
+    # The same event through the NVR, on another channel
+    assert deduplicator.is_duplicate("nvr", _event(1, channel=2))
+    assert not deduplicator.is_duplicate("nvr", _event(1, action="Stop"))
+    assert not deduplicator.is_duplicate("other", _event(1))
+    # Events that can't be identified are never duplicates
+    assert not deduplicator.is_duplicate("nvr", DahuaEvent("VideoMotion", 0, "Start"))
+    assert not deduplicator.is_duplicate("nvr", DahuaEvent("VideoMotion", 0, "Start"))
+    assert deduplicator.as_dict() == {"entries": 3, "checked": 4, "suppressed": 1}
+
+
+def test_window_expiry(clock):
+    deduplicator = EventDeduplicator(window=30)
+    deduplicator.is_duplicate("nvr", _event(1))
+    clock.now += 20
+    deduplicator.is_duplicate("nvr", _event(2))
+
+    clock.now += 10
+    assert deduplicator.is_duplicate("nvr", _event(1))
+    clock.now += 0.1
+    # Event 1 is forgotten once its window is over, event 2 isn't
+    assert not deduplicator.is_duplicate("nvr", _event(1))
+    assert deduplicator.is_duplicate("nvr", _event(2))
+    assert deduplicator.as_dict()["entries"] == 2
+
+
+def test_duplicate_does_not_extend_the_window(clock):
+    """ The window starts when the event is first seen, copies arriving later don't keep it alive """
+    deduplicator = EventDeduplicator(window=30)
+    deduplicator.is_duplicate("nvr", _event(1))
+    for _ in range(3):
+        clock.now += 10
+        assert deduplicator.is_duplicate("nvr", _event(1))
+
+    clock.now += 1
+    assert not deduplicator.is_duplicate("nvr", _event(1))
+    # Seen again after it expired, the window starts over
+    clock.now += 29
+    assert deduplicator.is_duplicate("nvr", _event(1))
+    clock.now += 1.1
+    assert not deduplicator.is_duplicate("nvr", _event(1))
+
+
+def test_oldest_entries_are_evicted_at_capacity(clock):
+    deduplicator = EventDeduplicator(window=30, maxsize=3)
+    for seq in range(4):
+        clock.now += 1
+        deduplicator.is_duplicate("nvr", _event(seq))
+
+    assert deduplicator.as_dict()["entries"] == 3
+    # Event 0 was evicted
+    assert deduplicator.is_duplicate("nvr", _event(1))
+    assert not deduplicator.is_duplicate("nvr", _event(0))
+    # Which evicted event 1, the oldest. Seeing its duplicate last didn't make it younger
+    assert deduplicator.is_duplicate("nvr", _event(2))
+    assert deduplicator.is_duplicate("nvr", _event(3))
+    assert deduplicator.is_duplicate("nvr", _event(0))
+    assert not deduplicator.is_duplicate("nvr", _event(1))
@@ -0,0 +1,170 @@
+"""Tests for the event queue."""
+import asyncio
+from types import SimpleNamespace
+
+from custom_components.dahua.event_queue import DahuaEventQueue
+
+INFO = ["VideoMotionInfo"]
+MOTION = ["VideoMotion"]
+
+
+class _Handler:
+    """ Records the args of the items dispatched, optionally failing on some """
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self._fail_on = fail_on
+
+    def __call__(self, *args):
+        self.calls.append(args)
+        if args == self._fail_on:
+            raise ValueError("Failed")
+
+
+def _queue(maxsize: int = 4, loop=None) -> DahuaEventQueue:
+    return DahuaEventQueue(SimpleNamespace(loop=loop), "test", maxsize)
+
+
+def _drain(queue: DahuaEventQueue):
+    """ Runs the dispatcher until the queue is empty """
+
+    async def dispatch():
+        queue._hass.loop = asyncio.get_running_loop()
+        queue.start()
+        while queue.depth():
+            await asyncio.sleep(0)
+        queue.stop()
+
+    asyncio.run(dispatch())
+
+
+def test_informational_events_are_coalesced_in_place():
+    queue = _queue()
+    handler = _Handler()
+    queue.put_nowait(handler, ("info", 1), INFO, 0)
+    queue.put_nowait(handler, ("info", 2), INFO, 1)
+    queue.put_nowait(handler, ("info", 3), INFO, 0)
+    queue.put_nowait(handler, ("info", 4), INFO, 0)
+
+    # The latest state of channel 0 takes the place of the first one, other channels aren't touched
+    assert queue.depth() == 2
+    _drain(queue)
+    assert handler.calls == [("info", 4), ("info", 2)]
+    assert queue.coalesced == {"VideoMotionInfo": 2}
+    assert queue.processed == 2
+
+
+def test_coalescing_is_by_handler_codes_and_channel():
+    queue = _queue(maxsize=8)
+    first, second = _Handler(), _Handler()
+    queue.put_nowait(first, ("info", 1), INFO, 0)
+    queue.put_nowait(second, ("info", 2), INFO, 0)
+    queue.put_nowait(first, ("frame", 3), ["IntelliFrame"], 0)
+    queue.put_nowait(first, ("both", 4), ["VideoMotionInfo", "IntelliFrame"], 0)
+    queue.put_nowait(first, ("info", 5), INFO, 0)
+
+    assert queue.depth() == 4
+    _drain(queue)
+    assert first.calls == [("info", 5), ("frame", 3), ("both", 4)]
+    assert second.calls == [("info", 2)]
+
+
+def test_alarms_are_dispatched_first_and_never_coalesced():
+    queue = _queue(maxsize=8)
+    handler = _Handler()
+    queue.put_nowait(handler, ("info", 1), INFO, 0)
+    for action in ("Start", "Stop", "Start", "Stop"):
+        queue.put_nowait(handler, (action,), MOTION, 0)
+    # A chunk with an alarm and an informational event is an alarm
+    queue.put_nowait(handler, ("mixed",), ["VideoMotion", "VideoMotionInfo"], 0)
+
+    _drain(queue)
+    assert handler.calls == [("Start",), ("Stop",), ("Start",), ("Stop",), ("mixed",), ("info", 1)]
+    assert queue.coalesced == {}
+
+
+def test_full_queue_drops_new_informational_events():
+    queue = _queue(maxsize=2)
+    handler = _Handler()
+    queue.put_nowait(handler, ("info", 0), INFO, 0)
+    queue.put_nowait(handler, ("info", 1), INFO, 1)
+
+    assert queue.put_nowait(handler, ("info", 2), INFO, 2)
+    assert queue.dropped == {"VideoMotionInfo": 1}
+    # Replacing a queued one needs no room
+    assert queue.put_nowait(handler, ("info", 3), INFO, 1)
+    assert queue.depth() == 2
+
+    _drain(queue)
+    assert handler.calls == [("info", 0), ("info", 3)]
+
+
+def test_full_queue_evicts_the_oldest_informational_event_for_an_alarm():
+    queue = _queue(maxsize=3)
+    handler = _Handler()
+    queue.put_nowait(handler, ("info", 0), INFO, 0)
+    queue.put_nowait(handler, ("frame", 1), ["IntelliFrame"], 1)
+    queue.put_nowait(handler, ("Start",), MOTION, 0)
+
+    assert queue.put_nowait(handler, ("Stop",), MOTION, 0)
+    assert queue.depth() == 3
+    assert queue.dropped == {"VideoMotionInfo": 1}
+    # The evicted event isn't coalesced with anymore, a new one is queued as a new item
+    queue.put_nowait(handler, ("info", 2), INFO, 0)
+    assert queue.dropped == {"VideoMotionInfo": 2}
+    assert queue.put_nowait(handler, ("Start",), MOTION, 0)
+    assert queue.dropped == {"VideoMotionInfo": 2, "IntelliFrame": 1}
+
+    _drain(queue)
+    assert handler.calls == [("Start",), ("Stop",), ("Start",)]
+    assert queue.as_dict()["max_depth"] == 3
+
+
+def test_full_queue_of_alarms_makes_the_reader_wait():
+    queue = _queue(maxsize=2)
+    handler = _Handler()
+    queue.put_nowait(handler, ("Start",), MOTION, 0)
+    queue.put_nowait(handler, ("Stop",), MOTION, 0)
+
+    assert not queue.put_nowait(handler, ("Start",), MOTION, 0)
+    assert not queue._not_full.is_set()
+    # Informational events are dropped rather than waiting
+    assert queue.put_nowait(handler, ("info", 0), INFO, 0)
+    assert queue.dropped == {"VideoMotionInfo": 1}
+    # Readers on other threads can't wait, their alarms go over the size
+    assert queue.put_nowait(handler, ("Start",), MOTION, 0, force=True)
+    assert queue.depth() == 3
+
+    _drain(queue)
+    assert handler.calls == [("Start",), ("Stop",), ("Start",)]
+
+
+def test_put_waits_for_the_dispatcher_and_keeps_order():
+    handler = _Handler()
+    actions = ["Start", "Stop"] * 10
+
+    async def produce():
+        queue = _queue(maxsize=2, loop=asyncio.get_running_loop())
+        queue.start()
+        for index, action in enumerate(actions):
+            await queue.put(handler, (action, index), MOTION, 0)
+        while queue.depth():
+            await asyncio.sleep(0)
+        queue.stop()
+        return queue
+
+    queue = asyncio.run(produce())
+    assert handler.calls == [(action, index) for index, action in enumerate(actions)]
+    assert queue.waits > 0
+    assert queue.max_depth == 2
+
+
+def test_failing_handler_does_not_stop_the_dispatcher():
+    queue = _queue()
+    handler = _Handler(fail_on=("Start",))
+    queue.put_nowait(handler, ("Start",), MOTION, 0)
+    queue.put_nowait(handler, ("Stop",), MOTION, 0)
+
+    _drain(queue)
+    assert handler.calls == [("Start",), ("Stop",)]
+    assert queue.processed == 2
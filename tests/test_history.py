@@ -0,0 +1,127 @@
+"""Tests for the event history."""
+import itertools
+
+import pytest
+
+from custom_components.dahua import history
+from custom_components.dahua.history import _TRIM_THRESHOLD, HISTORY_SIZE, EventHistory
+from custom_components.dahua.models import DahuaEvent
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """ Every event is recorded one second after the previous one, starting at 1000 """
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(history.time, "time", lambda: float(next(ticks)))
+
+
+def _event(code, channel=0, action="Start", name=None):
+    event = DahuaEvent(code, channel, action)
+    if name is not None:
+        event.set_event_name(name)
+    return event
+
+
+def _fill(events: EventHistory, count: int):
+    """ Adds count events: VideoMotion on even seqs, CrossRegionDetection dispatched as SmartMotionHuman on odd """
+    for seq in range(count):
+        if seq % 2:
+            events.add(_event("CrossRegionDetection", name="SmartMotionHuman"))
+        else:
+            events.add(_event("VideoMotion"))
+
+
+def test_overflow():
+    events = EventHistory()
+    events.add(_event("AlarmLocal"))
+    _fill(events, HISTORY_SIZE + 99)
+
+    assert len(events) == HISTORY_SIZE
+    # The AlarmLocal and the first 99 events were overwritten, their index went with them
+    assert events.query("AlarmLocal") == []
+    assert ("AlarmLocal", 0) not in events._index
+    assert events.as_dict() == {"size": HISTORY_SIZE, "records": HISTORY_SIZE, "indexes": 3}
+
+    records = events.query()
+    assert [record.seq for record in records] == list(range(HISTORY_SIZE + 99, 99, -1))
+
+
+def test_overflow_trims_indexes():
+    events = EventHistory()
+    _fill(events, HISTORY_SIZE * 3)
+
+    for key in (("VideoMotion", 0), ("CrossRegionDetection", 0), ("SmartMotionHuman", 0)):
+        index = events._index[key]
+        assert len(index) == HISTORY_SIZE // 2
+        # Evicted records are dropped from the start of the lists once enough piled up
+        assert index.start < max(_TRIM_THRESHOLD, len(index.records) // 2 + 1)
+        assert len(index.records) < HISTORY_SIZE
+        assert len(index.times) == len(index.records)
+        assert index.times == sorted(index.times)
+        assert all(record.seq >= HISTORY_SIZE * 2 for record in index.records[index.start:])
+
+
+def test_query_by_code_and_event_name():
+    events = EventHistory()
+    _fill(events, HISTORY_SIZE + 10)
+
+    by_code = events.query("CrossRegionDetection")
+    by_name = events.query("SmartMotionHuman")
+    assert by_code == by_name
+    assert len(by_code) == HISTORY_SIZE // 2
+    assert all(record.code == "CrossRegionDetection" and record.name == "SmartMotionHuman" for record in by_code)
+    assert by_code[0].as_dict() == {"time": by_code[0].time, "code": "CrossRegionDetection", "action": "Start",
+                                    "index": 0, "name": "SmartMotionHuman"}
+    assert [record.code for record in events.query("VideoMotion", 0)] == ["VideoMotion"] * (HISTORY_SIZE // 2)
+
+
+def test_query_all_events_lists_translated_events_once():
+    """ A translated event is in the indexes of its code and name, the merge must return it once """
+    events = EventHistory()
+    _fill(events, HISTORY_SIZE + 10)
+
+    records = events.query(event=None)
+    assert len(records) == HISTORY_SIZE
+    assert len({record.seq for record in records}) == HISTORY_SIZE
+    assert [record.seq for record in records] == sorted((record.seq for record in records), reverse=True)
+    assert events.count() == HISTORY_SIZE
+    assert len(events.query(channel=0, limit=5)) == 5
+
+
+def test_query_channels():
+    events = EventHistory()
+    for channel in (0, 1, 1, 2):
+        events.add(_event("VideoMotion", channel))
+
+    assert [record.channel for record in events.query("VideoMotion")] == [2, 1, 1, 0]
+    assert [record.channel for record in events.query(channel=1)] == [1, 1]
+    assert events.query("VideoMotion", 3) == []
+    assert events.count("VideoMotion", 1) == 2
+
+
+def test_query_time_range_action_and_limit():
+    events = EventHistory()
+    # Recorded at 1000, 1001, ... 1009
+    for seq in range(10):
+        events.add(_event("VideoMotion", action="Stop" if seq % 2 else "Start"))
+
+    assert [record.time for record in events.query("VideoMotion", since=1003, until=1005)] == [1005, 1004, 1003]
+    assert [record.time for record in events.query("VideoMotion", since=1003, action="Stop")] == [1009, 1007, 1005,
+                                                                                                  1003]
+    assert [record.time for record in events.query("VideoMotion", until=1001.5)] == [1001, 1000]
+    assert [record.time for record in events.query("VideoMotion", limit=2)] == [1009, 1008]
+    assert events.count("VideoMotion", since=1008) == 2
+    assert events.count("VideoMotion", since=1004, action="Start") == 3
+    assert events.last("VideoMotion", 0).time == 1009
+    assert events.last("VideoMotion", 0, action="Start").time == 1008
+    assert events.last("AlarmLocal", 0) is None
+
+
+def test_clock_going_backwards(monkeypatch):
+    events = EventHistory()
+    events.add(_event("VideoMotion"))
+    monkeypatch.setattr(history.time, "time", lambda: 10.0)
+    events.add(_event("VideoMotion"))
+
+    assert [record.time for record in events.query("VideoMotion")] == [1000, 1000]
+    assert events.count("VideoMotion", since=1000) == 2
@@ -0,0 +1,182 @@
+"""Tests for the event journal."""
+import os
+
+import pytest
+
+from custom_components.dahua import journal
+from custom_components.dahua.journal import EventJournal, list_segments, read_segment
+from custom_components.dahua.models import DahuaEvent
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1600000000.0
+
+    def time(self):
+        return self.now
+
+
+class _TimerWheel:
+    """ Keeps the scheduled flushes, they run when the test writes the batch """
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, delay, callback, *args):
+        self.scheduled.append(callback)
+        return self
+
+    def cancel(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(journal, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def events(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(journal, "get_timer_wheel", lambda hass: _TimerWheel())
+    return EventJournal(None, str(tmp_path / "journal"))
+
+
+def _write_pending(events: EventJournal):
+    """ Writes the queued events like the executor job does """
+    batch = list(events._pending)
+    events._pending.clear()
+    events._write(batch)
+
+
+def _read_all(events: EventJournal):
+    return [record for name in list_segments(events._directory)
+            for record in read_segment(os.path.join(events._directory, name))]
+
+
+def test_round_trip(events, clock):
+    raw = '{\n   "Name" : "Driveway",\n   "Object" : { "ObjectType" : "Vehicle" }\n}\n'
+    streamed = DahuaEvent("CrossRegionDetection", 1, "Start", raw_data=raw)
+    decoded = DahuaEvent("VideoMotion", 0, "Stop", raw_data='{"Id": [0]}')
+    assert decoded.data == {"Id": [0]}
+    vto = DahuaEvent.from_vto_message({"Action": "Pulse", "Code": "DoorStatus", "Data": {"Status": "Open"}}, 0)
+
+    events.append("Camera", streamed)
+    events.append("Camera", decoded)
+    events.append("Doorbell", vto)
+    events.append("Camera", DahuaEvent("AlarmLocal", 2, "Start"))
+    # Queuing doesn't decode the data
+    assert streamed.raw_data() == raw
+    _write_pending(events)
+
+    assert _read_all(events) == [
+        [clock.now, "Camera", "CrossRegionDetection", "Start", 1,
+         {"Name": "Driveway", "Object": {"ObjectType": "Vehicle"}}],
+        [clock.now, "Camera", "VideoMotion", "Stop", 0, {"Id": [0]}],
+        [clock.now, "Doorbell", "DoorStatus", "Pulse", 0, {"Status": "Open"}],
+        [clock.now, "Camera", "AlarmLocal", "Start", 2, None],
+    ]
+    assert events.as_dict()["written"] == 4
+
+
+@pytest.mark.parametrize("raw", [
+    '{\n   "Name" : "Driveway",\n   "Object" : { "ObjectType" : "Veh',
+    "{broken",
+    "Heartbeat",
+    "1, 2]",
+    '"unterminated',
+])
+def test_malformed_raw_data_is_kept_as_text(events, clock, raw):
+    event = DahuaEvent("CrossRegionDetection", 0, "Start", raw_data=raw)
+    events.append("Camera", event)
+    events.append("Camera", DahuaEvent("CrossRegionDetection", 0, "Stop"))
+    _write_pending(events)
+
+    # Same as the data of the event: the text as received
+    assert _read_all(events) == [
+        [clock.now, "Camera", "CrossRegionDetection", "Start", 0, event.data],
+        [clock.now, "Camera", "CrossRegionDetection", "Stop", 0, None],
+    ]
+    assert event.data == raw
+
+
+def test_corrupt_record_is_skipped_with_a_warning(events, caplog):
+    events.append("Camera", DahuaEvent("VideoMotion", 0, "Start"))
+    events._write(list(events._pending), close=True)
+    path = os.path.join(events._directory, list_segments(events._directory)[0])
+    with open(path, "ab") as segment:
+        for payload in (b'[1,"Camera","VideoMotion","Stop",0,{broken]',
+                        journal._encode((2, "Camera", "VideoMotion", "Pulse", 0, None, None))):
+            segment.write(journal._LENGTH.pack(len(payload)) + payload)
+
+    # The records after it are read
+    assert [record[3] for record in read_segment(path)] == ["Start", "Pulse"]
+    assert "Skipped 1 corrupt records" in caplog.text
+
+
+def test_torn_record(events):
+    events.append("Camera", DahuaEvent("VideoMotion", 0, "Start"))
+    events.append("Camera", DahuaEvent("VideoMotion", 0, "Stop"))
+    events._write(list(events._pending), close=True)
+    path = os.path.join(events._directory, list_segments(events._directory)[0])
+    with open(path, "r+b") as segment:
+        segment.truncate(os.path.getsize(path) - 3)
+
+    assert [record[3] for record in read_segment(path)] == ["Start"]
+
+
+def test_rotation(events, clock, monkeypatch):
+    monkeypatch.setattr(journal, "SEGMENT_MAX_BYTES", 200)
+    for second in range(10):
+        clock.now += 1
+        events.append("Camera", DahuaEvent("VideoMotion", second, "Pulse"))
+        _write_pending(events)
+    # Rotated by size, a segment takes writes until it's over SEGMENT_MAX_BYTES: 4 records of 55 bytes
+    assert len(list_segments(events._directory)) == 3
+
+    monkeypatch.setattr(journal, "SEGMENT_MAX_BYTES", 1 << 20)
+    clock.now += journal.SEGMENT_MAX_SECONDS
+    events.append("Camera", DahuaEvent("VideoMotion", 10, "Pulse"))
+    _write_pending(events)
+    # And by age
+    segments = list_segments(events._directory)
+    assert len(segments) == 4
+    assert segments[-1] == "events-{0}.seg".format(int(clock.now * 1000))
+    # Oldest segment first, nothing lost on rotation
+    assert [record[4] for record in _read_all(events)] == list(range(11))
+
+
+def test_retention(events, clock, monkeypatch):
+    monkeypatch.setattr(journal, "SEGMENT_MAX_SECONDS", 10)
+    for hour in range(5):
+        events.append("Camera", DahuaEvent("VideoMotion", hour, "Pulse"))
+        _write_pending(events)
+        os.utime(events._segment_path, (clock.now, clock.now))
+        clock.now += 3600
+    assert len(list_segments(events._directory)) == 5
+
+    # By age, the current segment is always kept
+    monkeypatch.setattr(journal, "RETENTION_SECONDS", 3 * 3600 - 1)
+    events.append("Camera", DahuaEvent("VideoMotion", 5, "Pulse"))
+    _write_pending(events)
+    assert [record[4] for record in _read_all(events)] == [3, 4, 5]
+
+    # By size, the oldest go first
+    monkeypatch.setattr(journal, "RETENTION_BYTES", os.path.getsize(events._segment_path) * 2)
+    clock.now += journal.RETENTION_CHECK_SECONDS
+    events.append("Camera", DahuaEvent("VideoMotion", 6, "Pulse"))
+    _write_pending(events)
+    assert [record[4] for record in _read_all(events)] == [5, 6]
+
+
+def test_pending_is_bounded(events, monkeypatch):
+    monkeypatch.setattr(journal, "MAX_PENDING", 3)
+    monkeypatch.setattr(journal, "BATCH_SIZE", 10)
+    events._pending = journal.deque(maxlen=3)
+    for index in range(5):
+        events.append("Camera", DahuaEvent("VideoMotion", index, "Pulse"))
+    _write_pending(events)
+
+    assert [record[4] for record in _read_all(events)] == [2, 3, 4]
+    assert events.dropped == 2
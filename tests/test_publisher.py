@@ -0,0 +1,224 @@
+"""Tests for the event bus publisher and the payload projection."""
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.dahua import publisher
+from custom_components.dahua.models import DahuaEvent
+from custom_components.dahua.payload import PayloadProjector, parse_payload_fields
+from custom_components.dahua.publisher import (
+    BATCH_BUS_EVENT,
+    BUS_EVENT,
+    EventPublisher,
+    parse_publish_policies,
+)
+
+CROSS_LINE_DATA = {
+    "Name": "Door",
+    "Direction": "LeftToRight",
+    "UTC": 1620000000,
+    "Object": {"ObjectType": "Human", "ObjectID": 7, "BoundingBox": [1, 2, 3, 4]},
+    "DetectLine": [[0, 0], [100, 100]],
+    "Mask": list(range(32)),
+}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class _Bus:
+    def __init__(self):
+        self.fired = []
+
+    def async_fire(self, event_type, event_data):
+        self.fired.append((event_type, event_data))
+
+
+class _Handle:
+    def __init__(self, delay, callback, args):
+        self.delay = delay
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Loop:
+    """ Keeps the scheduled flushes, the test runs them """
+
+    def __init__(self):
+        self.handles = []
+
+    def call_soon(self, callback, *args):
+        return self.call_later(0, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        handle = _Handle(delay, callback, args)
+        self.handles.append(handle)
+        return handle
+
+    def run_pending(self):
+        handles, self.handles = self.handles, []
+        for handle in handles:
+            if not handle.cancelled:
+                handle.callback(*handle.args)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(publisher, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def hass():
+    return SimpleNamespace(bus=_Bus(), loop=_Loop())
+
+
+@pytest.fixture
+def event_publisher(hass, clock):
+    return EventPublisher(hass, lambda: "Front")
+
+
+def _event(code="VideoMotion", action="Start", channel=0, data=None):
+    return DahuaEvent(code, channel, action, data=data)
+
+
+def _fired(hass):
+    return [(data["Code"], data["action"], data["index"]) for event_type, data in hass.bus.fired
+            if event_type == BUS_EVENT]
+
+
+def test_immediate_is_the_default(event_publisher, hass):
+    event_publisher.publish(_event(action="Start"))
+    event_publisher.publish(_event(action="Start"))
+    event_publisher.publish(_event(action="Stop", channel=1))
+
+    assert _fired(hass) == [("VideoMotion", "Start", "0"), ("VideoMotion", "Start", "0"), ("VideoMotion", "Stop", "1")]
+    assert hass.bus.fired[0][1] == {"Code": "VideoMotion", "action": "Start", "index": "0", "name": "Front",
+                                    "DeviceName": "Front"}
+    assert event_publisher.as_dict()["codes"]["VideoMotion"]["published"] == 3
+
+
+def test_none_is_never_fired(event_publisher, hass):
+    event_publisher.set_policies(parse_publish_policies("IntelliFrame=none"))
+    event_publisher.publish(_event("IntelliFrame", "Pulse"))
+    event_publisher.publish(_event("VideoMotion", "Start"))
+
+    assert _fired(hass) == [("VideoMotion", "Start", "0")]
+    assert not event_publisher.publishes("IntelliFrame")
+    assert event_publisher.as_dict()["codes"]["IntelliFrame"]["not_published"] == 1
+
+
+def test_sample_fires_changes_and_throttles_repeats(event_publisher, hass, clock):
+    event_publisher.set_policies(parse_publish_policies("VideoMotionInfo=sample:2"))
+
+    event_publisher.publish(_event("VideoMotionInfo", "State"))
+    # Same action within half a second: dropped
+    clock.now += 0.4
+    event_publisher.publish(_event("VideoMotionInfo", "State"))
+    # Another channel is sampled on its own
+    event_publisher.publish(_event("VideoMotionInfo", "State", channel=1))
+    # A changed action is always fired
+    clock.now += 0.05
+    event_publisher.publish(_event("VideoMotionInfo", "Stop"))
+    event_publisher.publish(_event("VideoMotionInfo", "Stop"))
+    # Once the interval is over the same action is fired again
+    clock.now += 0.5
+    event_publisher.publish(_event("VideoMotionInfo", "Stop"))
+
+    assert _fired(hass) == [
+        ("VideoMotionInfo", "State", "0"),
+        ("VideoMotionInfo", "State", "1"),
+        ("VideoMotionInfo", "Stop", "0"),
+        ("VideoMotionInfo", "Stop", "0"),
+    ]
+    counters = event_publisher.as_dict()["codes"]["VideoMotionInfo"]
+    assert (counters["published"], counters["sampled_out"]) == (4, 2)
+
+
+def test_batch_fires_once_per_interval(event_publisher, hass):
+    event_publisher.set_policies(parse_publish_policies("*=batch:5, VideoMotion=batch"))
+    event_publisher.publish(_event("CrossLineDetection", "Pulse"))
+    event_publisher.publish(_event("VideoMotion", "Start"))
+    event_publisher.publish(_event("CrossLineDetection", "Pulse", channel=1))
+    event_publisher.publish(_event("VideoMotion", "Stop"))
+
+    assert hass.bus.fired == []
+    assert sorted(handle.delay for handle in hass.loop.handles) == [0, 5]
+    hass.loop.run_pending()
+
+    assert [event_type for event_type, _ in hass.bus.fired] == [BATCH_BUS_EVENT, BATCH_BUS_EVENT]
+    batches = sorted([(event["Code"], event["action"], event["index"]) for event in data["events"]]
+                     for _, data in hass.bus.fired)
+    assert batches == [
+        [("CrossLineDetection", "Pulse", "0"), ("CrossLineDetection", "Pulse", "1")],
+        [("VideoMotion", "Start", "0"), ("VideoMotion", "Stop", "0")],
+    ]
+    assert all(data["DeviceName"] == "Front" for _, data in hass.bus.fired)
+    assert event_publisher.as_dict()["codes"]["VideoMotion"]["batched"] == 2
+
+
+def test_stop_fires_the_waiting_batches(event_publisher, hass):
+    event_publisher.set_policies(parse_publish_policies("*=batch:60"))
+    event_publisher.publish(_event("VideoMotion", "Start"))
+    event_publisher.stop()
+
+    assert [(event_type, len(data["events"])) for event_type, data in hass.bus.fired] == [(BATCH_BUS_EVENT, 1)]
+    assert hass.loop.handles[0].cancelled
+    hass.loop.run_pending()
+    assert len(hass.bus.fired) == 1
+
+
+@pytest.mark.parametrize("text", ["VideoMotion", "=batch", "VideoMotion=often", "VideoMotion=none:1",
+                                  "VideoMotion=sample", "VideoMotion=sample:0", "VideoMotion=batch:-1"])
+def test_invalid_policies(text):
+    with pytest.raises(ValueError):
+        parse_publish_policies(text)
+
+
+@pytest.mark.parametrize("fields, slim_payloads, expected", [
+    # No projection: the data as is
+    ("", False, CROSS_LINE_DATA),
+    ("CrossLineDetection=all", True, CROSS_LINE_DATA),
+    # Slimmed: bulky lists dropped, short scalar lists kept, also nested
+    ("", True, {"Name": "Door", "Direction": "LeftToRight", "UTC": 1620000000,
+                "Object": {"ObjectType": "Human", "ObjectID": 7, "BoundingBox": [1, 2, 3, 4]}}),
+    ("CrossLineDetection=Name|Object.ObjectType|Missing|Object.Missing", False,
+     {"Name": "Door", "Object": {"ObjectType": "Human"}}),
+    # A parent forwarded as a whole wins over its fields
+    ("CrossLineDetection=Object|Object.ObjectType", False, {"Object": CROSS_LINE_DATA["Object"]}),
+    ("*=UTC", False, {"UTC": 1620000000}),
+    ("*=UTC, CrossLineDetection=Direction", False, {"Direction": "LeftToRight"}),
+])
+def test_projected_payload(event_publisher, hass, fields, slim_payloads, expected):
+    event_publisher.set_payload_projector(PayloadProjector(parse_payload_fields(fields), slim_payloads))
+    event_publisher.publish(_event("CrossLineDetection", "Pulse", data=CROSS_LINE_DATA))
+
+    event_data = hass.bus.fired[0][1]
+    assert event_data["data"] == expected
+    assert set(event_data) == {"Code", "action", "index", "data", "name", "DeviceName"}
+
+
+def test_projection_to_none_leaves_the_data_out(event_publisher, hass):
+    event_publisher.set_payload_projector(PayloadProjector(parse_payload_fields("CrossLineDetection=none")))
+    event_publisher.publish(_event("CrossLineDetection", "Pulse", data=CROSS_LINE_DATA))
+    event_publisher.publish(_event("VideoMotion", "Start", data={"Id": [0]}))
+
+    assert set(hass.bus.fired[0][1]) == {"Code", "action", "index", "name", "DeviceName"}
+    assert hass.bus.fired[1][1]["data"] == {"Id": [0]}
+
+
+@pytest.mark.parametrize("text", ["CrossLineDetection", "CrossLineDetection=", "CrossLineDetection=Name|",
+                                  "CrossLineDetection=Object..Type"])
+def test_invalid_payload_fields(text):
+    with pytest.raises(ValueError):
+        parse_payload_fields(text)
@@ -0,0 +1,108 @@
+"""Tests for the local event rules."""
+import pytest
+
+from custom_components.dahua.models import DahuaEvent
+from custom_components.dahua.rules import RULE_DROP, RuleEngine, parse_rules
+
+README_RULES = ("drop: Code=SmartMotionHuman & Object.Confidence<60; drop: Code=VideoMotion & hour<6; "
+                "Driveway Car: Code=CrossRegionDetection & Name=Driveway & Object.ObjectType=Vehicle")
+
+
+def _event(code="CrossRegionDetection", action="Start", index=0, **data):
+    return DahuaEvent(code, index, action, data=data)
+
+
+def test_parse_rules():
+    rules = parse_rules(README_RULES)
+
+    assert [rule.target for rule in rules] == [RULE_DROP, RULE_DROP, "Driveway Car"]
+    assert [rule.codes for rule in rules] == [("SmartMotionHuman",), ("VideoMotion",), ("CrossRegionDetection",)]
+    assert rules[0].drops and not rules[2].drops
+
+
+@pytest.mark.parametrize("text", ["", " ; ", None])
+def test_parse_rules_empty(text):
+    assert parse_rules(text) == []
+
+
+@pytest.mark.parametrize("text", [
+    "drop",
+    "drop:",
+    ": Code=VideoMotion",
+    "drop: Code",
+    "drop: Object.Confidence<high",
+    "drop: Name~[",
+    "Rule:Car: Code=VideoMotion",
+])
+def test_parse_rules_invalid(text):
+    with pytest.raises(ValueError):
+        parse_rules(text)
+
+
+@pytest.mark.parametrize("rule, event, expected", [
+    # Code, alternatives and negation
+    ("Car: Code=CrossRegionDetection", _event(), ["Car"]),
+    ("Car: Code=CrossLineDetection|CrossRegionDetection", _event(), ["Car"]),
+    ("Car: Code=CrossLineDetection", _event(), []),
+    ("Car: Name!=Driveway", _event(Name="Street"), ["Car"]),
+    ("Car: Name!=Driveway", _event(Name="Driveway"), []),
+    # Nested data fields, missing fields never match
+    ("Car: Object.ObjectType=Vehicle", _event(Object={"ObjectType": "Vehicle"}), ["Car"]),
+    ("Car: Object.ObjectType=Vehicle", _event(Object={"ObjectType": "Human"}), []),
+    ("Car: Object.ObjectType=Vehicle", _event(), []),
+    # Numbers, including numbers sent as text, and booleans
+    ("Big: Object.Confidence>=60", _event(Object={"Confidence": 60}), ["Big"]),
+    ("Big: Object.Confidence>60", _event(Object={"Confidence": 60}), []),
+    ("Big: Object.Confidence<60", _event(Object={"Confidence": "59.5"}), ["Big"]),
+    ("Big: Object.Confidence<60", _event(Object={"Confidence": "unknown"}), []),
+    ("Smart: SmartMotionEnable=true", _event(SmartMotionEnable=True), ["Smart"]),
+    # Regular expressions, action and index
+    ("Rule: Name~^Drive", _event(Name="Driveway"), ["Rule"]),
+    ("Rule: Name~^Drive", _event(Name="Front Driveway"), []),
+    ("Rule: action=Start & index=1", _event(index=1), ["Rule"]),
+    ("Rule: action=Start & index=1", _event(index=0), []),
+])
+def test_evaluate(rule, event, expected):
+    assert RuleEngine(parse_rules(rule)).evaluate(event) == expected
+
+
+def test_evaluate_drop():
+    engine = RuleEngine(parse_rules(README_RULES))
+
+    assert engine.evaluate(_event("SmartMotionHuman", Object={"Confidence": 40})) is None
+    assert engine.evaluate(_event("SmartMotionHuman", Object={"Confidence": 80})) == []
+    assert engine.evaluate(_event(Name="Driveway", Object={"ObjectType": "Vehicle"})) == ["Driveway Car"]
+    # No rule for this code
+    assert engine.evaluate(_event("AlarmLocal")) == []
+    assert engine.dropped == 1
+
+
+def test_evaluate_drop_first_match_wins():
+    engine = RuleEngine(parse_rules("Car: Code=VideoMotion; drop: Code=VideoMotion; Other: Code=VideoMotion"))
+
+    assert engine.evaluate(_event("VideoMotion")) is None
+
+
+def test_evaluate_rules_for_all_codes_keep_their_order():
+    engine = RuleEngine(parse_rules("First: index=0; Second: Code=VideoMotion; Third: action=Start"))
+
+    assert engine.evaluate(_event("VideoMotion")) == ["First", "Second", "Third"]
+    assert engine.evaluate(_event("AlarmLocal")) == ["First", "Third"]
+
+
+def test_drop_rules_never_drop_stop():
+    """ The Stop of a Start that was let through must get through, even if its data matches a drop rule """
+    engine = RuleEngine(parse_rules("drop: Code=CrossRegionDetection & Object.Confidence<60"))
+
+    assert engine.evaluate(_event(Object={"Confidence": 80})) == []
+    assert engine.evaluate(_event(action="Stop", Object={"Confidence": 0})) == []
+    assert engine.evaluate(_event(action="Pulse", Object={"Confidence": 0})) is None
+
+
+def test_sensor_rules_match_stop():
+    engine = RuleEngine(parse_rules("Driveway: Code=CrossRegionDetection & Name=Driveway"))
+
+    assert engine.evaluate(_event(action="Stop", Name="Driveway")) == ["Driveway"]
+    assert engine.sensor_names() == ["Driveway"]
+    assert engine.wants_code("CrossRegionDetection")
+    assert not engine.wants_code("VideoMotion")
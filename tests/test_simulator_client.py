@@ -0,0 +1,133 @@
+"""Tests for DahuaClient against the simulated device."""
+import asyncio
+
+import aiohttp
+import pytest
+
+from custom_components.dahua.client import DahuaClient
+from custom_components.dahua.digest import MAX_CHALLENGES
+from custom_components.dahua.dahua_utils import parse_event
+from tests.simulator import ACTION_START, DahuaSimulator, ScriptedEvent
+from tests.simulator.events import HEARTBEAT
+
+BOUNDARY = b"--myboundary\r\n"
+
+
+def _client(simulator: DahuaSimulator, session: aiohttp.ClientSession, password: str = "password") -> DahuaClient:
+    return DahuaClient("admin", password, simulator.host, simulator.http_port, 554, session)
+
+
+async def _wait_for(predicate, timeout: float = 5):
+    async def wait():
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+def _parse(chunks: list) -> list:
+    """ Parses the events of the stream one part at a time, like the device sends them, chunks can hold several """
+    parts = b"".join(chunks).split(BOUNDARY)
+    return [event for part in parts if part for event in parse_event((BOUNDARY + part).decode("utf-8"))]
+
+
+def test_config_round_trip():
+    asyncio.run(_async_test_config_round_trip())
+
+
+async def _async_test_config_round_trip():
+    async with DahuaSimulator() as simulator, aiohttp.ClientSession() as session:
+        client = _client(simulator, session)
+
+        assert await client.async_get_disarming_linkage() == {"table.DisableLinkage.Enable": "false"}
+        await client.async_set_disarming_linkage(0, True)
+        assert await client.async_get_disarming_linkage() == {"table.DisableLinkage.Enable": "true"}
+        assert simulator.state.config["DisableLinkage.Enable"] == "true"
+
+        await client.async_enabled_smart_motion_detection(False)
+        config = await client.async_get_config("SmartMotionDetect")
+        assert config["table.SmartMotionDetect[0].Enable"] == "false"
+        assert config["table.SmartMotionDetect[0].Sensitivity"] == "Middle"
+
+        # Every call is challenged once by digest authentication, then authorized
+        assert simulator.http.requests["configManager.setConfig"] == 2 * 2
+        assert simulator.http.requests["configManager.getConfig"] == 3 * 2
+
+
+def test_event_stream():
+    asyncio.run(_async_test_event_stream())
+
+
+async def _async_test_event_stream():
+    async with DahuaSimulator() as simulator, aiohttp.ClientSession() as session:
+        simulator.http.heartbeat_seconds = 0.05
+        chunks = []
+        connected = asyncio.Event()
+        stream = asyncio.ensure_future(_client(simulator, session).stream_events(
+            lambda data, channel: chunks.append(data), ["VideoMotion", "CrossLineDetection"], 0, connected.set))
+        try:
+            await asyncio.wait_for(connected.wait(), 5)
+            await _wait_for(lambda: HEARTBEAT in b"".join(chunks))
+
+            simulator.publish("VideoMotion", ACTION_START, data={"Id": [0]})
+            # Not asked for, so not sent
+            simulator.publish("NewFile")
+            await simulator.start_script(ScriptedEvent("CrossLineDetection", rate=50, action=ACTION_START, hold=0.01,
+                                                       count=2, data={"Object": {"ObjectType": "Human"}}))
+            await _wait_for(lambda: len(_parse(chunks)) == 5)
+        finally:
+            stream.cancel()
+
+        events = _parse(chunks)
+        assert [(event.code, event.action_name) for event in events] == [
+            ("VideoMotion", "Start"),
+            ("CrossLineDetection", "Start"),
+            ("CrossLineDetection", "Stop"),
+            ("CrossLineDetection", "Start"),
+            ("CrossLineDetection", "Stop"),
+        ]
+        assert events[0].data["Id"] == [0]
+        assert events[1].data["Object"] == {"ObjectType": "Human"}
+
+
+def test_401_storm():
+    asyncio.run(_async_test_401_storm())
+
+
+async def _async_test_401_storm():
+    async with DahuaSimulator() as simulator, aiohttp.ClientSession() as session:
+        client = _client(simulator, session)
+        await client.async_get_current_time()
+        # Every call is challenged once
+        assert simulator.http.unauthorized == 1
+
+        # A short storm is ridden out by answering the challenges again
+        simulator.faults.start_401_storm(MAX_CHALLENGES)
+        assert await client.async_get_current_time()
+        assert simulator.http.unauthorized == 1 + MAX_CHALLENGES
+
+        # A longer one fails the call after MAX_CHALLENGES
+        simulator.faults.start_401_storm(100)
+        with pytest.raises(aiohttp.ClientResponseError) as error:
+            await asyncio.wait_for(client.async_get_current_time(), 5)
+        assert error.value.status == 401
+        assert simulator.http.unauthorized == 1 + MAX_CHALLENGES + 1 + MAX_CHALLENGES
+
+        # Authorized again once the storm is over
+        simulator.faults.start_401_storm(0)
+        assert await client.async_get_current_time()
+
+
+def test_bad_credentials():
+    asyncio.run(_async_test_bad_credentials())
+
+
+async def _async_test_bad_credentials():
+    async with DahuaSimulator() as simulator, aiohttp.ClientSession() as session:
+        client = _client(simulator, session, password="wrong")
+
+        # The device keeps challenging, the request must end with the 401 instead of retrying forever
+        with pytest.raises(aiohttp.ClientResponseError) as error:
+            await asyncio.wait_for(client.async_get_current_time(), 5)
+        assert error.value.status == 401
+        assert simulator.http.unauthorized == 1 + MAX_CHALLENGES
@@ -0,0 +1,71 @@
+"""Tests for the connection supervisor."""
+import pytest
+
+from custom_components.dahua import supervisor
+from custom_components.dahua.supervisor import HISTORY_SIZE, ConnectionSupervisor
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(supervisor, "time", clock)
+    # No jitter: every delay is the upper bound
+    monkeypatch.setattr(supervisor.random, "uniform", lambda low, high: high)
+    return clock
+
+
+def test_history_records_the_delays_and_errors(clock):
+    link = ConnectionSupervisor("event_stream", base_delay=2, max_delay=5, stable_after=60)
+    assert link.disconnected(ConnectionError("Refused")) == 2
+    clock.now += 2
+    assert link.disconnected(TimeoutError("Timed out")) == 4
+    clock.now += 4
+    assert link.disconnected(ConnectionError("Refused")) == 5
+    clock.now += 5
+    link.connected()
+    clock.now += 60
+    # Closed cleanly after it was up long enough: reconnect right away
+    assert link.disconnected() == 0
+
+    assert link.as_dict()["history"] == [
+        {"time": 1000, "event": "disconnected", "delay": 2, "error": "ConnectionError: Refused"},
+        {"time": 1002, "event": "disconnected", "delay": 4, "error": "TimeoutError: Timed out"},
+        {"time": 1006, "event": "disconnected", "delay": 5, "error": "ConnectionError: Refused"},
+        {"time": 1011, "event": "connected", "delay": None, "error": None},
+        {"time": 1071, "event": "disconnected", "delay": 0, "error": None},
+    ]
+    assert link.as_dict()["last_error"] == "ConnectionError: Refused"
+
+
+def test_error_after_a_stable_connection_starts_the_backoff_over(clock):
+    link = ConnectionSupervisor("vto", base_delay=2, max_delay=120, stable_after=60)
+    for _ in range(3):
+        link.disconnected(ConnectionError("Refused"))
+    link.connected()
+    clock.now += 60
+
+    assert link.disconnected(ConnectionResetError("Reset")) == 2
+    assert link.history[-1] == (1060, "disconnected", 2, "ConnectionResetError: Reset")
+
+
+def test_history_is_bounded(clock):
+    link = ConnectionSupervisor("event_stream")
+    for attempt in range(HISTORY_SIZE + 5):
+        clock.now += 1
+        link.disconnected(ConnectionError(attempt))
+
+    history = link.as_dict()["history"]
+    assert len(history) == HISTORY_SIZE
+    assert history[0]["error"] == "ConnectionError: 5"
+    assert history[-1]["error"] == "ConnectionError: {0}".format(HISTORY_SIZE + 4)
@@ -0,0 +1,201 @@
+"""Tests for the event stream thread."""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.dahua import thread
+from custom_components.dahua.thread import OVERLAP_GRACE_SECONDS, OVERLAP_MAX_SECONDS, DahuaEventThread
+
+
+def _chunk(body: str) -> bytes:
+    """ An event as a chunk of the event stream """
+    return "--myboundary\r\nContent-Type: text/plain\r\nContent-Length:{0}\r\n\r\n{1}\r\n\r\n".format(
+        len(body), body).encode("utf-8")
+
+
+MOTION_START = _chunk("Code=VideoMotion;action=Start;index=0")
+MOTION_STOP = _chunk("Code=VideoMotion;action=Stop;index=0")
+CROSS_LINE = _chunk("Code=CrossLineDetection;action=Pulse;index=0")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class _Stream:
+    """ An event stream opened by the thread, the test delivers its chunks and accepts it """
+
+    def __init__(self, on_receive, events, on_connect):
+        self.on_receive = on_receive
+        self.events = events
+        self.on_connect = on_connect
+        self.cancelled = threading.Event()
+
+    def deliver(self, *chunks):
+        for chunk in chunks:
+            self.on_receive(chunk, 0)
+
+
+class _Client:
+    def __init__(self):
+        self.streams = []
+        self.error = None
+
+    async def stream_events(self, on_receive, events, channel, on_connect=None):
+        stream = _Stream(on_receive, events, on_connect)
+        self.streams.append(stream)
+        if self.error is not None:
+            raise self.error
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            stream.cancelled.set()
+            raise
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    runner = threading.Thread(target=loop.run_forever, daemon=True)
+    runner.start()
+    yield loop
+
+    async def cancel_streams():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(cancel_streams(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    runner.join(5)
+    loop.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(thread, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def client():
+    return _Client()
+
+
+@pytest.fixture
+def received():
+    return []
+
+
+@pytest.fixture
+def event_thread(loop, clock, client, received):
+    """ A thread streaming VideoMotion, without running it: the test plays the stream """
+    event_thread = DahuaEventThread(SimpleNamespace(loop=loop), client, lambda data, channel: received.append(data),
+                                    ["VideoMotion"], 0)
+    event_thread.started = True
+    event_thread._subscribe(event_thread.events, event_thread.supervisor.connected)
+    _wait_for(lambda: len(client.streams) == 1)
+    return event_thread
+
+
+def _wait_for(predicate, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.005)
+
+
+def _resubscribe(event_thread: DahuaEventThread, client: _Client, events: list):
+    """ Opens the new stream and returns the old and the new one, the new one isn't accepted yet """
+    old = client.streams[-1]
+    event_thread.resubscribe(events)
+    _wait_for(lambda: len(client.streams) == 2)
+    return old, client.streams[-1]
+
+
+def test_overlap_dispatches_each_event_once(event_thread, client, received):
+    old, new = _resubscribe(event_thread, client, ["VideoMotion", "CrossLineDetection"])
+
+    # Both streams deliver the same events, in any order, while they overlap
+    old.deliver(MOTION_START)
+    new.deliver(MOTION_START, CROSS_LINE)
+    old.deliver(CROSS_LINE, MOTION_STOP)
+    new.deliver(MOTION_STOP)
+
+    assert received == [MOTION_START, CROSS_LINE, MOTION_STOP]
+
+
+def test_overlap_counts_repeats_per_stream(event_thread, client, received):
+    """ Events without data are byte identical, the nth chunk of a stream is only a duplicate of the nth of the other """
+    old, new = _resubscribe(event_thread, client, ["VideoMotion", "CrossLineDetection"])
+
+    old.deliver(CROSS_LINE, CROSS_LINE)
+    new.deliver(CROSS_LINE, CROSS_LINE, CROSS_LINE)
+    old.deliver(CROSS_LINE)
+    new.deliver(CROSS_LINE)
+
+    assert received == [CROSS_LINE] * 4
+
+
+def test_repeats_after_the_overlap_are_dispatched(event_thread, client, clock, received):
+    old, new = _resubscribe(event_thread, client, ["VideoMotion", "CrossLineDetection"])
+    old.deliver(MOTION_START)
+    new.deliver(MOTION_START)
+    new.on_connect()
+
+    # The old stream might still flush during the grace period
+    clock.now += OVERLAP_GRACE_SECONDS / 2
+    old.deliver(MOTION_STOP)
+    new.deliver(MOTION_STOP)
+    assert received == [MOTION_START, MOTION_STOP]
+
+    clock.now += OVERLAP_GRACE_SECONDS
+    new.deliver(MOTION_START, MOTION_STOP)
+    assert received == [MOTION_START, MOTION_STOP, MOTION_START, MOTION_STOP]
+    assert event_thread._overlap_chunks is None
+
+
+def test_overlap_ends_if_the_new_stream_never_connects(event_thread, client, clock, received):
+    old, new = _resubscribe(event_thread, client, ["VideoMotion", "CrossLineDetection"])
+    old.deliver(MOTION_START)
+
+    clock.now += OVERLAP_MAX_SECONDS + 1
+    new.deliver(MOTION_START)
+    assert received == [MOTION_START, MOTION_START]
+
+
+def test_old_stream_is_aborted_once_the_new_one_connects(event_thread, client):
+    old_future = event_thread._future
+    old, new = _resubscribe(event_thread, client, ["VideoMotion", "CrossLineDetection"])
+    new_future = event_thread._future
+    # Make before break: the old stream stays current until the device accepted the new one
+    assert new_future is old_future
+    assert not old.cancelled.is_set()
+
+    new.on_connect()
+
+    assert old_future.cancelled()
+    assert old.cancelled.wait(5)
+    assert event_thread._future is not old_future and not event_thread._future.done()
+    assert not new.cancelled.is_set()
+    assert new.events == ["VideoMotion", "CrossLineDetection"]
+
+
+def test_failed_resubscribe_keeps_the_old_stream(event_thread, client, received):
+    old_future = event_thread._future
+    client.error = ConnectionError("Refused")
+    old, new = _resubscribe(event_thread, client, ["VideoMotion", "CrossLineDetection"])
+    _wait_for(lambda: event_thread._overlap_chunks is None)
+
+    assert event_thread._future is old_future and not old_future.done()
+    old.deliver(MOTION_START, MOTION_START)
+    assert received == [MOTION_START, MOTION_START]
@@ -0,0 +1,217 @@
+"""Tests for the timer wheel."""
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.dahua import timer_wheel
+from custom_components.dahua.timer_wheel import TimerWheel
+
+SIZE = 8
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 500.0
+
+    def monotonic(self):
+        return self.now
+
+
+class _Handle:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Loop:
+    """ Keeps the wake up the wheel asked for, the test advances the wheel itself """
+
+    def __init__(self):
+        self.handles = []
+
+    def time(self):
+        return 0.0
+
+    def call_at(self, when, callback):
+        handle = _Handle()
+        self.handles.append(handle)
+        return handle
+
+    @property
+    def armed(self) -> bool:
+        return bool(self.handles) and not self.handles[-1].cancelled
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(timer_wheel, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def loop():
+    return _Loop()
+
+
+@pytest.fixture
+def wheel(clock, loop):
+    return TimerWheel(SimpleNamespace(loop=loop), tick=1.0, size=SIZE)
+
+
+class _Expiry:
+    """ Expires keys like the coordinator expires events: one timer per key, replaced when it's rescheduled """
+
+    def __init__(self, wheel: TimerWheel, clock: _Clock):
+        self._wheel = wheel
+        self._clock = clock
+        self.timers = {}
+        self.fired = []
+
+    def schedule(self, key, delay):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[key] = self._wheel.schedule(delay, self._expire, key)
+
+    def _expire(self, key):
+        self.timers.pop(key, None)
+        self.fired.append((key, self._clock.now))
+
+
+def _run_until(wheel: TimerWheel, clock: _Clock, until: float, step: float = 1.0):
+    """ Wakes the wheel up every step seconds like the loop does """
+    while clock.now < until:
+        clock.now = min(clock.now + step, until)
+        wheel._advance()
+
+
+@pytest.mark.parametrize("delay, fires_at", [
+    (0.2, 501),
+    (1, 501),
+    (2.5, 503),
+    # Further out than one rotation of the wheel, the timer waits in its slot for the right round
+    (SIZE, 500 + SIZE),
+    (SIZE + 1, 501 + SIZE),
+    (SIZE * 3 + 2.5, 503 + SIZE * 3),
+])
+def test_fires_on_the_tick_it_is_due(wheel, clock, delay, fires_at):
+    expiry = _Expiry(wheel, clock)
+    expiry.schedule("VideoMotion", delay)
+
+    _run_until(wheel, clock, fires_at - 1)
+    assert expiry.fired == []
+    _run_until(wheel, clock, fires_at + SIZE * 2)
+    assert expiry.fired == [("VideoMotion", fires_at)]
+    assert len(wheel) == 0
+
+
+def test_timers_sharing_a_slot_fire_in_their_own_round(wheel, clock):
+    expiry = _Expiry(wheel, clock)
+    for round_ in range(4):
+        expiry.schedule(round_, 2 + SIZE * round_)
+
+    _run_until(wheel, clock, 500 + SIZE * 4)
+    assert expiry.fired == [(round_, 502 + SIZE * round_) for round_ in range(4)]
+
+
+def test_late_wake_up_catches_up(wheel, clock):
+    expiry = _Expiry(wheel, clock)
+    expiry.schedule("first", 1)
+    expiry.schedule("second", 3)
+    expiry.schedule("next round", SIZE + 3)
+    expiry.schedule("later", SIZE * 2 + 3)
+
+    # The loop was busy for more than a rotation
+    clock.now += SIZE + 4
+    wheel._advance()
+    # All due timers fired in this one pass, those of a slot in no particular order
+    assert {key for key, _ in expiry.fired} == {"first", "second", "next round"}
+    assert len(wheel) == 1
+
+    _run_until(wheel, clock, 503 + SIZE * 2)
+    assert expiry.fired[-1] == ("later", 503 + SIZE * 2)
+
+
+def test_cancelled_timers_do_not_fire(wheel, clock, loop):
+    fired = []
+    first = wheel.schedule(2, fired.append, "first")
+    wrapped = wheel.schedule(2 + SIZE, fired.append, "wrapped")
+    kept = wheel.schedule(2, fired.append, "kept")
+    assert loop.armed
+
+    first.cancel()
+    wrapped.cancel()
+    # Cancelling twice is fine
+    first.cancel()
+    assert len(wheel) == 1
+
+    _run_until(wheel, clock, 500 + SIZE * 3)
+    assert fired == ["kept"]
+    kept.cancel()
+    assert len(wheel) == 0
+
+
+def test_cancel_from_the_callback_of_another_timer(wheel, clock):
+    fired = []
+    victim = wheel.schedule(3, fired.append, "victim")
+    wheel.schedule(3, lambda: victim.cancel() or fired.append("killer"))
+
+    _run_until(wheel, clock, 510)
+    # Both are in the same slot, the victim fires only if it came first
+    assert "killer" in fired
+    assert fired.count("victim") == (1 if fired[0] == "victim" else 0)
+    assert len(wheel) == 0
+
+
+def test_rescheduling_a_key_replaces_its_timer(wheel, clock):
+    expiry = _Expiry(wheel, clock)
+    expiry.schedule("VideoMotion", 3)
+    _run_until(wheel, clock, 502)
+    # Extended before it expired, also to the same slot one rotation later
+    expiry.schedule("VideoMotion", 1 + SIZE)
+    expiry.schedule("CrossLineDetection", 5)
+    expiry.schedule("CrossLineDetection", 2)
+    assert len(wheel) == 2
+
+    _run_until(wheel, clock, 520)
+    assert expiry.fired == [("CrossLineDetection", 504), ("VideoMotion", 503 + SIZE)]
+    assert expiry.timers == {}
+
+
+def test_wakes_up_only_while_timers_are_pending(wheel, clock, loop):
+    assert not loop.armed
+    timer = wheel.schedule(5, lambda: None)
+    assert loop.armed
+    timer.cancel()
+    assert not loop.armed
+
+    wheel.schedule(1, lambda: None)
+    _run_until(wheel, clock, 501)
+    assert len(wheel) == 0
+    wakeups = len(loop.handles)
+    _run_until(wheel, clock, 510)
+    assert len(loop.handles) == wakeups
+
+
+def test_failing_callback_does_not_stop_the_wheel(wheel, clock):
+    fired = []
+    wheel.schedule(1, lambda: 1 / 0)
+    wheel.schedule(1, fired.append, "ok")
+
+    _run_until(wheel, clock, 502)
+    assert fired == ["ok"]
+
+
+def test_stop(wheel, clock, loop):
+    fired = []
+    timer = wheel.schedule(1, fired.append, "stopped")
+    wheel.stop()
+
+    assert len(wheel) == 0
+    assert not loop.armed
+    _run_until(wheel, clock, 510)
+    assert fired == []
+    timer.cancel()
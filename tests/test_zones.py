@@ -0,0 +1,131 @@
+"""Tests for the spatial zones."""
+import pytest
+
+from custom_components.dahua.models import DahuaEvent
+from custom_components.dahua.zones import GRID_SIZE, SpatialZoneIndex, parse_spatial_zones
+
+SQUARE = ((1000, 1000), (2000, 1000), (2000, 2000), (1000, 2000))
+TRIANGLE = ((1000, 1000), (3000, 1000), (1000, 3000))
+GATE = ((4096, 0), (4096, 8191))
+DIAGONAL = ((0, 0), (8191, 8191))
+
+
+def _event(*objects):
+    return DahuaEvent("CrossRegionDetection", 0, "Start", data={"Objects": list(objects)})
+
+
+def _center(x, y):
+    return {"Center": [x, y]}
+
+
+def _box(left, top, right, bottom):
+    return {"BoundingBox": [left, top, right, bottom]}
+
+
+@pytest.mark.parametrize("zone, obj, expected", [
+    # Centers inside, outside and on the edges of a square, edges belong to the zone on their left or top side
+    (SQUARE, _center(1500, 1500), True),
+    (SQUARE, _center(500, 1500), False),
+    (SQUARE, _center(1500, 2500), False),
+    (SQUARE, _center(1000, 1500), True),
+    (SQUARE, _center(1500, 1000), True),
+    (SQUARE, _center(2000, 1500), False),
+    (SQUARE, _center(1500, 2000), False),
+    # Inside the bounds of a triangle isn't enough
+    (TRIANGLE, _center(1500, 1500), True),
+    (TRIANGLE, _center(2900, 2900), False),
+    (TRIANGLE, _center(1999, 1999), True),
+    (TRIANGLE, _center(2001, 2001), False),
+    # Polygons use the center, the center of the box when the object has none
+    (SQUARE, _box(1200, 1200, 1800, 1800), True),
+    (SQUARE, _box(1800, 1800, 3000, 3000), False),
+    (SQUARE, dict(_box(0, 0, 1200, 1200), Center=[1100, 1100]), True),
+    # Boxes crossing a line and missing it, lines need a box
+    (GATE, _box(4000, 100, 4200, 300), True),
+    (GATE, _box(4096, 100, 4200, 300), True),
+    (GATE, _box(3000, 100, 4000, 300), False),
+    (GATE, _center(4096, 200), False),
+    (DIAGONAL, _box(3000, 2000, 5000, 4000), True),
+    (DIAGONAL, _box(1000, 3000, 2000, 4000), False),
+])
+def test_match(zone, obj, expected):
+    index = SpatialZoneIndex({"Zone": zone})
+
+    assert index.match(_event(obj)) == (["Zone"] if expected else [])
+
+
+def test_match_shared_edge():
+    """ An object on the edge shared by two zones is only in one of them """
+    index = SpatialZoneIndex({"Left": ((0, 0), (4096, 0), (4096, 8191), (0, 8191)),
+                              "Right": ((4096, 0), (8191, 0), (8191, 8191), (4096, 8191))})
+
+    assert index.match(_event(_center(4096, 100))) == ["Right"]
+
+
+@pytest.mark.parametrize("obj", [
+    _center(100, 100),
+    _center(8100, 8100),
+    _center(8100, 100),
+    _center(4096, 4096),
+])
+def test_match_zone_spanning_cells(obj):
+    """ A zone covering the whole space is listed in every cell """
+    index = SpatialZoneIndex({"All": ((0, 0), (8191, 0), (8191, 8191), (0, 8191))})
+
+    assert all(index._cells[cell] for cell in range(GRID_SIZE * GRID_SIZE))
+    assert index.match(_event(obj)) == ["All"]
+
+
+def test_match_line_through_cells_away_from_center():
+    """ A box is matched against the zones of every cell it covers, not only the cell of its center """
+    index = SpatialZoneIndex({"Gate": ((8000, 0), (8000, 8191))})
+
+    assert index.match(_event(_box(100, 100, 8100, 400))) == ["Gate"]
+
+
+def test_match_objects_in_configured_order():
+    index = SpatialZoneIndex({"Square": SQUARE, "Gate": GATE, "Triangle": TRIANGLE})
+    event = _event(_box(4000, 100, 4200, 300), _center(1500, 1500), _center(6000, 6000))
+
+    assert index.match(event) == ["Square", "Gate", "Triangle"]
+    assert index.as_dict() == {"evaluated": 1, "zones": {"Square": {"line": False, "matches": 1},
+                                                         "Gate": {"line": True, "matches": 1},
+                                                         "Triangle": {"line": False, "matches": 1}}}
+
+
+@pytest.mark.parametrize("data", [
+    {},
+    {"Objects": "none"},
+    {"Objects": [None, {"ObjectType": "Human"}]},
+    {"Object": {"ObjectType": "Human"}},
+])
+def test_match_without_positions(data):
+    index = SpatialZoneIndex({"Square": SQUARE})
+
+    assert index.match(DahuaEvent("CrossRegionDetection", 0, "Start", data=data)) == []
+
+
+def test_match_single_object():
+    index = SpatialZoneIndex({"Square": SQUARE})
+
+    assert index.match(DahuaEvent("SmartMotionHuman", 0, "Start", data={"Object": _center(1500, 1500)})) == ["Square"]
+
+
+def test_parse_spatial_zones():
+    assert parse_spatial_zones("Driveway=0,4000 8191,4000 8191,8191 0,8191; Gate=4096,0 4096,8191;") == {
+        "Driveway": ((0, 4000), (8191, 4000), (8191, 8191), (0, 8191)),
+        "Gate": ((4096, 0), (4096, 8191)),
+    }
+
+
+@pytest.mark.parametrize("text", [
+    "Driveway",
+    "=0,0 1,1",
+    "Gate=4096,0",
+    "Gate=4096 4096,8191",
+    "Gate=4096,0 4096,8192",
+    "Gate=a,0 4096,8191",
+])
+def test_parse_spatial_zones_invalid(text):
+    with pytest.raises(ValueError):
+        parse_spatial_zones(text)